@@ -1,9 +1,34 @@
 # -*- coding: utf-8 -*-
 
-"""Top-level package for exiobase_v3.3x."""
+"""Top-level package for exiobase_v3.3x.
+
+Submodules are imported when they are first used, e.g. pySUTtoIO.main,
+so importing the package, or a single module such as pySUTtoIO.cli, does
+not load numpy, scipy and every model module. The module __getattr__
+(PEP 562) needs Python 3.7, see python_requires in setup.py.
+"""
+
+import importlib
 
 __author__ = """Franco Donati"""
 __email__ = 'f.donati@cml.leidenuniv.nl'
 __version__ = '0.1.0'
 
-from pySUTtoIO import main
\ No newline at end of file
+_submodules = ('aggregation', 'balance', 'batch', 'benchmark', 'bundle',
+               'characterization', 'cli', 'dimensions', 'disk_cache',
+               'instrumentation', 'labels', 'leontief', 'main',
+               'make_ramascene_data', 'matrix_inverter',
+               'read_msut_exiobase', 'scenarios', 'secondary_flows', 'sut',
+               'table_reader', 'tools', 'transformation_model_0',
+               'transformation_model_b', 'writer')
+
+
+def __getattr__(name):
+    if name in _submodules:
+        return importlib.import_module('.' + name, __name__)
+    raise AttributeError('module {!r} has no attribute {!r}'.format(
+        __name__, name))
+
+
+def __dir__():
+    return sorted(list(globals()) + list(_submodules))
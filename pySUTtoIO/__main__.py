@@ -0,0 +1,4 @@
+import sys
+from pySUTtoIO.cli import main
+
+sys.exit(main())
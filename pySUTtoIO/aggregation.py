@@ -0,0 +1,295 @@
+"""
+Aggregation of multi-regional supply-use and input-output tables with
+concordances of products, industries, countries and final demand
+categories, e.g. data/auxiliary/prd_aggregation.txt which maps the 200
+EXIOBASE products to 17 groups.
+
+A concordance is kept as the group number of each detailed category. Dense
+matrices are aggregated with segment sums (np.add.reduceat over the
+categories sorted by group), sparse matrices with a sparse aggregation
+operator; a dense concordance matrix is never built. Coefficients such as
+A, L and B are aggregated weighted with total output.
+"""
+import os.path
+import numpy as np
+import scipy.sparse as sp
+import pySUTtoIO.tools as tl
+import pySUTtoIO.sut as st
+import pySUTtoIO.dimensions as dm
+
+default_product_concordance = os.path.join('data', 'auxiliary',
+                                           'prd_aggregation.txt')
+
+
+class Concordance:
+    """Mapping of detailed categories to groups. The groups are numbered in
+    the order of their first appearance."""
+
+    def __init__(self, groups):
+        """
+        :param groups: list
+                The group of each detailed category, in the order of the
+                categories
+        """
+        names = {}
+        codes = [names.setdefault(group, len(names)) for group in groups]
+        self._init(np.array(codes, dtype=np.intp), list(names))
+
+    def _init(self, codes, names):
+        self.codes = codes
+        self.codes.flags.writeable = False
+        self.names = names
+        counts = np.bincount(codes, minlength=len(names))
+        # start of each group among the categories sorted by group
+        self._starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+        self._sorted = bool(np.all(np.diff(codes) >= 0))
+        self._order = None if self._sorted else \
+            np.argsort(codes, kind='stable')
+
+    @classmethod
+    def from_codes(cls, codes, names):
+        """Creates a concordance from group numbers, every group must have
+        at least one category."""
+        concordance = cls.__new__(cls)
+        concordance._init(np.asarray(codes, dtype=np.intp), list(names))
+        return concordance
+
+    @classmethod
+    def identity(cls, size):
+        """Concordance that keeps every category, with None as names."""
+        return cls.from_codes(np.arange(size), [None] * size)
+
+    @classmethod
+    def from_file(cls, filename=default_product_concordance, codes=None,
+                  delimiter='\t'):
+        """
+        Reads a concordance file with a category code and a group on each
+        line, such as prd_aggregation.txt.
+
+        :param codes: list, optional
+                The codes of the categories in the order of the table, by
+                default the order of the file
+        """
+        rows = [row for row in tl.csv_file_to_list(filename, delimiter)
+                if row]
+        if codes is None:
+            return cls([row[1] for row in rows])
+        group_of = {row[0]: row[1] for row in rows}
+        return cls([group_of[code] for code in codes])
+
+    @property
+    def size(self):
+        """Number of detailed categories."""
+        return len(self.codes)
+
+    @property
+    def group_cnt(self):
+        return len(self.names)
+
+    @property
+    def is_identity(self):
+        return self.size == self.group_cnt and self._sorted
+
+    def operator(self, dtype=np.float64):
+        """
+        :return: scipy sparse matrix
+                Groups by categories matrix with a one for each category in
+                its group
+        """
+        return sp.csr_matrix((np.ones(self.size, dtype=dtype),
+                              (self.codes, np.arange(self.size))),
+                             shape=(self.group_cnt, self.size))
+
+    def sum_rows(self, matrix):
+        """Sums the rows of each group."""
+        if self.is_identity:
+            return matrix
+        if sp.issparse(matrix):
+            return self.operator(matrix.dtype) @ matrix
+        if self._order is not None:
+            matrix = np.take(matrix, self._order, axis=0)
+        return np.add.reduceat(matrix, self._starts, axis=0)
+
+    def sum_columns(self, matrix):
+        """Sums the columns of each group."""
+        if self.is_identity:
+            return matrix
+        if sp.issparse(matrix):
+            return matrix @ self.operator(matrix.dtype).T
+        if self._order is not None:
+            matrix = np.take(matrix, self._order, axis=1)
+        return np.add.reduceat(matrix, self._starts, axis=1)
+
+    def sum_vector(self, vector):
+        return np.bincount(self.codes, weights=vector,
+                           minlength=self.group_cnt)
+
+    def mean_columns(self, matrix, weights):
+        """
+        Weighted mean of the columns of each group, the columns of groups
+        with a zero total weight are zero.
+        """
+        if self.is_identity:
+            return matrix
+        if sp.issparse(matrix):
+            weighted = matrix @ sp.diags(weights)
+        else:
+            weighted = matrix * np.reshape(weights, (1, -1))
+        return tl.inv_scale_columns(self.sum_columns(weighted),
+                                    self.sum_vector(weights))
+
+
+def regroup_final_demand(Y, fd_cnt, groups=None):
+    """
+    Collapses, selects or regroups the final demand categories of each
+    country. The columns are reshaped to (products, countries, categories)
+    without copying, and the categories are reduced in one operation.
+
+    :param Y: numpy array
+            Final demand with fd_cnt columns per country, country by country
+    :param fd_cnt: int
+            Number of final demand categories per country
+    :param groups: list, optional
+            Lists of category positions, one list per new column of each
+            country, e.g. [[0], [1, 2]] keeps the first category and adds
+            up the second and third. By default all categories of a
+            country are added up.
+    :return: numpy array
+            One column per group of each country, country by country
+    """
+    view = np.reshape(Y, (Y.shape[0], -1, fd_cnt))
+    if groups is None:
+        return np.sum(view, axis=2, dtype=np.float64)
+    grouping = np.zeros((fd_cnt, len(groups)))
+    for column, positions in enumerate(groups):
+        grouping[list(positions), column] = 1
+    return np.reshape(view @ grouping, (Y.shape[0], -1))
+
+
+def multiregional(countries, sectors):
+    """
+    Concordance of the rows or columns of a multi-regional table, country
+    by country, from a concordance of the countries and one of the products,
+    industries or final demand categories. The groups are ordered country
+    group by country group.
+    """
+    codes = countries.codes[:, None] * sectors.group_cnt + \
+        sectors.codes[None, :]
+    names = [(country, sector) for country in countries.names
+             for sector in sectors.names]
+    return Concordance.from_codes(codes.ravel(), names)
+
+
+class Aggregation:
+    """Aggregation of the tables of one set of dimensions. Concordances
+    that are not given keep the categories as they are."""
+
+    def __init__(self, dimensions, products=None, industries=None,
+                 countries=None, finaluses=None):
+        """
+        :param dimensions: Dimensions
+                Dimensions of the detailed tables
+        :param products: Concordance, optional
+                Groups of the products of a country
+        :param industries: Concordance, optional
+        :param countries: Concordance, optional
+        :param finaluses: Concordance, optional
+                Groups of the final demand categories of a country
+        """
+        self.countries = countries or Concordance.identity(
+            dimensions.cntr_cnt)
+        self.products = products or Concordance.identity(dimensions.prd_cnt)
+        self.industries = industries or Concordance.identity(
+            dimensions.ind_cnt)
+        self.finaluses = finaluses or Concordance.identity(dimensions.fd_cnt)
+        assert self.countries.size == dimensions.cntr_cnt
+        assert self.products.size == dimensions.prd_cnt
+        assert self.industries.size == dimensions.ind_cnt
+        assert self.finaluses.size == dimensions.fd_cnt
+        self.detailed = dimensions
+        self.dimensions = dm.Dimensions(
+            self.countries.group_cnt, self.products.group_cnt,
+            self.industries.group_cnt, self.finaluses.group_cnt)
+        self.product_rows = multiregional(self.countries, self.products)
+        self.industry_columns = multiregional(self.countries,
+                                              self.industries)
+        self.finaluse_columns = multiregional(self.countries,
+                                              self.finaluses)
+
+    def supply_use(self, matrix):
+        """Aggregates a supply or use matrix (products x industries)."""
+        return self.industry_columns.sum_columns(
+            self.product_rows.sum_rows(matrix))
+
+    def final_use(self, matrix):
+        return self.finaluse_columns.sum_columns(
+            self.product_rows.sum_rows(matrix))
+
+    def industry_extensions(self, matrix):
+        """Aggregates the columns of extensions or factor inputs by
+        industry."""
+        return self.industry_columns.sum_columns(matrix)
+
+    def transactions(self, Z):
+        """Aggregates a product by product transaction matrix."""
+        return self.product_rows.sum_columns(self.product_rows.sum_rows(Z))
+
+    def coefficients(self, A, x):
+        """
+        Aggregates a product by product coefficient matrix, such as A or L,
+        weighted with the total output x of the products.
+        """
+        return self.product_rows.mean_columns(self.product_rows.sum_rows(A),
+                                              x)
+
+    def extension_coefficients(self, B, x):
+        """Aggregates the columns of extension or factor input coefficients
+        by product, weighted with the total output x."""
+        return self.product_rows.mean_columns(B, x)
+
+    def _labels(self, labels, concordance, sector_cnt):
+        if labels is None:
+            return None
+        countries = self.countries.names
+        if self.countries.is_identity:
+            countries = [labels[idx * sector_cnt][0]
+                         for idx in range(self.detailed.cntr_cnt)]
+        if concordance.is_identity:
+            return [[country] + list(labels[idx][1:])
+                    for country in countries for idx in range(sector_cnt)]
+        return [[country, sector] for country in countries
+                for sector in concordance.names]
+
+    def sut(self, sut):
+        """
+        Aggregates a supply-use table, the result can be transformed like
+        any other Sut.
+
+        :return: Sut
+                The aggregated tables with the aggregated dimensions
+        """
+        assert sut.dimensions == self.detailed
+        aggregated = st.Sut(self.dimensions)
+        aggregated.supply = self.supply_use(sut.supply)
+        aggregated.use = self.supply_use(sut.use)
+        aggregated.final_use = self.final_use(sut.final_use)
+        aggregated.factor_inputs = self.industry_extensions(
+            sut.factor_inputs)
+        aggregated.extensions = self.industry_extensions(sut.extensions)
+        if sut.year is not None:
+            aggregated.year = sut.year
+        for attribute, concordance, sector_cnt in [
+                ('product_categories', self.products,
+                 self.detailed.prd_cnt),
+                ('industry_categories', self.industries,
+                 self.detailed.ind_cnt),
+                ('finaluse_categories', self.finaluses,
+                 self.detailed.fd_cnt)]:
+            labels = self._labels(getattr(sut, attribute), concordance,
+                                  sector_cnt)
+            if labels is not None:
+                setattr(aggregated, attribute, labels)
+        for attribute in ['factor_input_categories', 'extension_categories']:
+            if getattr(sut, attribute) is not None:
+                setattr(aggregated, attribute, getattr(sut, attribute))
+        return aggregated
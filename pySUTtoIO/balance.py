@@ -0,0 +1,82 @@
+import numpy as np
+
+
+class BalanceReport:
+    """The outcome of comparing two vectors that should be equal, e.g.
+    total output calculated in two different ways. All elements are
+    compared at once. An element violates the balance when the
+    difference is larger than rel_tol times the larger absolute value and
+    larger than abs_tol, as in math.isclose. A report evaluates to True
+    when there are no violations, so it can be used as a plain check."""
+
+    def __init__(self, name, expected, actual, rel_tol=0.0, abs_tol=0.0,
+                 labels=None):
+        """
+        :param name: str
+                Description of the check
+        :param expected: numpy array
+                Reference values
+        :param actual: numpy array
+                Values to be checked
+        :param rel_tol: float
+                Allowed relative difference
+        :param abs_tol: float
+                Allowed absolute difference
+        :param labels: list, optional
+                One label (e.g. [country, product]) for each element
+        """
+        # single precision values are compared in double precision, so the
+        # errors show the rounding of the single precision values
+        expected = np.asarray(expected, dtype=np.float64).ravel()
+        actual = np.asarray(actual, dtype=np.float64).ravel()
+        assert expected.shape == actual.shape
+        abs_error = np.abs(actual - expected)
+        scale = np.maximum(np.abs(actual), np.abs(expected))
+        rel_error = np.zeros(abs_error.shape)
+        np.divide(abs_error, scale, out=rel_error, where=scale != 0)
+        allowed = np.maximum(rel_tol * scale, abs_tol)
+        violating = ~(abs_error <= allowed)  # nan values are violations
+
+        self.name = name
+        self.rel_tol = rel_tol
+        self.abs_tol = abs_tol
+        self.size = len(expected)
+        self.max_abs_error = np.max(abs_error, initial=0)
+        self.max_rel_error = np.max(rel_error, initial=0)
+        self.indices = np.flatnonzero(violating)
+        self.expected = expected[self.indices]
+        self.actual = actual[self.indices]
+        self.abs_error = abs_error[self.indices]
+        self.rel_error = rel_error[self.indices]
+        if labels is None:
+            self.labels = None
+        else:
+            self.labels = [labels[idx] for idx in self.indices]
+
+    def __bool__(self):
+        return len(self.indices) == 0
+
+    def __str__(self):
+        return '{}: {} of {} values violate the balance, ' \
+               'maximum relative error {:.3g}'.format(
+                   self.name, len(self.indices), self.size,
+                   self.max_rel_error)
+
+    def to_list(self):
+        """
+        Returns the violations as a list of lists with a header row, to be
+        saved with tools.list_to_csv_file.
+
+        :return: list
+                One row per violation: index, label items, expected value,
+                actual value, absolute and relative error
+        """
+        rows = [['index', 'label', 'expected', 'actual', 'absolute error',
+                 'relative error']]
+        for pos, idx in enumerate(self.indices):
+            label = '' if self.labels is None else self.labels[pos]
+            if isinstance(label, (list, tuple)):
+                label = ' '.join(str(item) for item in label)
+            rows.append([idx, label, self.expected[pos], self.actual[pos],
+                         self.abs_error[pos], self.rel_error[pos]])
+        return rows
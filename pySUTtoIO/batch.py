@@ -0,0 +1,245 @@
+"""
+Scheduling of the transformation of many years. Each year is an
+independent job; jobs run concurrently in a pool of worker processes.
+The number of workers is limited by the available memory and every worker
+gets its own share of BLAS threads so workers do not oversubscribe cores.
+"""
+import collections
+import concurrent.futures
+import contextlib
+import multiprocessing
+import os
+import time
+import traceback
+import numpy as np
+import pySUTtoIO.bundle as bd
+import pySUTtoIO.dimensions as dm
+import pySUTtoIO.instrumentation as ins
+
+
+YearJob = collections.namedtuple('YearJob', ['year', 'data_dir', 'save_dir'])
+
+YearResult = collections.namedtuple('YearResult', ['year', 'status', 'seconds',
+                                                   'message'])
+
+# environment variables read by the common BLAS and OpenMP libraries when
+# they are loaded
+blas_thread_variables = ['OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS',
+                         'MKL_NUM_THREADS', 'VECLIB_MAXIMUM_THREADS',
+                         'NUMEXPR_NUM_THREADS']
+
+input_filenames = ['U.npy', 'V.npy', 'Y.npy', 'W.npy', 'M.npy']
+
+
+def available_memory():
+    """
+    Returns the memory in bytes that is available for new processes, or
+    None when it cannot be determined on this platform.
+    """
+    try:
+        with open('/proc/meminfo') as meminfo:
+            for line in meminfo:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    try:
+        return os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+def estimate_memory(data_dir):
+    """
+    Rough estimate of the peak memory in bytes needed to transform the
+    year in data_dir: twice the input arrays plus four product by product
+    matrices (A, its factorization, L and a temporary).
+    """
+    input_bytes = 0
+    product_cnt = 0
+    for filename in input_filenames:
+        full_fn = os.path.join(data_dir, filename)
+        if os.path.exists(full_fn):
+            input_bytes += os.path.getsize(full_fn)
+            if filename == 'V.npy':
+                product_cnt = np.load(full_fn, mmap_mode='r').shape[0]
+    full_fn = os.path.join(data_dir, bd.bundle_filename)
+    if os.path.exists(full_fn):
+        input_bytes += os.path.getsize(full_fn)
+        with bd.Bundle(full_fn) as bundle:
+            product_cnt = bundle.shape('V')[0]
+    return 2 * input_bytes + 4 * product_cnt * product_cnt * 8
+
+
+def outputs_valid(directory, filenames):
+    """
+    Checks whether all output files exist and are complete .npy files.
+    """
+    for filename in filenames:
+        try:
+            # memory mapping checks the header and the size of the data
+            np.load(os.path.join(directory, filename), mmap_mode='r')
+        except (OSError, ValueError):
+            return False
+    return True
+
+
+def worker_count(jobs, max_workers=None, memory_per_year=None):
+    """
+    Determines the number of worker processes: at most max_workers (by
+    default the number of cores), one per job and no more than fit in the
+    available memory.
+    """
+    workers = max_workers or os.cpu_count() or 1
+    workers = max(1, min(workers, len(jobs)))
+    available = available_memory()
+    if available is not None and len(jobs) > 0:
+        if memory_per_year is None:
+            memory_per_year = max(estimate_memory(job.data_dir)
+                                  for job in jobs)
+        if memory_per_year > 0:
+            workers = max(1, min(workers, available // memory_per_year))
+    return workers
+
+
+@contextlib.contextmanager
+def blas_threads_limit(threads):
+    """
+    Sets the BLAS thread count for processes started within this context.
+    """
+    previous = {name: os.environ.get(name) for name in blas_thread_variables}
+    for name in blas_thread_variables:
+        os.environ[name] = str(threads)
+    try:
+        yield
+    finally:
+        for name, value in previous.items():
+            if value is None:
+                del os.environ[name]
+            else:
+                os.environ[name] = value
+
+
+def trace_filename(trace_dir, year):
+    return os.path.join(trace_dir, 'trace_{}.json'.format(year))
+
+
+def _run_year(job, model, make_secondary, project, mmap_mode, trace_dir=None,
+              trace_memory=False, precision='double',
+              dimensions=dm.exiobase, cache_dir=None):
+    import pySUTtoIO.main as mn
+
+    start = time.perf_counter()
+    ins.logger.info('Reading multi-regional supply-use tables for year %s',
+                    job.year)
+    tracer = ins.Tracer(trace_memory) if trace_dir else ins.get_tracer()
+    try:
+        with ins.use(tracer), tracer.stage('year', year=job.year):
+            mn.launch_year(job.data_dir, model, job.save_dir, make_secondary,
+                           project, mmap_mode, precision, dimensions,
+                           cache_dir)
+    except Exception:
+        return YearResult(job.year, 'failed', time.perf_counter() - start,
+                          traceback.format_exc())
+    finally:
+        if trace_dir:
+            if not os.path.exists(trace_dir):
+                os.makedirs(trace_dir)
+            tracer.export(trace_filename(trace_dir, job.year))
+    return YearResult(job.year, 'done', time.perf_counter() - start, '')
+
+
+def run_years(jobs, model, make_secondary, project=0, max_workers=1,
+              resume=False, memory_per_year=None, blas_threads=None,
+              mmap_mode=None, trace_dir=None, trace_memory=False,
+              precision='double', dimensions=dm.exiobase, cache_dir=None):
+    """
+    Transforms the years described by jobs.
+
+    :param jobs: list
+            YearJob tuples with year, input directory and output directory
+    :param max_workers: int
+            Maximum number of concurrent years, None for one per core. With
+            one worker the years run in the current process.
+    :param resume: bool
+            Skip years of which all outputs already exist and are valid
+    :param memory_per_year: int, optional
+            Peak memory in bytes of one year, by default estimated from the
+            input files
+    :param blas_threads: int, optional
+            BLAS threads per worker, by default the cores divided over the
+            workers. It only applies to worker processes: with one worker
+            the years run in this process, of which BLAS is already loaded,
+            so set the BLAS thread variables before starting Python instead
+    :param mmap_mode: str, optional
+            Memory map the input files, see main.main
+    :param trace_dir: str, optional
+            Directory to save the stage timings of each year in, as
+            trace_<year>.json
+    :param trace_memory: bool
+            Also trace the peak memory of each stage
+    :param precision: str
+            'double' or 'single', see main.main
+    :param dimensions: Dimensions
+            Dimensions of the tables stored as .npy files
+    :param cache_dir: str, optional
+            Directory of the disk cache of derived matrices shared by the
+            years, see main.main
+    :return: list
+            YearResult tuples in the order of the jobs
+    """
+    import pySUTtoIO.main as mn
+
+    results = {}
+    todo = []
+    for job in jobs:
+        if resume and outputs_valid(job.save_dir,
+                                    mn.output_filenames[project]):
+            results[job.year] = YearResult(job.year, 'skipped', 0.0, '')
+        else:
+            todo.append(job)
+
+    workers = worker_count(todo, max_workers, memory_per_year)
+    if workers == 1:
+        for job in todo:
+            results[job.year] = _run_year(job, model, make_secondary, project,
+                                          mmap_mode, trace_dir, trace_memory,
+                                          precision, dimensions, cache_dir)
+    else:
+        if blas_threads is None:
+            blas_threads = max(1, (os.cpu_count() or 1) // workers)
+        # spawned workers load BLAS after the thread variables are set
+        context = multiprocessing.get_context('spawn')
+        with blas_threads_limit(blas_threads), \
+                concurrent.futures.ProcessPoolExecutor(
+                    workers, mp_context=context) as executor:
+            futures = {executor.submit(_run_year, job, model, make_secondary,
+                                       project, mmap_mode, trace_dir,
+                                       trace_memory, precision, dimensions,
+                                       cache_dir): job
+                       for job in todo}
+            for future in concurrent.futures.as_completed(futures):
+                job = futures[future]
+                try:
+                    results[job.year] = future.result()
+                except concurrent.futures.process.BrokenProcessPool:
+                    # a worker died, e.g. killed when out of memory; the
+                    # years of the pool that did not finish are failed
+                    results[job.year] = YearResult(
+                        job.year, 'failed', 0.0, traceback.format_exc())
+
+    return [results[job.year] for job in jobs]
+
+
+def format_summary(results):
+    """Table of the time spent on each year, with the errors of failed
+    years."""
+    lines = ['{:<8}{:<10}{:>12}'.format('year', 'status', 'seconds')]
+    for result in results:
+        lines.append('{:<8}{:<10}{:>12.1f}'.format(
+            result.year, result.status, result.seconds))
+        if result.status == 'failed':
+            lines.append(result.message)
+    lines.append('{:<18}{:>12.1f}'.format(
+        'total', sum(r.seconds for r in results)))
+    return '\n'.join(lines)
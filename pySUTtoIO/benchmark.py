@@ -0,0 +1,486 @@
+"""
+Benchmarks of the pipeline stages on synthetic supply-use tables.
+
+A balanced multi-regional supply-use table of a configurable size, from a
+toy table up to the full EXIOBASE dimensions, is generated and written as
+raw EXIOBASE text files. Each stage is then run and measured: the parsing
+by read_msut_exiobase, the secondary material reallocation by
+secondary_flows.make_secondary, every matrix of TransformationModelB, the
+Leontief factorization and inversion, the saving of the outputs and
+make_ramascene_data.
+
+For every stage the wall time, the peak of the memory allocated during
+the stage (tracemalloc, numpy reports its buffers) and the peak resident
+set size of the process so far are recorded. Results are saved as JSON
+baselines; a later run compared to a baseline reports every stage that
+became slower or used more memory than the tolerance allows.
+"""
+import collections
+import json
+import os
+import platform
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+import pySUTtoIO.sut as st
+import pySUTtoIO.dimensions as dm
+import pySUTtoIO.secondary_flows as sf
+import pySUTtoIO.transformation_model_b as mb
+import pySUTtoIO.read_msut_exiobase as rd
+import pySUTtoIO.make_ramascene_data as rama
+import pySUTtoIO.characterization as ch
+import pySUTtoIO.writer as wr
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+
+StageResult = collections.namedtuple('StageResult', [
+    'stage', 'status', 'seconds', 'peak_bytes', 'max_rss'])
+
+Regression = collections.namedtuple('Regression', [
+    'stage', 'metric', 'baseline', 'current', 'ratio'])
+
+# countries, products and industries per country, final demand categories
+# per country and extensions; all sizes have the EXIOBASE extensions, of
+# which make_ramascene_data selects rows
+sizes = {'toy': (2, 30, 25, 7, 1104),
+         'small': (5, 200, 163, 7, 1104),
+         'medium': (15, 200, 163, 7, 1104),
+         'exiobase': (49, 200, 163, 7, 1104)}
+
+model_stages = ['transformation_matrix', 'io_transaction_matrix',
+                'io_coefficient_matrix', 'ext_transaction_matrix',
+                'ext_coefficients_matrix', 'factor_inputs_transaction_matrix',
+                'factor_inputs_coefficients_matrix', 'leontief',
+                'io_total_requirement_matrix']
+
+stages = ['parse', 'secondary'] + model_stages + ['checks', 'save',
+                                                  'ramascene']
+
+# stages that run in a pool of worker processes: their peak memory only
+# covers the main process, their max RSS also the largest worker
+process_pool_stages = ['parse']
+
+# indicator file of the ramascene stage, found independent of the current
+# directory
+default_indicators = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    ch.default_indicators)
+
+# value added and employment rows of the EXIOBASE factor inputs
+value_added_cnt = 9
+factor_input_cnt = 23
+
+
+def _balance(matrix, row_totals, column_totals, iterations=20):
+    """Scales a positive matrix towards the row totals, the column totals
+    are met exactly (RAS). Empty rows stay empty."""
+    for _ in range(iterations):
+        row_sums = np.sum(matrix, axis=1)
+        scale = np.zeros(len(row_sums))
+        np.divide(row_totals, row_sums, out=scale, where=row_sums != 0)
+        matrix *= scale[:, None]
+        matrix *= column_totals / np.sum(matrix, axis=0)
+    return matrix
+
+
+def synthetic_sut(cntr_cnt, prd_cnt, ind_cnt, fd_cnt, ext_cnt, density=0.2,
+                  seed=0):
+    """
+    Creates a random supply-use table that is balanced: product supply
+    equals product use and industry output equals industry input. Every
+    industry mainly supplies one product of its own country. The first
+    product and industry codes are those of the secondary material pairs
+    of secondary_flows, so make_secondary finds them by code. As in
+    EXIOBASE the secondary material products are neither supplied nor
+    used: both industries of a pair supply the primary material, and the
+    table stays balanced when make_secondary moves the output of the
+    secondary material industry to the secondary material product.
+
+    :param density: float
+            Share of non-zero values of the use table besides the main
+            inputs
+    :return: Sut
+    """
+    rng = np.random.RandomState(seed)
+    prd_total = cntr_cnt * prd_cnt
+    ind_total = cntr_cnt * ind_cnt
+
+    # products and industries of the secondary material pairs alternate
+    # primary and secondary, see the codes below
+    pair_cnt = min(len(sf.default_code_pairs), prd_cnt // 2, ind_cnt // 2)
+    primary_products = np.concatenate(
+        [cntr_idx * prd_cnt + 2 * np.arange(pair_cnt)
+         for cntr_idx in range(cntr_cnt)])
+    secondary_products = primary_products + 1
+    secondary = np.zeros(prd_total, dtype=bool)
+    secondary[secondary_products] = True
+
+    supply = np.zeros((prd_total, ind_total))
+    main_products = np.arange(ind_cnt) * prd_cnt // ind_cnt
+    main_products[:2 * pair_cnt] = 2 * (np.arange(2 * pair_cnt) // 2)
+    for cntr_idx in range(cntr_cnt):
+        rows = cntr_idx * prd_cnt + main_products
+        columns = cntr_idx * ind_cnt + np.arange(ind_cnt)
+        supply[rows, columns] = rng.uniform(50, 150, ind_cnt)
+        # some secondary output within the country
+        block = supply[cntr_idx * prd_cnt:(cntr_idx + 1) * prd_cnt,
+                       cntr_idx * ind_cnt:(cntr_idx + 1) * ind_cnt]
+        block += rng.uniform(0, 5, block.shape) * \
+            (rng.uniform(size=block.shape) < density)
+    # the secondary material products are supplied as primary material
+    supply[primary_products] += supply[secondary_products]
+    supply[secondary_products] = 0
+    # products no industry supplies mainly
+    empty = (np.sum(supply, axis=1) == 0) & ~secondary
+    supply[empty, rng.randint(0, ind_total, np.sum(empty))] = \
+        rng.uniform(10, 50, np.sum(empty))
+
+    q = np.sum(supply, axis=1)
+    g = np.sum(supply, axis=0)
+    use = rng.uniform(0.1, 1, (prd_total, ind_total)) * \
+        (rng.uniform(size=(prd_total, ind_total)) < density)
+    use[secondary] = 0
+    # every product but the secondary materials and every industry has a
+    # use
+    rows = np.flatnonzero(~secondary)
+    pairs = np.arange(max(len(rows), ind_total))
+    use[rows[pairs % len(rows)], pairs % ind_total] += 1
+    # half of the output goes to intermediate use
+    use = _balance(use, 0.5 * q, 0.5 * g)
+
+    final_use = rng.uniform(0.1, 1, (prd_total, cntr_cnt * fd_cnt))
+    final_use[secondary] = 0
+    scale = np.zeros(prd_total)
+    np.divide(q - np.sum(use, axis=1), np.sum(final_use, axis=1),
+              out=scale, where=~secondary)
+    final_use *= scale[:, None]
+    value_added = g - np.sum(use, axis=0)
+    shares = rng.uniform(0.1, 1, (value_added_cnt, ind_total))
+    employment = rng.uniform(0, 1, (factor_input_cnt - value_added_cnt,
+                                    ind_total))
+    factor_inputs = np.vstack([shares / np.sum(shares, axis=0) * value_added,
+                               employment])
+
+    extensions = rng.uniform(0, 10, (ext_cnt, ind_total))
+
+    codes = [code for pair in sf.default_code_pairs for code in pair]
+    product_codes = [code for code in codes if code.startswith('C_')]
+    industry_codes = [code for code in codes if code.startswith('A_')]
+    countries = ['R{:02d}'.format(idx) for idx in range(cntr_cnt)]
+
+    def code(codes, prefix, idx):
+        return codes[idx] if idx < len(codes) else \
+            '{}{:03d}'.format(prefix, idx)
+
+    sut = st.Sut(dm.Dimensions(cntr_cnt, prd_cnt, ind_cnt, fd_cnt))
+    sut.supply = supply
+    sut.use = use
+    sut.final_use = final_use
+    sut.factor_inputs = factor_inputs
+    sut.extensions = extensions
+    sut.product_categories = [
+        [country, 'product {}'.format(idx), code(product_codes, 'C_', idx)]
+        for country in countries for idx in range(prd_cnt)]
+    sut.industry_categories = [
+        [country, 'industry {}'.format(idx), code(industry_codes, 'A_', idx)]
+        for country in countries for idx in range(ind_cnt)]
+    sut.finaluse_categories = [
+        [country, 'final use {}'.format(idx)]
+        for country in countries for idx in range(fd_cnt)]
+    sut.factor_input_categories = [
+        ['factor input {}'.format(idx), 'M.EUR']
+        for idx in range(factor_input_cnt)]
+    sut.extension_categories = [
+        ['extension {}'.format(idx), 'kg'] for idx in range(ext_cnt)]
+    return sut
+
+
+def write_raw_table(filename, values, row_labels, column_labels):
+    """Writes values as EXIOBASE text table with two header rows."""
+    with open(filename, 'w') as table:
+        for header_idx in range(2):
+            table.write('\t'.join([''] * len(row_labels[0]) +
+                                  [label[header_idx] for label in
+                                   column_labels]) + '\n')
+        for labels, row in zip(row_labels, values):
+            table.write('\t'.join(list(labels) +
+                                  [repr(value) for value in row.tolist()]) +
+                        '\n')
+
+
+def write_raw_year(raw_data_dir, yr_string, sut):
+    """
+    Writes a Sut as the raw EXIOBASE text files of one year, as read by
+    read_msut_exiobase. The extensions are split in emissions, materials
+    and resources.
+    """
+    year_dir = os.path.join(raw_data_dir, yr_string)
+    if not os.path.exists(year_dir):
+        os.makedirs(year_dir)
+    products = sut.product_categories
+    industries = [label[:2] for label in sut.industry_categories]
+    final_uses = sut.finaluse_categories
+    extensions = sut.extensions
+    split = np.array_split(np.arange(len(extensions)), 3)
+    tables = [('mrSupply', sut.supply, products, industries),
+              ('mrUse', sut.use, products, industries),
+              ('mrFinalDemand', sut.final_use, products, final_uses),
+              ('mrFactorInputs', sut.factor_inputs,
+               sut.factor_input_categories, industries)]
+    for prefix, rows, header_cnt in [('Emissions', split[0], 3),
+                                     ('Materials', split[1], 2),
+                                     ('Resources', split[2], 3)]:
+        labels = [['{} {}'.format(prefix, idx), 'kg', 'air'][:header_cnt]
+                  for idx in rows]
+        tables.append(('mr' + prefix, extensions[rows], labels, industries))
+        tables.append(('mrFD' + prefix,
+                       np.zeros((len(rows), len(final_uses))), labels,
+                       final_uses))
+    for prefix, values, row_labels, column_labels in tables:
+        write_raw_table(os.path.join(year_dir, '{}_3.3_{}.txt'.format(
+            prefix, yr_string)), values, row_labels, column_labels)
+
+
+def _max_rss(children=False):
+    if resource is None:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if children:
+        max_rss = max(max_rss, resource.getrusage(
+            resource.RUSAGE_CHILDREN).ru_maxrss)
+    # kilobytes on Linux, bytes on macOS
+    return max_rss if platform.system() == 'Darwin' else max_rss * 1024
+
+
+def measure(stage, function, *args, trace_memory=True):
+    """
+    Runs function(*args) and measures it.
+
+    :param trace_memory: bool
+            Trace the allocations, which slows down code that allocates
+            many small Python objects
+    :return: tuple
+            The result of the function and a StageResult
+    """
+    if trace_memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        result = function(*args)
+    finally:
+        seconds = time.perf_counter() - start
+        peak_bytes = None
+        if trace_memory:
+            peak_bytes = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+    return result, StageResult(stage, 'done', seconds, peak_bytes,
+                               _max_rss(stage in process_pool_stages))
+
+
+def run_benchmark(size='toy', directory=None, selected=None, seed=0,
+                  trace_memory=True, indicators_filename=default_indicators):
+    """
+    Generates a synthetic table and runs the pipeline stages on it.
+
+    :param size: str or tuple
+            A key of sizes or a tuple (countries, products, industries,
+            final demand categories, extensions)
+    :param directory: str, optional
+            Directory for the raw, parsed and output files, by default a
+            temporary directory
+    :param selected: list, optional
+            Names of the stages to run, by default all stages
+    :param indicators_filename: str
+            Indicator file of the ramascene stage
+    :return: list
+            StageResult tuples in the order of the stages
+    """
+    if directory is None:
+        with tempfile.TemporaryDirectory() as tmp:
+            return run_benchmark(size, tmp, selected, seed, trace_memory,
+                                 indicators_filename)
+
+    dimensions = sizes[size] if isinstance(size, str) else tuple(size)
+    selected = stages if selected is None else selected
+    sut = synthetic_sut(*dimensions, seed=seed)
+    results = []
+
+    def run(stage, function, *args):
+        if stage not in selected:
+            return None
+        result, stage_result = measure(stage, function, *args,
+                                       trace_memory=trace_memory)
+        results.append(stage_result)
+        return result
+
+    def skip(stage):
+        if stage in selected:
+            results.append(StageResult(stage, 'skipped', None, None, None))
+
+    if 'parse' in selected:
+        raw_data_dir = os.path.join(directory, 'raw')
+        write_raw_year(raw_data_dir, '2011', sut)
+        run('parse', rd.main, raw_data_dir,
+            os.path.join(directory, 'clean'), [2011])
+
+    # tables too small for the secondary material pairs skip make_secondary
+    if sf.label_coordinates(sf.default_code_pairs, sut.product_index,
+                            sut.industry_index) is None:
+        skip('secondary')
+    else:
+        run('secondary', sf.make_secondary, sut)
+
+    model = mb.TransformationModelB(sut, False)
+    for stage in model_stages:
+        run(stage, getattr(model, stage))
+    run('checks', lambda: [model.check_io_transaction_matrix(),
+                           model.check_io_coefficients_matrix(),
+                           model.check_ext_transaction_matrix(),
+                           model.check_ext_coefficient_matrix()])
+
+    def save():
+        output_dir = os.path.join(directory, 'output')
+        if not os.path.exists(output_dir):
+            os.makedirs(output_dir)
+        wr.save(os.path.join(output_dir, 'Y.npy'), model.final_demand())
+        wr.save(os.path.join(output_dir, 'B.npy'),
+                model.ext_coefficients_matrix())
+        wr.save(os.path.join(output_dir, 'W.npy'),
+                model.factor_inputs_coefficients_matrix())
+        wr.save(os.path.join(output_dir, 'A.npy'),
+                model.io_coefficient_matrix())
+        product_cnt = len(model.q)
+        wr.save_row_blocks(os.path.join(output_dir, 'L.npy'),
+                           (product_cnt, product_cnt),
+                           model.leontief().inverse_rows)
+    run('save', save)
+
+    # make_ramascene_data selects rows of the EXIOBASE extensions, tables
+    # of another size skip it
+    indicators = ch.load(indicators_filename)
+    try:
+        indicators.check('factor_inputs', model.factor_inputs.shape[0])
+        indicators.check('extensions', model.extensions.shape[0])
+    except ValueError:
+        skip('ramascene')
+    else:
+        run('ramascene', rama.main, directory, model, None, indicators)
+    return results
+
+
+def environment():
+    """Description of the machine and libraries, stored with baselines."""
+    return {'python': platform.python_version(),
+            'numpy': np.__version__,
+            'machine': platform.machine(),
+            'processor': platform.processor(),
+            'cpu_count': os.cpu_count()}
+
+
+def save_baseline(filename, results, size):
+    """Saves benchmark results as JSON baseline."""
+    baseline = {'size': size, 'environment': environment(),
+                'stages': {result.stage: result._asdict()
+                           for result in results}}
+    with open(filename, 'w') as baseline_file:
+        json.dump(baseline, baseline_file, indent=2)
+
+
+def load_baseline(filename):
+    with open(filename) as baseline_file:
+        return json.load(baseline_file)
+
+
+def compare(results, baseline, time_tolerance=0.25, memory_tolerance=0.25,
+            min_seconds=0.05, min_bytes=2 ** 20):
+    """
+    Compares benchmark results to a baseline.
+
+    :param time_tolerance: float
+            Allowed relative increase of the wall time
+    :param memory_tolerance: float
+            Allowed relative increase of the peak memory and peak RSS
+    :param min_seconds: float
+            Stages faster than this in both runs are not compared, their
+            timings are mostly noise
+    :param min_bytes: int
+            Memory below this in both runs is not compared
+    :return: list
+            Regression tuples, empty when nothing got worse
+    """
+    regressions = []
+    for result in results:
+        reference = baseline['stages'].get(result.stage)
+        if reference is None or result.status != 'done' or \
+                reference['status'] != 'done':
+            continue
+        for metric, tolerance, minimum in [
+                ('seconds', time_tolerance, min_seconds),
+                ('peak_bytes', memory_tolerance, min_bytes),
+                ('max_rss', memory_tolerance, min_bytes)]:
+            current = getattr(result, metric)
+            previous = reference[metric]
+            if current is None or previous is None or \
+                    max(current, previous) < minimum:
+                continue
+            if current > previous * (1 + tolerance):
+                regressions.append(Regression(
+                    result.stage, metric, previous, current,
+                    current / previous if previous else float('inf')))
+    return regressions
+
+
+def print_results(results):
+    print('{:<36}{:<9}{:>10}{:>12}{:>12}'.format(
+        'stage', 'status', 'seconds', 'peak MB', 'max RSS MB'))
+    for result in results:
+        if result.status != 'done':
+            print('{:<36}{:<9}'.format(result.stage, result.status))
+            continue
+        print('{:<36}{:<9}{:>10.3f}{:>12}{:>12}'.format(
+            result.stage, result.status, result.seconds,
+            '' if result.peak_bytes is None else
+            '{:.1f}'.format(result.peak_bytes / 2 ** 20),
+            '' if result.max_rss is None else
+            '{:.1f}'.format(result.max_rss / 2 ** 20)))
+    pool_stages = [result.stage for result in results
+                   if result.stage in process_pool_stages and
+                   result.status == 'done']
+    if pool_stages:
+        print('{}: the peak MB only covers the main process, the max RSS '
+              'also the largest worker process'.format(
+                  ', '.join(pool_stages)))
+
+
+def main(size='toy', baseline_filename=None, update=False, directory=None,
+         selected=None):
+    """
+    Runs the benchmark and prints the results. With a baseline file the
+    results are compared to it and regressions are reported; with update
+    the baseline is (re)written with these results.
+
+    :return: list
+            Regression tuples
+    """
+    results = run_benchmark(size, directory, selected)
+    print_results(results)
+    regressions = []
+    if baseline_filename is not None and os.path.exists(baseline_filename) \
+            and not update:
+        regressions = compare(results, load_baseline(baseline_filename))
+        for regression in regressions:
+            print('Regression: {} {} went from {:.4g} to {:.4g} ({:.2f}x)'
+                  .format(*regression))
+    if baseline_filename is not None and \
+            (update or not os.path.exists(baseline_filename)):
+        save_baseline(baseline_filename, results, size)
+    return regressions
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,231 @@
+"""
+A single file format holding all tables of one year.
+
+The file starts with a fixed header pointing to a JSON index at the end of
+the file. Arrays are stored in blocks of rows, optionally zlib compressed,
+so a block of rows (e.g. the products of one country) can be read with a
+single seek. Uncompressed arrays can also be memory mapped. Labels are
+stored per column as a list of unique values plus an integer code for each
+row, instead of pickled nested lists.
+"""
+import json
+import os
+import struct
+import zlib
+import numpy as np
+import pySUTtoIO.tools as tl
+
+bundle_filename = 'sut.bundle'
+
+_magic = b'SUTBNDL1'
+_header = struct.Struct('<8sQQ')  # magic, index offset, index length
+
+
+def _chunk_rows(shape, dtype, chunk_bytes=2 ** 23):
+    row_bytes = np.dtype(dtype).itemsize * max(1, int(np.prod(shape[1:])))
+    return max(1, chunk_bytes // row_bytes)
+
+
+def _write_segment(bundle, data, compress):
+    data = np.ascontiguousarray(data).tobytes()
+    if compress:
+        data = zlib.compress(data)
+    offset = bundle.tell()
+    bundle.write(data)
+    return [offset, len(data)]
+
+
+def pad_labels(labels, fill=''):
+    """Pads labels with fill to the length of the longest label, e.g. the
+    extension labels of which only emissions and resources have a
+    compartment."""
+    length = max([len(label) for label in labels] or [0])
+    return [list(label) + [fill] * (length - len(label))
+            for label in labels]
+
+
+def _encode_labels(labels):
+    labels = [list(label) for label in labels]
+    lengths = {len(label) for label in labels}
+    if len(lengths) > 1:
+        raise ValueError('labels have different lengths: {}'.format(
+            sorted(lengths)))
+    columns = []
+    for column in zip(*labels):
+        categories = list(dict.fromkeys(column))
+        positions = {category: idx for idx, category in enumerate(categories)}
+        codes = np.array([positions[item] for item in column],
+                         dtype=np.min_scalar_type(max(1, len(categories) - 1)))
+        columns.append((categories, codes))
+    return columns
+
+
+def write_bundle(filename, arrays, labels=None, metadata=None, compress=False,
+                 chunk_rows=None):
+    """
+    Writes arrays and labels to a bundle file. The file is written under a
+    temporary name and renamed when complete.
+
+    :param filename : str
+            Full qualified filename
+    :param arrays : dict
+            Two dimensional arrays by name, sparse matrices are stored dense
+    :param labels : dict, optional
+            Label lists (lists of lists, e.g. [country, product, code]) by
+            name, all labels of a list have the same length, see pad_labels
+    :param metadata : dict, optional
+            Any JSON serializable data, e.g. the year
+    :param compress : bool
+            Compress the array blocks with zlib
+    :param chunk_rows : int, optional
+            Rows per block, by default blocks of about 8 MB
+    """
+    index = {'metadata': metadata or {}, 'arrays': {}, 'labels': {}}
+    temporary = filename + '.part'
+    try:
+        with open(temporary, 'wb') as bundle:
+            bundle.write(_header.pack(_magic, 0, 0))
+            for name, array in arrays.items():
+                array = tl.to_dense(array)
+                rows = chunk_rows or _chunk_rows(array.shape, array.dtype)
+                chunks = [_write_segment(bundle, array[start:start + rows],
+                                         compress)
+                          for start in range(0, len(array), rows)]
+                index['arrays'][name] = {
+                    'dtype': array.dtype.str, 'shape': list(array.shape),
+                    'chunk_rows': rows, 'compressed': compress,
+                    'chunks': chunks}
+            for name, label_list in (labels or {}).items():
+                columns = []
+                for categories, codes in _encode_labels(label_list):
+                    columns.append({
+                        'categories': categories, 'dtype': codes.dtype.str,
+                        'codes': _write_segment(bundle, codes, False)})
+                index['labels'][name] = {'length': len(label_list),
+                                         'columns': columns}
+            index_data = json.dumps(index).encode('utf-8')
+            index_offset = bundle.tell()
+            bundle.write(index_data)
+            bundle.seek(0)
+            bundle.write(_header.pack(_magic, index_offset, len(index_data)))
+        os.replace(temporary, filename)
+    except BaseException:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+        raise
+
+
+class Bundle:
+    """Read access to a bundle file. Opening only reads the index, arrays
+    and labels are read when they are requested. The file is only open
+    while reading, so a Bundle can be kept, e.g. by a Sut, without holding
+    a file handle; memory mapped arrays map the file themselves."""
+
+    def __init__(self, filename):
+        self.filename = filename
+        with open(filename, 'rb') as bundle:
+            magic, index_offset, index_length = _header.unpack(
+                bundle.read(_header.size))
+            if magic != _magic:
+                raise ValueError('{} is not a bundle file'.format(filename))
+            bundle.seek(index_offset)
+            self._index = json.loads(
+                bundle.read(index_length).decode('utf-8'))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
+
+    def close(self):
+        """Nothing to release, kept so a Bundle can be used as context
+        manager."""
+
+    @property
+    def metadata(self):
+        return self._index['metadata']
+
+    @property
+    def array_names(self):
+        return list(self._index['arrays'])
+
+    @property
+    def label_names(self):
+        return list(self._index['labels'])
+
+    def shape(self, name):
+        return tuple(self._index['arrays'][name]['shape'])
+
+    @staticmethod
+    def _read_segment(bundle, segment, compressed):
+        offset, length = segment
+        bundle.seek(offset)
+        data = bundle.read(length)
+        if compressed:
+            data = zlib.decompress(data)
+        return data
+
+    def read(self, name, start=0, stop=None, mmap_mode=None):
+        """
+        Reads rows start up to stop of an array, only the blocks holding
+        these rows are read.
+
+        :param mmap_mode : str, optional
+                Memory map an uncompressed array instead of reading it,
+                see np.load
+        :return: numpy array
+        """
+        entry = self._index['arrays'][name]
+        dtype = np.dtype(entry['dtype'])
+        shape = entry['shape']
+        stop = shape[0] if stop is None else min(stop, shape[0])
+        start = min(start, stop)
+        row_shape = shape[1:]
+
+        if mmap_mode is not None and not entry['compressed']:
+            # uncompressed blocks are stored one after the other
+            row_bytes = dtype.itemsize * int(np.prod(row_shape))
+            if stop == start:
+                return np.empty([0] + row_shape, dtype)
+            return np.memmap(self.filename, dtype=dtype, mode=mmap_mode,
+                             offset=entry['chunks'][0][0] + start * row_bytes,
+                             shape=tuple([stop - start] + row_shape))
+
+        rows = entry['chunk_rows']
+        result = np.empty([stop - start] + row_shape, dtype)
+        with open(self.filename, 'rb') as bundle:
+            for chunk_idx in range(start // rows, -(-stop // rows)):
+                chunk_start = chunk_idx * rows
+                data = self._read_segment(bundle, entry['chunks'][chunk_idx],
+                                          entry['compressed'])
+                chunk = np.frombuffer(data, dtype).reshape([-1] + row_shape)
+                lo = max(start, chunk_start)
+                hi = min(stop, chunk_start + len(chunk))
+                result[lo - start:hi - start] = \
+                    chunk[lo - chunk_start:hi - chunk_start]
+        return result
+
+    def label_columns(self, name):
+        """
+        Returns the label columns as (categories, codes) pairs, the label of
+        column k of row i is categories[k][codes[k][i]].
+        """
+        columns = []
+        with open(self.filename, 'rb') as bundle:
+            for column in self._index['labels'][name]['columns']:
+                codes = np.frombuffer(
+                    self._read_segment(bundle, column['codes'], False),
+                    np.dtype(column['dtype']))
+                columns.append((column['categories'], codes))
+        return columns
+
+    def labels(self, name):
+        """
+        Returns labels as list of lists, as written by write_bundle.
+        """
+        columns = [[categories[code] for code in codes]
+                   for categories, codes in self.label_columns(name)]
+        if not columns:
+            return [[] for _ in range(self._index['labels'][name]['length'])]
+        return [list(label) for label in zip(*columns)]
@@ -0,0 +1,232 @@
+"""
+Characterization of extensions into indicators, e.g. GHG emissions in CO2
+equivalents, from indicator definition files such as
+data/auxiliary/indicators_v3.txt.
+
+An indicator file is a stressors by indicators matrix of characterization
+factors. The stressors are rows of the model matrices, stacked in the order
+given by a layout: a list of (source, rows) pairs, e.g. all factor inputs
+followed by the GHG rows of the extensions. A file is parsed once into one
+sparse operator per source that only refers to the source rows with a
+factor, so indicators are calculated as sparse products over these rows
+only. Parsed operators are kept in memory and on disk next to the file.
+"""
+import functools
+import os
+import zipfile
+import numpy as np
+import scipy.sparse as sp
+import pySUTtoIO.tools as tl
+
+default_indicators = os.path.join('data', 'auxiliary', 'indicators_v3.txt')
+indicators_v2 = os.path.join('data', 'auxiliary', 'indicators_v2.txt')
+
+# rows of the EXIOBASE extensions used by RaMa-SCENE: CO2, CH4 and N2O
+# emissions, and "domestic extraction used" of metals and minerals
+ghg_index = (0, 1, 2, 27, 28, 29, 52, 53, 54, 55, 56, 57, 58, 59, 77, 78,
+             403, 404, 405, 406, 407, 410)
+material_index = tuple(range(417 + 419, 417 + 439))
+
+# stacking of the stressors of indicators_v3.txt: a placeholder for the
+# total output coefficients, all factor inputs, GHG emissions and materials;
+# None stands for all rows of a source
+ramascene_layout = (('placeholder', (0,)),
+                    ('factor_inputs', None),
+                    ('extensions', ghg_index),
+                    ('extensions', material_index))
+
+# indicators_v2.txt also has input coefficients of the 17 product groups of
+# prd_aggregation.txt after the placeholder
+ramascene_v2_layout = ramascene_layout[:1] + \
+    (('product_inputs', tuple(range(17))),) + ramascene_layout[1:]
+
+# layouts of the indicator files by file name, other files use
+# ramascene_layout unless a layout is given
+layouts = {os.path.basename(default_indicators): ramascene_layout,
+           os.path.basename(indicators_v2): ramascene_v2_layout}
+
+
+class Characterization:
+    """Sparse characterization operators, one per source."""
+
+    def __init__(self, factors, layout):
+        """
+        :param factors: numpy array or scipy sparse matrix
+                Characterization factors, stressors by indicators
+        :param layout: tuple
+                (source, rows) pairs in the order of the stressors, the
+                rows of at most one pair can be None for all remaining
+                stressors
+        """
+        factors = sp.csc_matrix(factors)
+        self.indicator_cnt = factors.shape[1]
+        known = sum(len(rows) for _, rows in layout if rows is not None)
+        self.rows = {}
+        self.operators = {}
+        # number of rows of the sources of which all rows are stressors
+        self.sizes = {}
+        start = 0
+        blocks_of = {}
+        for source, rows in layout:
+            if rows is None:
+                rows = range(factors.shape[0] - known)
+                self.sizes[source] = len(rows)
+            rows = np.asarray(rows, dtype=np.intp)
+            block = factors[start:start + len(rows)].T.tocsr()
+            start += len(rows)
+            blocks_of.setdefault(source, []).append((rows, block))
+        assert start == factors.shape[0], \
+            'layout has {} stressors, factors {}'.format(start,
+                                                         factors.shape[0])
+        for source, blocks in blocks_of.items():
+            rows = np.concatenate([rows for rows, _ in blocks])
+            operator = sp.hstack([block for _, block in blocks]).tocsc()
+            # only keep the source rows that have a factor
+            used = np.flatnonzero(np.diff(operator.indptr))
+            rows, inverse = np.unique(rows[used], return_inverse=True)
+            operator = operator[:, used].tocoo()
+            self.rows[source] = rows
+            self.operators[source] = sp.csr_matrix(
+                (operator.data, (operator.row, inverse[operator.col])),
+                shape=(self.indicator_cnt, len(rows)))
+
+    def check(self, source, row_cnt):
+        """
+        Raises a ValueError when a source with row_cnt rows does not fit
+        the layout, e.g. an indicator file with another number of factor
+        inputs than the tables.
+        """
+        if source in self.sizes:
+            if row_cnt != self.sizes[source]:
+                raise ValueError(
+                    'the indicators have {} rows of {}, the tables {}'.format(
+                        self.sizes[source], source, row_cnt))
+        elif source in self.rows and len(self.rows[source]) > 0 and \
+                self.rows[source][-1] >= row_cnt:
+            raise ValueError(
+                'the indicators use row {} of {}, the tables have {}'.format(
+                    self.rows[source][-1], source, row_cnt))
+
+    def apply_rows(self, selected):
+        """
+        Calculates the indicators from the needed rows of each source.
+
+        :param selected: dict
+                For each source a matrix with the rows of self.rows[source],
+                sources that are missing count as zero
+        :return: numpy array
+                Indicators by columns of the sources
+        """
+        used = [source for source in self.operators if source in selected]
+        if not used:
+            raise ValueError('none of the sources {} is given'.format(
+                list(self.operators)))
+        result = np.zeros((self.indicator_cnt,
+                           selected[used[0]].shape[1]))
+        for source in used:
+            if self.operators[source].nnz > 0:
+                result += self.operators[source] @ \
+                    tl.to_dense(selected[source])
+        return result
+
+    def apply(self, sources):
+        """
+        Calculates the indicators from complete source matrices, of which
+        only the needed rows are read.
+        """
+        for source in self.operators:
+            if source in sources:
+                self.check(source, sources[source].shape[0])
+        return self.apply_rows({source: sources[source][self.rows[source]]
+                                for source in self.operators
+                                if source in sources})
+
+    def save(self, filename, **metadata):
+        arrays = dict(metadata, indicator_cnt=self.indicator_cnt,
+                      sources=np.array(list(self.operators)))
+        for idx, source in enumerate(self.operators):
+            operator = self.operators[source]
+            arrays['rows_{}'.format(idx)] = self.rows[source]
+            arrays['size_{}'.format(idx)] = self.sizes.get(source, -1)
+            arrays['data_{}'.format(idx)] = operator.data
+            arrays['indices_{}'.format(idx)] = operator.indices
+            arrays['indptr_{}'.format(idx)] = operator.indptr
+        # written under a temporary name, processes that load the same
+        # file at the same time never see a partial file
+        temporary = '{}.{}.part'.format(filename, os.getpid())
+        try:
+            with open(temporary, 'wb') as compiled:
+                np.savez(compiled, **arrays)
+            os.replace(temporary, filename)
+        except BaseException:
+            if os.path.exists(temporary):
+                os.remove(temporary)
+            raise
+
+    @classmethod
+    def from_saved(cls, arrays):
+        characterization = cls.__new__(cls)
+        characterization.indicator_cnt = int(arrays['indicator_cnt'])
+        characterization.rows = {}
+        characterization.operators = {}
+        characterization.sizes = {}
+        for idx, source in enumerate(arrays['sources']):
+            source = str(source)
+            rows = arrays['rows_{}'.format(idx)]
+            characterization.rows[source] = rows
+            size = int(arrays['size_{}'.format(idx)])
+            if size >= 0:
+                characterization.sizes[source] = size
+            characterization.operators[source] = sp.csr_matrix(
+                (arrays['data_{}'.format(idx)],
+                 arrays['indices_{}'.format(idx)],
+                 arrays['indptr_{}'.format(idx)]),
+                shape=(characterization.indicator_cnt, len(rows)))
+        return characterization
+
+
+def _compiled_filename(filename):
+    return os.path.splitext(filename)[0] + '.npz'
+
+
+def _signature(filename, layout):
+    status = os.stat(filename)
+    return repr((status.st_mtime_ns, status.st_size, layout))
+
+
+@functools.lru_cache(maxsize=None)
+def _load(filename, layout, signature):
+    compiled_fn = _compiled_filename(filename)
+    if os.path.exists(compiled_fn):
+        try:
+            with np.load(compiled_fn) as arrays:
+                if str(arrays['signature']) == signature:
+                    return Characterization.from_saved(arrays)
+        except (OSError, KeyError, ValueError, zipfile.BadZipFile):
+            pass  # not a valid compiled file, it is replaced
+    factors = tl.list_to_numpy_array(
+        tl.csv_file_to_list(filename, delimiter='\t'), 0, 0)
+    characterization = Characterization(factors, layout)
+    try:
+        characterization.save(compiled_fn, signature=signature)
+    except OSError:
+        pass  # e.g. a read-only data directory, parse again next time
+    return characterization
+
+
+def load(filename=default_indicators, layout=None):
+    """
+    Returns the characterization of an indicator file. The file is parsed
+    once, the operators are kept in memory and saved as .npz next to the
+    file; they are parsed again when the file or the layout changes.
+
+    :param layout: tuple, optional
+            (source, rows) pairs, see Characterization, by default the
+            layout of the file name in layouts or ramascene_layout
+    :return: Characterization
+    """
+    if layout is None:
+        layout = layouts.get(os.path.basename(filename), ramascene_layout)
+    layout = tuple((source, None if rows is None else tuple(rows))
+                   for source, rows in layout)
+    return _load(filename, layout, _signature(filename, layout))
@@ -0,0 +1,184 @@
+"""
+Command line interface of the pipeline, with a subcommand per stage:
+
+    pySUTtoIO ingest RAW_DIR CLEAN_DIR --years 2005-2008
+    pySUTtoIO transform CLEAN_DIR SAVE_DIR --years 2005 2007 --workers 2
+    pySUTtoIO export CLEAN_DIR SAVE_DIR --years 2011
+    pySUTtoIO bench --size small --baseline baseline.json
+
+ingest parses the raw EXIOBASE text files, transform saves A, L, Y, B and
+W of each year, export saves the RaMa-SCENE data and bench runs the stage
+benchmarks. The modules of a stage are only imported when it runs, so
+--help and argument errors return without loading numpy or scipy.
+"""
+import argparse
+import logging
+import sys
+
+
+def parse_years(text):
+    """
+    Parses a year or an inclusive range of years such as 2005-2008.
+
+    :return: list
+            The years as strings
+    """
+    first, _, last = text.partition('-')
+    try:
+        first = int(first)
+        last = int(last) if last else first
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            'not a year or range of years: {!r}'.format(text))
+    if last < first:
+        raise argparse.ArgumentTypeError(
+            'empty range of years: {!r}'.format(text))
+    return [str(yr) for yr in range(first, last + 1)]
+
+
+def _years(args):
+    if args.years is None:
+        return None
+    return [yr for years in args.years for yr in years]
+
+
+def _add_years(parser, required=False):
+    parser.add_argument('--years', nargs='+', type=parse_years,
+                        required=required,
+                        help='years or ranges of years, e.g. 2005-2008 2011')
+
+
+def _add_transform_options(parser):
+    parser.add_argument('sut_dir',
+                        help='directory with a subdirectory per year of '
+                             'clean supply-use tables')
+    parser.add_argument('save_dir', help='output directory')
+    _add_years(parser)
+    parser.add_argument('--workers', type=int, default=1,
+                        help='concurrent years, 0 for one per core '
+                             '(default 1)')
+    parser.add_argument('--blas-threads', type=int,
+                        help='BLAS threads per worker process, with one '
+                             'worker set OMP_NUM_THREADS instead')
+    parser.add_argument('--resume', action='store_true',
+                        help='skip years of which all outputs are valid')
+    parser.add_argument('--secondary', action='store_true',
+                        help='move secondary material flows, see '
+                             'secondary_flows')
+    parser.add_argument('--precision', choices=['double', 'single'],
+                        default='double')
+    parser.add_argument('--mmap', choices=['c', 'r'],
+                        help='memory map the input files')
+    parser.add_argument('--cache-dir',
+                        help='disk cache of the derived matrices')
+    parser.add_argument('--trace-dir',
+                        help='save the stage timings of each year here')
+    parser.add_argument('--trace-memory', action='store_true',
+                        help='also trace the peak memory of each stage')
+
+
+def ingest(args):
+    import pySUTtoIO.read_msut_exiobase as rd
+
+    rd.main(args.raw_dir, args.clean_dir, _years(args), args.workers,
+            args.format)
+    return 0
+
+
+def transform(args, project=0):
+    import pySUTtoIO.main as mn
+    import pySUTtoIO.batch as bt
+
+    summary = mn.launch(args.sut_dir, 'b', args.save_dir, args.secondary,
+                        project, max_workers=args.workers or None,
+                        resume=args.resume, blas_threads=args.blas_threads,
+                        mmap_mode=args.mmap, trace_dir=args.trace_dir,
+                        trace_memory=args.trace_memory,
+                        precision=args.precision, cache_dir=args.cache_dir,
+                        years=_years(args))
+    print(bt.format_summary(summary))
+    return int(any(result.status == 'failed' for result in summary))
+
+
+def export(args):
+    return transform(args, project=1)
+
+
+def bench(args):
+    import pySUTtoIO.benchmark as bm
+
+    regressions = bm.main(args.size, args.baseline, args.update,
+                          args.directory, args.stages)
+    return int(len(regressions) > 0)
+
+
+def make_parser():
+    parser = argparse.ArgumentParser(
+        prog='pySUTtoIO',
+        description='Transforms EXIOBASE supply-use tables into '
+                    'input-output tables.')
+    parser.add_argument('-v', '--verbose', action='count', default=0,
+                        help='log progress, twice for the stage timings')
+    subparsers = parser.add_subparsers(dest='command', metavar='command')
+    subparsers.required = True
+
+    ingest_parser = subparsers.add_parser(
+        'ingest', help='parse raw EXIOBASE text files')
+    ingest_parser.add_argument('raw_dir',
+                               help='directory with a subdirectory of raw '
+                                    'text files per year')
+    ingest_parser.add_argument('clean_dir', help='output directory')
+    _add_years(ingest_parser, required=True)
+    ingest_parser.add_argument('--workers', type=int,
+                               help='files parsed at the same time, by '
+                                    'default one per core')
+    ingest_parser.add_argument('--format', choices=['npy', 'bundle'],
+                               default='npy')
+    ingest_parser.set_defaults(run=ingest)
+
+    transform_parser = subparsers.add_parser(
+        'transform', help='save the input-output tables of each year')
+    _add_transform_options(transform_parser)
+    transform_parser.set_defaults(run=transform)
+
+    export_parser = subparsers.add_parser(
+        'export', help='save the RaMa-SCENE data of each year')
+    _add_transform_options(export_parser)
+    export_parser.set_defaults(run=export)
+
+    bench_parser = subparsers.add_parser(
+        'bench', help='benchmark the pipeline stages')
+    bench_parser.add_argument('--size', default='toy',
+                              help='size of the synthetic tables, see '
+                                   'benchmark.sizes (default toy)')
+    bench_parser.add_argument('--baseline',
+                              help='JSON baseline to compare to, written '
+                                   'when it does not exist')
+    bench_parser.add_argument('--update', action='store_true',
+                              help='overwrite the baseline')
+    bench_parser.add_argument('--directory',
+                              help='keep the generated files here')
+    bench_parser.add_argument('--stages', nargs='+',
+                              help='only run these stages')
+    bench_parser.set_defaults(run=bench)
+    return parser
+
+
+def main(argv=None):
+    """
+    Runs a subcommand.
+
+    :return: int
+            Exit status, 1 when a year failed or the benchmark found
+            regressions
+    """
+    args = make_parser().parse_args(argv)
+    if args.verbose:
+        logging.basicConfig(
+            level=logging.DEBUG if args.verbose > 1 else logging.INFO,
+            format='%(asctime)s %(levelname)s %(message)s')
+    return args.run(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,96 @@
+"""
+Dimensions of a multi-regional supply-use table: the number of countries
+(or regions), and the number of products, industries and final demand
+categories per country. The rows and columns of each country form a block,
+the offsets of these blocks follow from the dimensions.
+"""
+import collections
+import numpy as np
+
+
+class Dimensions(collections.namedtuple('Dimensions', [
+        'cntr_cnt', 'prd_cnt', 'ind_cnt', 'fd_cnt'])):
+    """Countries, and products, industries and final demand categories per
+    country. Dimensions are immutable and hashable, so they can be used as
+    key of cached block positions."""
+
+    __slots__ = ()
+
+    @property
+    def products(self):
+        """Number of product rows of all countries."""
+        return self.cntr_cnt * self.prd_cnt
+
+    @property
+    def industries(self):
+        return self.cntr_cnt * self.ind_cnt
+
+    @property
+    def finaluses(self):
+        return self.cntr_cnt * self.fd_cnt
+
+    @property
+    def supply_shape(self):
+        """Shape of the supply and use matrices."""
+        return self.products, self.industries
+
+    @property
+    def final_use_shape(self):
+        return self.products, self.finaluses
+
+    def product_offsets(self):
+        """First product row of each country."""
+        return self.prd_cnt * np.arange(self.cntr_cnt)
+
+    def industry_offsets(self):
+        return self.ind_cnt * np.arange(self.cntr_cnt)
+
+    def finaluse_offsets(self):
+        return self.fd_cnt * np.arange(self.cntr_cnt)
+
+    def product_block(self, country):
+        """Slice of the products of a country, by position."""
+        return slice(country * self.prd_cnt, (country + 1) * self.prd_cnt)
+
+    def industry_block(self, country):
+        return slice(country * self.ind_cnt, (country + 1) * self.ind_cnt)
+
+    def product_blocks(self):
+        """Slices of the products of all countries."""
+        return [self.product_block(idx) for idx in range(self.cntr_cnt)]
+
+    def product_positions(self, positions):
+        """
+        Repeats product positions within a country for all countries.
+
+        :param positions: list
+                Positions within a country
+        :return: numpy array
+                The positions in all countries, country by country
+        """
+        return _repeat(positions, self.product_offsets())
+
+    def industry_positions(self, positions):
+        return _repeat(positions, self.industry_offsets())
+
+    @classmethod
+    def from_labels(cls, product_categories, industry_categories,
+                    finaluse_categories, country_column=0):
+        """
+        Derives the dimensions from the labels of a supply-use table, each
+        label holding the country in country_column.
+        """
+        countries = {label[country_column] for label in product_categories}
+        cntr_cnt = len(countries)
+        return cls(cntr_cnt, len(product_categories) // cntr_cnt,
+                   len(industry_categories) // cntr_cnt,
+                   len(finaluse_categories) // cntr_cnt)
+
+
+def _repeat(positions, offsets):
+    positions = np.asarray(positions, dtype=np.intp)
+    return (positions[None, :] + offsets[:, None]).ravel()
+
+
+# EXIOBASE 3 multi-regional supply-use tables
+exiobase = Dimensions(cntr_cnt=49, prd_cnt=200, ind_cnt=163, fd_cnt=7)
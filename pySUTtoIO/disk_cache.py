@@ -0,0 +1,287 @@
+"""
+Persistent cache of derived matrices, such as the transformation matrix,
+the coefficient matrices, the LU factors of I - A and the Leontief
+inverse, so a rerun of the same tables does not compute them again.
+
+Entries are content addressed: the key of a matrix is a hash of the input
+arrays it is derived from, the model type and settings and the library
+version, see TransformationModelB. A changed input therefore only misses
+the entries that depend on it, and entries never have to be invalidated.
+
+Each entry is a payload file (.npy for dense arrays, .npz for sparse
+matrices and groups of arrays) and a small JSON file with the checksum
+and size of the payload. Both are written under a temporary name and
+renamed when complete, so processes can share a cache directory. Entries
+whose payload does not match the checksum are removed and count as a
+miss. When the payloads exceed max_bytes the least recently used entries
+are removed.
+"""
+import hashlib
+import json
+import os
+import shutil
+import numpy as np
+import scipy.sparse as sp
+
+# 32 GB, room for the matrices of a few EXIOBASE years
+default_max_bytes = 32 * 2 ** 30
+
+_block_bytes = 2 ** 24
+
+
+def digest(*parts):
+    """Hash of strings, digests and arrays, as hexadecimal string."""
+    hasher = hashlib.blake2b(digest_size=20)
+    for part in parts:
+        if isinstance(part, np.ndarray) or sp.issparse(part):
+            part = array_digest(part)
+        hasher.update(str(part).encode('utf-8'))
+        hasher.update(b'\0')
+    return hasher.hexdigest()
+
+
+def array_digest(array):
+    """
+    Hash of the shape, type and values of a numpy array or scipy sparse
+    matrix, as hexadecimal string.
+    """
+    hasher = hashlib.blake2b(digest_size=20)
+    if sp.issparse(array):
+        array = sp.csr_matrix(array)
+        hasher.update(repr(('csr', array.shape, array.dtype.str)).encode())
+        arrays = [array.data, array.indices, array.indptr]
+    else:
+        hasher.update(repr(('dense', array.shape,
+                            array.dtype.str)).encode())
+        arrays = [array]
+    for part in arrays:
+        part = np.ascontiguousarray(part).reshape(-1)
+        step = max(1, _block_bytes // max(1, part.itemsize))
+        # hashed in blocks, so a memory mapped array is never copied whole
+        for start in range(0, len(part), step):
+            hasher.update(memoryview(part[start:start + step]).cast('B'))
+    return hasher.hexdigest()
+
+
+def file_digest(filename):
+    hasher = hashlib.blake2b(digest_size=20)
+    with open(filename, 'rb') as payload:
+        for block in iter(lambda: payload.read(_block_bytes), b''):
+            hasher.update(block)
+    return hasher.hexdigest()
+
+
+def _remove(*filenames):
+    for filename in filenames:
+        try:
+            os.remove(filename)
+        except OSError:
+            pass
+
+
+class DiskCache:
+    """Cache of arrays, sparse matrices and dicts of arrays in a
+    directory, by key."""
+
+    def __init__(self, directory, max_bytes=default_max_bytes,
+                 mmap_mode=None, verify=True):
+        """
+        :param directory: str
+                Directory of the entries, created when it does not exist
+        :param max_bytes: int
+                Total size of the payloads above which the least recently
+                used entries are removed
+        :param mmap_mode: str, optional
+                Memory map cached dense arrays, e.g. 'r', instead of
+                reading them into memory
+        :param verify: bool
+                Compare the checksum of every payload that is read
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.mmap_mode = mmap_mode
+        self.verify = verify
+        if not os.path.exists(directory):
+            os.makedirs(directory, exist_ok=True)
+
+    def _meta_filename(self, key):
+        return os.path.join(self.directory, key + '.json')
+
+    def _payload_filename(self, key, kind):
+        extension = '.npy' if kind == 'dense' else '.npz'
+        return os.path.join(self.directory, key + extension)
+
+    def _read_meta(self, key):
+        try:
+            with open(self._meta_filename(key)) as meta_file:
+                return json.load(meta_file)
+        except (OSError, ValueError):
+            return None
+
+    def _valid_payload(self, key):
+        """Returns the payload filename and kind of a complete entry, or
+        None; an entry that fails the integrity check is removed."""
+        meta = self._read_meta(key)
+        if meta is None:
+            return None
+        filename = self._payload_filename(key, meta['kind'])
+        try:
+            valid = os.path.getsize(filename) == meta['bytes'] and \
+                (not self.verify or file_digest(filename) == meta['checksum'])
+        except OSError:
+            valid = False
+        if not valid:
+            self.discard(key)
+            return None
+        # the modification time orders the entries for eviction
+        try:
+            os.utime(filename)
+        except OSError:
+            pass
+        return filename, meta['kind']
+
+    def __contains__(self, key):
+        return self._read_meta(key) is not None
+
+    def get(self, key):
+        """
+        :return: numpy array, scipy sparse matrix or dict
+                The cached value, None when the key is not cached or the
+                entry is damaged
+        """
+        entry = self._valid_payload(key)
+        if entry is None:
+            return None
+        filename, kind = entry
+        try:
+            if kind == 'dense':
+                return np.load(filename, mmap_mode=self.mmap_mode)
+            if kind == 'sparse':
+                return sp.load_npz(filename)
+            with np.load(filename) as arrays:
+                return {name: arrays[name] for name in arrays.files}
+        except (OSError, ValueError, KeyError):
+            self.discard(key)
+            return None
+
+    def get_file(self, key, filename):
+        """
+        Copies a cached dense array to a .npy file.
+
+        :return: bool
+                Whether the key was cached
+        """
+        entry = self._valid_payload(key)
+        if entry is None or entry[1] != 'dense':
+            return False
+        temporary = filename + '.part'
+        try:
+            shutil.copyfile(entry[0], temporary)
+            os.replace(temporary, filename)
+        except BaseException:
+            _remove(temporary)
+            raise
+        return True
+
+    def put(self, key, value):
+        """
+        Stores a numpy array, a scipy sparse matrix or a dict of numpy
+        arrays.
+
+        :return: bool
+                Whether the value was stored, values larger than max_bytes
+                are not
+        """
+        if sp.issparse(value):
+            kind = 'sparse'
+        elif isinstance(value, dict):
+            kind = 'arrays'
+        else:
+            kind = 'dense'
+        filename = self._payload_filename(key, kind)
+        temporary = '{}.{}.part'.format(filename, os.getpid())
+        try:
+            with open(temporary, 'wb') as payload:
+                if kind == 'dense':
+                    np.save(payload, value)
+                elif kind == 'sparse':
+                    sp.save_npz(payload, value, compressed=False)
+                else:
+                    np.savez(payload, **value)
+            return self._add(key, kind, temporary)
+        finally:
+            _remove(temporary)
+
+    def put_file(self, key, filename):
+        """Stores a dense array that is already saved as .npy file."""
+        temporary = '{}.{}.part'.format(self._payload_filename(key, 'dense'),
+                                        os.getpid())
+        try:
+            shutil.copyfile(filename, temporary)
+            return self._add(key, 'dense', temporary)
+        finally:
+            _remove(temporary)
+
+    def _add(self, key, kind, temporary):
+        size = os.path.getsize(temporary)
+        if size > self.max_bytes:
+            return False
+        meta = {'kind': kind, 'bytes': size,
+                'checksum': file_digest(temporary)}
+        os.replace(temporary, self._payload_filename(key, kind))
+        # the metadata is written last, an entry without it does not exist
+        meta_temporary = '{}.{}.part'.format(self._meta_filename(key),
+                                             os.getpid())
+        with open(meta_temporary, 'w') as meta_file:
+            json.dump(meta, meta_file)
+        os.replace(meta_temporary, self._meta_filename(key))
+        self.evict(keep=key)
+        return True
+
+    def discard(self, key):
+        _remove(self._meta_filename(key),
+                *[self._payload_filename(key, kind)
+                  for kind in ('dense', 'sparse')])
+
+    def entries(self):
+        """
+        :return: list
+                (last use, bytes, key) of each entry, least recently used
+                first
+        """
+        entries = []
+        for filename in os.listdir(self.directory):
+            key, extension = os.path.splitext(filename)
+            if extension != '.json':
+                continue
+            meta = self._read_meta(key)
+            if meta is None:
+                continue
+            try:
+                used = os.path.getmtime(self._payload_filename(key,
+                                                               meta['kind']))
+            except OSError:
+                continue
+            entries.append((used, meta['bytes'], key))
+        return sorted(entries)
+
+    def size(self):
+        """Total bytes of the payloads."""
+        return sum(size for _, size, _ in self.entries())
+
+    def evict(self, keep=None):
+        """Removes the least recently used entries, except keep, until the
+        payloads fit in max_bytes."""
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        for _, size, key in entries:
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            self.discard(key)
+            total -= size
+
+    def clear(self):
+        for _, _, key in self.entries():
+            self.discard(key)
@@ -0,0 +1,184 @@
+"""
+Timing and memory instrumentation of the pipeline stages.
+
+Code marks a stage with
+
+    with instrumentation.stage('io_coefficient_matrix') as record:
+        ...
+        record.add_array('A', A)
+
+and the active Tracer records the wall time, the CPU time, the peak of
+the memory allocated during the stage and the sizes of the arrays it
+produced. Stages can be nested. Every finished stage is logged to the
+'pySUTtoIO' logger at debug level and passed to the hooks of the tracer,
+and the records can be exported as a JSON trace that can be opened in
+chrome://tracing or Perfetto.
+
+Memory is measured with tracemalloc, which numpy reports its buffers to,
+when the tracer is created with trace_memory=True.
+"""
+import contextlib
+import json
+import logging
+import os
+import threading
+import time
+import tracemalloc
+import numpy as np
+import scipy.sparse as sp
+
+logger = logging.getLogger('pySUTtoIO')
+
+
+class StageRecord:
+    """Measurements of one stage."""
+
+    def __init__(self, name, depth, info):
+        self.name = name
+        self.depth = depth
+        self.info = info
+        self.start = None
+        self.wall = None
+        self.cpu = None
+        self.peak_bytes = None
+        self.arrays = []
+        self._peak = 0
+
+    def add_array(self, name, array):
+        """Records the shape and size in bytes of an array made by the
+        stage."""
+        if sp.issparse(array):
+            nbytes = array.data.nbytes
+            if hasattr(array, 'indices'):
+                nbytes += array.indices.nbytes + array.indptr.nbytes
+        elif isinstance(array, np.ndarray):
+            nbytes = array.nbytes
+        else:
+            return
+        self.arrays.append({'name': name, 'shape': list(array.shape),
+                            'bytes': int(nbytes)})
+
+    def to_dict(self):
+        return {'name': self.name, 'depth': self.depth, 'start': self.start,
+                'wall': self.wall, 'cpu': self.cpu,
+                'peak_bytes': self.peak_bytes, 'arrays': self.arrays,
+                'info': self.info}
+
+    def __str__(self):
+        text = '{}: {:.3f} s wall, {:.3f} s cpu'.format(self.name, self.wall,
+                                                        self.cpu)
+        if self.peak_bytes is not None:
+            text += ', peak {:.1f} MB'.format(self.peak_bytes / 2 ** 20)
+        return text
+
+
+class Tracer:
+    """Collects the records of stages. Hooks are functions that are called
+    with each StageRecord when its stage has finished. Without
+    keep_records the stages are only logged and passed to the hooks."""
+
+    def __init__(self, trace_memory=False, hooks=None, keep_records=True):
+        self.trace_memory = trace_memory
+        self.hooks = list(hooks or [])
+        self.keep_records = keep_records
+        self.records = []
+        self._stack = []
+        self._origin = time.perf_counter()
+
+    def add_hook(self, hook):
+        self.hooks.append(hook)
+
+    def remove_hook(self, hook):
+        self.hooks.remove(hook)
+
+    @contextlib.contextmanager
+    def stage(self, name, **info):
+        record = StageRecord(name, len(self._stack), info)
+        memory = self.trace_memory and tracemalloc.is_tracing()
+        if memory:
+            current, peak = tracemalloc.get_traced_memory()
+            if self._stack:
+                parent = self._stack[-1]
+                parent._peak = max(parent._peak, peak)
+            _reset_peak()
+        self._stack.append(record)
+        start_cpu = time.process_time()
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record.wall = time.perf_counter() - start
+            record.cpu = time.process_time() - start_cpu
+            record.start = start - self._origin
+            self._stack.pop()
+            if memory:
+                peak = max(record._peak, tracemalloc.get_traced_memory()[1])
+                record.peak_bytes = max(0, peak - current)
+                if self._stack:
+                    parent = self._stack[-1]
+                    parent._peak = max(parent._peak, peak)
+                _reset_peak()
+            if self.keep_records:
+                self.records.append(record)
+            logger.debug('%s', record)
+            for hook in self.hooks:
+                hook(record)
+
+    def to_list(self):
+        return [record.to_dict() for record in self.records]
+
+    def export(self, filename):
+        """
+        Saves the records as JSON trace in the Trace Event Format, with the
+        CPU time, peak memory and arrays of each stage as arguments.
+        """
+        events = []
+        for record in self.records:
+            events.append({
+                'name': record.name, 'ph': 'X', 'pid': os.getpid(),
+                'tid': 0, 'ts': record.start * 1E6, 'dur': record.wall * 1E6,
+                'args': {'cpu': record.cpu, 'peak_bytes': record.peak_bytes,
+                         'arrays': record.arrays, 'info': record.info}})
+        with open(filename, 'w') as trace_file:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'},
+                      trace_file, indent=1)
+
+
+def _reset_peak():
+    # tracemalloc.reset_peak exists from Python 3.9, before that the peak
+    # of a stage includes the peaks of earlier stages
+    if hasattr(tracemalloc, 'reset_peak'):
+        tracemalloc.reset_peak()
+
+
+_local = threading.local()
+_default = Tracer(keep_records=False)
+
+
+def get_tracer():
+    """Returns the active tracer of this thread."""
+    return getattr(_local, 'tracer', _default)
+
+
+@contextlib.contextmanager
+def use(tracer):
+    """
+    Makes tracer the active tracer within this context. Memory tracing is
+    started when the tracer traces memory and stopped again afterwards.
+    """
+    previous = get_tracer()
+    started = tracer.trace_memory and not tracemalloc.is_tracing()
+    if started:
+        tracemalloc.start()
+    _local.tracer = tracer
+    try:
+        yield tracer
+    finally:
+        _local.tracer = previous
+        if started:
+            tracemalloc.stop()
+
+
+def stage(name, **info):
+    """Measures a stage with the active tracer, see Tracer.stage."""
+    return get_tracer().stage(name, **info)
@@ -0,0 +1,146 @@
+"""
+Index of the row or column labels of a multi-regional table, e.g. the
+product labels [country, product name, product code] of the supply table.
+The labels are hashed once, after which a label is found by country and
+product name or code in constant time. The rows of each country form a
+block, the slices of these blocks are kept as well.
+"""
+import numpy as np
+
+
+class LabelIndex:
+    """Lookup of table positions by country and name or code, and of labels
+    by position. Every label column except the country column can be used
+    as name, e.g. both 'Cultivation of paddy rice' and 'C_PARI'."""
+
+    def __init__(self, labels, country_column=0):
+        """
+        :param labels: list
+                One label per row or column, each a list with the country
+                and one or more names or codes
+        :param country_column: int
+                Position of the country in a label
+        """
+        self._labels = labels
+        self.country_column = country_column
+
+        countries = {}
+        names = {}
+        country_codes = np.empty(len(labels), dtype=np.intp)
+        name_rows = []
+        for idx, label in enumerate(labels):
+            country_codes[idx] = countries.setdefault(
+                label[country_column], len(countries))
+            name_rows.append([names.setdefault(name, len(names))
+                              for pos, name in enumerate(label)
+                              if pos != country_column])
+        self._countries = countries
+        self._names = names
+
+        # position of each country and name combination, -1 when absent;
+        # the first occurrence wins when a name is not unique in a country
+        self._table = np.full((len(countries), len(names)), -1,
+                              dtype=np.intp)
+        for idx in range(len(labels) - 1, -1, -1):
+            self._table[country_codes[idx], name_rows[idx]] = idx
+
+        self._blocks = {}
+        for country, code in countries.items():
+            rows = np.flatnonzero(country_codes == code)
+            if len(rows) > 0 and rows[-1] - rows[0] + 1 == len(rows):
+                self._blocks[country] = slice(int(rows[0]), int(rows[-1]) + 1)
+
+    def __len__(self):
+        return len(self._labels)
+
+    def __getitem__(self, idx):
+        return self._labels[idx]
+
+    @property
+    def labels(self):
+        return self._labels
+
+    @property
+    def countries(self):
+        """The countries in the order of their first appearance."""
+        return list(self._countries)
+
+    def index(self, country, name):
+        """
+        :return: int
+                Position of the label with this country and name or code
+        """
+        try:
+            idx = self._table[self._countries[country], self._names[name]]
+        except KeyError:
+            idx = -1
+        if idx < 0:
+            raise KeyError((country, name))
+        return int(idx)
+
+    def indices(self, countries, names):
+        """
+        Translates countries and names to positions. Each distinct country
+        and name is looked up once, the combinations are found with array
+        indexing.
+
+        :param countries: list or str
+                Countries, broadcast against names
+        :param names: list or str
+                Names or codes
+        :return: numpy array
+                Positions with the broadcast shape of countries and names
+        """
+        country_codes = self._codes(self._countries, countries)
+        name_codes = self._codes(self._names, names)
+        country_codes, name_codes = np.broadcast_arrays(country_codes,
+                                                        name_codes)
+        result = np.full(country_codes.shape, -1, dtype=np.intp)
+        known = (country_codes >= 0) & (name_codes >= 0)
+        result[known] = self._table[country_codes[known], name_codes[known]]
+        if np.any(result < 0):
+            pos = tuple(np.argwhere(result < 0)[0])
+            countries = np.broadcast_to(np.asarray(countries, dtype=object),
+                                        result.shape)
+            names = np.broadcast_to(np.asarray(names, dtype=object),
+                                    result.shape)
+            raise KeyError((countries[pos], names[pos]))
+        return result
+
+    @staticmethod
+    def _codes(categories, values):
+        values = np.asarray(values, dtype=object)
+        unique, inverse = np.unique(values.ravel(), return_inverse=True)
+        codes = np.array([categories.get(value, -1) for value in unique],
+                         dtype=np.intp)
+        return codes[inverse].reshape(values.shape)
+
+    def positions(self, names, countries=None):
+        """
+        Positions of names in every country, e.g. of the primary material
+        products in all countries.
+
+        :param countries: list, optional
+                By default all countries
+        :return: numpy array
+                One row per country and one column per name, ravel gives
+                the positions country by country
+        """
+        if countries is None:
+            countries = self.countries
+        return self.indices(np.asarray(countries, dtype=object)[:, None],
+                            np.asarray(names, dtype=object)[None, :])
+
+    def country_slice(self, country):
+        """
+        :return: slice
+                The block of positions of the country
+        """
+        return self._blocks[country]
+
+    def country_blocks(self):
+        """
+        :return: dict
+                The slice of each country, in the order of the countries
+        """
+        return dict(self._blocks)
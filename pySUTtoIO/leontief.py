@@ -0,0 +1,441 @@
+import collections
+import inspect
+import numpy as np
+import scipy.linalg as sla
+import scipy.sparse as sp
+import scipy.sparse.linalg as spla
+import pySUTtoIO.instrumentation as ins
+
+
+SolverReport = collections.namedtuple(
+    'SolverReport', ['method', 'iterations', 'residual', 'converged'])
+
+# scipy 1.12 renamed the relative tolerance of gmres from tol to rtol
+_gmres_tol = 'rtol' if 'rtol' in inspect.signature(spla.gmres).parameters \
+    else 'tol'
+
+
+class LeontiefSolver:
+    """Solves Leontief systems (I - A) x = y. The matrix I - A is LU
+    factorized once, after which every product with the Leontief inverse L
+    is obtained by triangular solves. The full L is only built on request.
+    A sparse A is factorized with a sparse LU decomposition.
+
+    The factorization is done in double precision, also for a single
+    precision A. With dtype float32 it is done in single precision, which
+    halves its memory, and refine steps of iterative refinement bring the
+    solutions back to double precision accuracy: the residual of each
+    solution is calculated in double precision with A and the correction
+    is solved with the single precision factors. The outcome of the
+    refinement of the last solve is available as report."""
+
+    def __init__(self, A, dtype=np.float64, refine=0):
+        """
+        :param dtype: numpy dtype
+                Precision of the factorization, float64 or float32
+        :param refine: int
+                Maximum number of refinement steps of each solve
+        """
+        self._size = A.shape[0]
+        self.dtype = np.dtype(dtype)
+        self.refine = refine
+        self.report = None
+        if sp.issparse(A):
+            A = sp.csc_matrix(A)
+            A.data = np.nan_to_num(A.data)
+            identity = sp.identity(self._size, format='csc')
+            self._lu = None
+            self._splu = spla.splu((identity - A).astype(self.dtype,
+                                                         copy=False))
+        else:
+            A = np.nan_to_num(A)
+            identity = np.identity(self._size, dtype=self.dtype)
+            self._lu = sla.lu_factor(identity - A.astype(self.dtype,
+                                                         copy=False))
+            self._splu = None
+        # A is only kept for the residuals of the refinement
+        self._A = A if refine > 0 else None
+
+    def factors(self):
+        """
+        :return: tuple
+                The LU factors and pivots of a dense factorization, see
+                scipy.linalg.lu_factor, None for a sparse factorization
+        """
+        return self._lu
+
+    @classmethod
+    def from_factors(cls, lu, piv, A=None, refine=0):
+        """
+        Creates a solver from saved dense LU factors of I - A. A is only
+        needed for iterative refinement.
+        """
+        solver = cls.__new__(cls)
+        solver._size = lu.shape[0]
+        solver.dtype = lu.dtype
+        solver.refine = refine
+        solver.report = None
+        solver._lu = (lu, piv)
+        solver._splu = None
+        solver._A = np.nan_to_num(A) if refine > 0 else None
+        return solver
+
+    def _factor_solve(self, b, trans=0):
+        b = np.asarray(b, dtype=self.dtype)
+        if self._splu is not None:
+            return self._splu.solve(b, trans='T' if trans else 'N')
+        return sla.lu_solve(self._lu, b, trans=trans)
+
+    def _solve(self, b, trans=0):
+        if sp.issparse(b):
+            b = b.toarray()
+        x = self._factor_solve(b, trans).astype(np.float64)
+        if self.refine == 0:
+            return x
+        A = self._A.T if trans else self._A
+        b = np.asarray(b, dtype=np.float64)
+        b_norm = np.linalg.norm(b)
+        if b_norm == 0:
+            b_norm = 1
+        tol = np.finfo(np.float64).eps * np.sqrt(self._size)
+        iterations = 0
+        residual = b - x + A @ x
+        while iterations < self.refine:
+            if np.linalg.norm(residual) / b_norm <= tol:
+                break
+            x += self._factor_solve(residual, trans)
+            iterations += 1
+            residual = b - x + A @ x
+        residual = np.linalg.norm(residual) / b_norm
+        self.report = SolverReport('lu', iterations, residual,
+                                   residual <= tol)
+        return x
+
+    def solve(self, y):
+        """
+        Calculates the total output needed to deliver a final demand.
+
+        :param y: numpy array
+                Final demand vector
+        :return: numpy array
+                The vector L y
+        """
+        return self._solve(y)
+
+    def solve_many(self, Y):
+        """
+        Calculates the total output for each column of a final demand
+        matrix in a single call.
+
+        :param Y: numpy array
+                Final demand matrix with one column per final demand vector
+        :return: numpy array
+                The matrix L Y
+        """
+        return self._solve(Y)
+
+    def solve_transpose(self, B):
+        """
+        Calculates multipliers by solving the transposed system.
+
+        :param B: numpy array
+                Coefficient vector or matrix with one row per extension
+        :return: numpy array
+                The multipliers B L, with the same shape as B
+        """
+        return np.transpose(self._solve(np.transpose(B), trans=1))
+
+    def inverse(self):
+        """
+        Builds the full Leontief inverse.
+
+        :return: numpy array
+                The matrix L = (I - A)^-1
+        """
+        return self._solve(np.identity(self._size))
+
+    def inverse_rows(self, start, stop):
+        """
+        Builds a block of rows of the Leontief inverse.
+
+        :return: numpy array
+                The rows start up to stop of L
+        """
+        return self.solve_transpose(np.eye(stop - start, self._size, k=start))
+
+
+class UpdatedLeontiefSolver:
+    """Solves Leontief systems of a changed coefficient matrix A + P Q^T,
+    where the change has a low rank k, without a new factorization. With
+    the Sherman-Morrison-Woodbury identity the new Leontief inverse is
+
+        L' = L + L P (I - Q^T L P)^-1 Q^T L
+
+    so each solve needs a solve with the solver of A and products with
+    k by n matrices. The k columns of L P and rows of Q^T L are solved once.
+    Updating an updated solver stacks the changes on the original solver."""
+
+    def __init__(self, solver, P, Q):
+        """
+        :param solver: LeontiefSolver, IterativeLeontiefSolver or
+                UpdatedLeontiefSolver
+                Solver of the original coefficient matrix
+        :param P: numpy array
+                Left factor of the change, n by k
+        :param Q: numpy array
+                Right factor of the change, n by k
+        """
+        P = np.reshape(P, (np.shape(P)[0], -1))
+        Q = np.reshape(Q, (np.shape(Q)[0], -1))
+        if isinstance(solver, UpdatedLeontiefSolver):
+            P = np.hstack([solver._P, P])
+            Q = np.hstack([solver._Q, Q])
+            solver = solver._base
+        self._base = solver
+        self._size = P.shape[0]
+        self._P = P
+        self._Q = Q
+        self._LP = solver.solve_many(P)
+        self._QL = solver.solve_transpose(Q.T)
+        capacitance = np.identity(P.shape[1]) - Q.T @ self._LP
+        self._capacitance = sla.lu_factor(capacitance)
+
+    @property
+    def rank(self):
+        return self._P.shape[1]
+
+    def solve(self, y):
+        """
+        Calculates the total output needed to deliver a final demand.
+
+        :param y: numpy array
+                Final demand vector
+        :return: numpy array
+                The vector L' y
+        """
+        x = self._base.solve(y)
+        return x + self._LP @ sla.lu_solve(self._capacitance, self._Q.T @ x)
+
+    def solve_many(self, Y):
+        """
+        Calculates the total output for each column of a final demand
+        matrix in a single call.
+
+        :return: numpy array
+                The matrix L' Y
+        """
+        return self.solve(Y)
+
+    def solve_transpose(self, B):
+        """
+        Calculates multipliers by solving the transposed system.
+
+        :return: numpy array
+                The multipliers B L', with the same shape as B
+        """
+        z = self._base.solve_transpose(B)
+        w = sla.lu_solve(self._capacitance, np.transpose(z @ self._P),
+                         trans=1)
+        return z + np.transpose(w) @ self._QL
+
+    def inverse(self):
+        """
+        Builds the full Leontief inverse.
+
+        :return: numpy array
+                The matrix L'
+        """
+        return self.inverse_rows(0, self._size)
+
+    def inverse_rows(self, start, stop):
+        """
+        Builds a block of rows of the Leontief inverse.
+
+        :return: numpy array
+                The rows start up to stop of L'
+        """
+        correction = sla.lu_solve(self._capacitance, self._QL)
+        return self._base.inverse_rows(start, stop) + \
+            self._LP[start:stop] @ correction
+
+
+def update_inverse(L, P, Q):
+    """
+    Updates a full Leontief inverse for the change P Q^T of the coefficient
+    matrix with the Sherman-Morrison-Woodbury identity.
+
+    :return: numpy array
+            The Leontief inverse of A + P Q^T
+    """
+    LP = L @ P
+    QL = Q.T @ L
+    capacitance = np.identity(P.shape[1]) - Q.T @ LP
+    return L + LP @ np.linalg.solve(capacitance, QL)
+
+
+class IterativeLeontiefSolver:
+    """Solves Leontief systems (I - A) x = y iteratively without factorizing
+    I - A. Two methods are available: 'power', a truncated power series
+    x = y + A y + A^2 y + ..., and 'gmres', a Krylov solver. Both only need
+    products with A, so a sparse A scales to resolutions that cannot be
+    inverted in memory. Each solve is warm started from the previous
+    solution of the same shape, or from an explicitly given x0. The outcome
+    of the last solve is available as report."""
+
+    methods = ('power', 'gmres')
+
+    def __init__(self, A, method='power', tol=1E-10, maxiter=1000, x0=None):
+        assert method in self.methods
+        if sp.issparse(A):
+            A = sp.csr_matrix(A)
+            A.data = np.nan_to_num(A.data)
+        else:
+            A = np.nan_to_num(A)
+        self._A = A
+        self._size = A.shape[0]
+        self.method = method
+        self.tol = tol
+        self.maxiter = maxiter
+        self._previous = {}
+        if x0 is not None:
+            self._previous[np.shape(x0)] = x0
+        self.report = None
+
+    def _start(self, y, x0):
+        if x0 is None:
+            x0 = self._previous.get(np.shape(y))
+        if x0 is None:
+            return np.array(y, dtype=np.float64)
+        return np.array(x0, dtype=np.float64)
+
+    def _iterate(self, A, y, x0):
+        x = self._start(y, x0)
+        y_norm = np.linalg.norm(y)
+        if y_norm == 0:
+            y_norm = 1
+        if self.method == 'power':
+            iterations = 0
+            residual = np.linalg.norm(y - x + A @ x) / y_norm
+            while residual > self.tol and iterations < self.maxiter:
+                x = y + A @ x
+                iterations += 1
+                residual = np.linalg.norm(y - x + A @ x) / y_norm
+        else:
+            operator = spla.LinearOperator(
+                (self._size, self._size), matvec=lambda v: v - A @ v,
+                dtype=np.float64)
+            counts = []
+
+            def count(pr_norm):
+                counts[-1] += 1
+
+            columns = x.reshape(self._size, -1).copy()
+            rhs = np.reshape(y, (self._size, -1))
+            for idx in range(columns.shape[1]):
+                counts.append(0)
+                columns[:, idx], _ = spla.gmres(
+                    operator, rhs[:, idx], x0=columns[:, idx], atol=0,
+                    maxiter=self.maxiter, callback_type='pr_norm',
+                    callback=count, **{_gmres_tol: self.tol})
+            iterations = max(counts)
+            x = columns.reshape(np.shape(y))
+            residual = np.linalg.norm(y - x + A @ x) / y_norm
+        converged = residual <= self.tol
+        self.report = SolverReport(self.method, iterations, residual,
+                                   converged)
+        if not converged:
+            ins.logger.warning('%s solver did not converge, relative '
+                               'residual is %s', self.method, residual)
+        return x
+
+    def solve(self, y, x0=None):
+        """
+        Calculates the total output needed to deliver a final demand.
+
+        :param y: numpy array
+                Final demand vector
+        :param x0: numpy array, optional
+                Initial guess, by default the previous solution
+        :return: numpy array
+                The vector L y
+        """
+        x = self._iterate(self._A, y, x0)
+        self._previous[np.shape(y)] = x
+        return x
+
+    def solve_many(self, Y, x0=None):
+        """
+        Calculates the total output for each column of a final demand
+        matrix.
+
+        :param Y: numpy array
+                Final demand matrix with one column per final demand vector
+        :param x0: numpy array, optional
+                Initial guess, by default the previous solution
+        :return: numpy array
+                The matrix L Y
+        """
+        return self.solve(Y, x0)
+
+    def solve_transpose(self, B, x0=None):
+        """
+        Calculates multipliers by solving the transposed system.
+
+        :param B: numpy array
+                Coefficient vector or matrix with one row per extension
+        :param x0: numpy array, optional
+                Initial guess of the multipliers
+        :return: numpy array
+                The multipliers B L, with the same shape as B
+        """
+        B = np.transpose(B.toarray() if sp.issparse(B) else B)
+        if x0 is not None:
+            x0 = np.transpose(x0)
+        return np.transpose(self._iterate(self._A.T, B, x0))
+
+    def inverse(self):
+        """
+        Builds the full Leontief inverse column by column.
+
+        :return: numpy array
+                The matrix L = (I - A)^-1
+        """
+        return self.solve_many(np.identity(self._size))
+
+    def inverse_rows(self, start, stop):
+        """
+        Builds a block of rows of the Leontief inverse.
+
+        :return: numpy array
+                The rows start up to stop of L
+        """
+        return self.solve_transpose(np.eye(stop - start, self._size, k=start))
+
+    def with_matrix(self, A):
+        """
+        Creates a solver for another coefficient matrix with the same
+        settings, warm started from the solutions of this solver.
+        """
+        solver = IterativeLeontiefSolver(A, self.method, self.tol,
+                                         self.maxiter)
+        solver._previous = dict(self._previous)
+        return solver
+
+
+def make_solver(A, method='lu', **options):
+    """
+    Creates a Leontief solver for the coefficient matrix A.
+
+    :param A: numpy array or scipy sparse matrix
+            Input-output coefficient matrix
+    :param method: str
+            'lu' for a factorization, 'power' or 'gmres' for an
+            iterative solver
+    :param options:
+            Options of the factorization: dtype and refine, or of the
+            iterative solver: tol, maxiter and x0
+    :return: LeontiefSolver or IterativeLeontiefSolver
+    """
+    if method == 'lu':
+        return LeontiefSolver(A, **options)
+    return IterativeLeontiefSolver(A, method, **options)
@@ -2,14 +2,39 @@ import numpy as np
 import os.path
 import glob
 import pySUTtoIO.sut as st
+import pySUTtoIO.bundle as bd
+import pySUTtoIO.dimensions as dm
+import pySUTtoIO.writer as wr
 import pySUTtoIO.transformation_model_b as mb
 import pySUTtoIO.make_ramascene_data as rama
+import pySUTtoIO.batch as bt
+import pySUTtoIO.instrumentation as ins
+import pySUTtoIO.disk_cache as dc
 
 
-def main(data_dir, model, make_secondary):
+def main(data_dir, model, make_secondary, mmap_mode=None, precision='double',
+         dimensions=dm.exiobase, cache_dir=None):
     """"
     added model so that this module can be use as interface to call the
     specific model types
+
+    With mmap_mode 'c' the input files are memory mapped copy-on-write
+    instead of read into memory: processes working on the same year share
+    the page cache and only pages changed by the secondary flow
+    reallocation are copied. Mode 'r' maps the files read-only.
+
+    When data_dir holds a bundle file it is used instead of the separate
+    .npy files. The .npy files are checked against dimensions, a bundle
+    file holds its own dimensions.
+
+    With precision 'single' the tables are transformed and saved in
+    float32, see TransformationModelB. The checks log the largest error of
+    each balance, which shows the error introduced by single precision.
+
+    With cache_dir the derived matrices are kept in a disk cache in
+    cache_dir, which can be shared by all years and runs; matrices of which
+    the inputs and settings did not change are read from it, see
+    disk_cache.
     """
 
     # SETTINGS
@@ -26,72 +51,156 @@ def main(data_dir, model, make_secondary):
     full_factor_inputs_fn = os.path.join(data_dir, factorinputs_filename)
     full_extensions_fn = os.path.join(data_dir, extensions_filename)
 
+    full_bundle_fn = os.path.join(data_dir, bd.bundle_filename)
+
     # LOAD FILES AND CREATE SUT DATA TRANSFER OBJECT
-    sut = st.Sut()
-    sut.use = np.load(full_use_fn)
-    sut.supply = np.load(full_supply_fn)
-    sut.final_use = np.load(full_finaldemands_fn)
-    sut.factor_inputs = np.load(full_factor_inputs_fn)
-    sut.extensions = np.load(full_extensions_fn)
+    with ins.stage('load', data_dir=data_dir):
+        if os.path.exists(full_bundle_fn):
+            sut = st.Sut.open_bundle(full_bundle_fn, mmap_mode=mmap_mode)
+        else:
+            sut = st.Sut(dimensions)
+            sut.use = np.load(full_use_fn, mmap_mode=mmap_mode)
+            sut.supply = np.load(full_supply_fn, mmap_mode=mmap_mode)
+            sut.final_use = np.load(full_finaldemands_fn,
+                                    mmap_mode=mmap_mode)
+            sut.factor_inputs = np.load(full_factor_inputs_fn,
+                                        mmap_mode=mmap_mode)
+            sut.extensions = np.load(full_extensions_fn, mmap_mode=mmap_mode)
     # should add one for final demand emissions
 
     # CREATE PXP-ITA IOT
-    md_b = mb.TransformationModelB(sut, make_secondary)
+    cache = None if cache_dir is None else dc.DiskCache(cache_dir)
+    md_b = mb.TransformationModelB(sut, make_secondary, precision=precision,
+                                   cache=cache)
     # model_b = md_b.io_coefficient_matrix()
 
     # CHECK IO TABLE
-    if not md_b.check_io_transaction_matrix():
-        print('Model B transaction matrix not correct')
-    if not md_b.check_io_coefficients_matrix():
-        print('Model B coefficients matrix not correct')
-    if not md_b.check_ext_transaction_matrix():
-        print('Model B extension matrix not correct')
-    if not md_b.check_ext_coefficient_matrix():
-        print('Model B extension coefficients matrix not correct')
+    with ins.stage('checks'):
+        for check, description in [
+                (md_b.check_io_transaction_matrix, 'transaction matrix'),
+                (md_b.check_io_coefficients_matrix, 'coefficients matrix'),
+                (md_b.check_ext_transaction_matrix, 'extension matrix'),
+                (md_b.check_ext_coefficient_matrix,
+                 'extension coefficients matrix')]:
+            report = check()
+            ins.logger.info('%s', report)
+            if not report:
+                ins.logger.warning('Model B %s not correct\n%s',
+                                   description, report)
 
     return(md_b)
 
 
-def launch(or_sut_data_dir, model, save_dir, make_secondary, project=0):
+# files saved for each year by launch_year, per project
+output_filenames = {0: ['A.npy', 'L.npy', 'Y.npy', 'B.npy', 'W.npy'],
+                    1: ['A_v4.npy', 'L_v4.npy', 'Y_v4.npy', 'B_v4.npy']}
+
+
+def launch_year(data_dir, model, directory, make_secondary, project=0,
+                mmap_mode=None, precision='double', dimensions=dm.exiobase,
+                cache_dir=None):
+    """
+    Transforms the supply-use tables of one year in data_dir and saves the
+    results in directory.
+    """
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+
+    # This is a quick fix. This is data only needed for RaMa-SCENE
+    # please update script to output everything
+    A_file_name = os.path.join(directory, 'A.npy')
+    L_file_name = os.path.join(directory, 'L.npy')
+    Y_file_name = os.path.join(directory, 'Y.npy')
+    B_file_name = os.path.join(directory, 'B.npy')
+    W_file_name = os.path.join(directory, 'W.npy')
+
+    IO_tables = main(data_dir, model, make_secondary, mmap_mode, precision,
+                     dimensions, cache_dir)
+    # 11. SAVING MULTIREGIONAL DATA AS BINARY NUMPY ARRAY OBJECT
+    # every output is written as soon as it is ready and the intermediates
+    # are released right after, the Leontief inverse is never held in full
+    if project == 0:
+        with ins.stage('save Y'):
+            wr.save(Y_file_name, IO_tables.final_demand())
+        with ins.stage('save B'):
+            wr.save(B_file_name, IO_tables.ext_coefficients_matrix())
+        IO_tables.release('ext_Z', 'ext_A')
+        with ins.stage('save W'):
+            wr.save(W_file_name,
+                    IO_tables.factor_inputs_coefficients_matrix())
+        IO_tables.release('fi_Z', 'fi_A')
+        with ins.stage('save A'):
+            wr.save(A_file_name, IO_tables.io_coefficient_matrix())
+        product_cnt = len(IO_tables.q)
+        with ins.stage('save L'):
+            # I - A is only factorized when L is not in the disk cache
+            if not IO_tables.restore_file('L', L_file_name):
+                leontief = IO_tables.leontief()
+                IO_tables.release('T', 'Z', 'A')
+                wr.save_row_blocks(L_file_name, (product_cnt, product_cnt),
+                                   leontief.inverse_rows,
+                                   dtype=IO_tables.dtype)
+                IO_tables.persist_file('L', L_file_name)
+        IO_tables.release('T', 'Z', 'A', 'LU')
+
+    elif project == 1:
+        with ins.stage('make_ramascene_data'):
+            rama.main(directory, IO_tables)
+
+
+def launch(or_sut_data_dir, model, save_dir, make_secondary, project=0,
+           max_workers=1, resume=False, memory_per_year=None,
+           blas_threads=None, mmap_mode=None, trace_dir=None,
+           trace_memory=False, precision='double', dimensions=dm.exiobase,
+           cache_dir=None, years=None):
     """
     project = 0 (EXIOBASE), 1 (RaMa-SCENE)
 
+    By default every year directory in or_sut_data_dir is transformed,
+    years limits this to a list of years.
+
+    Years are transformed concurrently when max_workers is larger than one,
+    see batch.run_years for the other scheduling options. Returns the
+    per-year timing summary. See main for mmap_mode, precision and
+    dimensions.
+
+    With trace_dir the stage timings of each year are saved as JSON trace
+    in trace_dir, see instrumentation.
+
+    With cache_dir the derived matrices are cached on disk, so a rerun
+    with another save_dir, or after changing back make_secondary, reads
+    them instead of computing them again.
     """
     if save_dir == "":
         save_dir = os.path.expanduser("~\\Documents\\pySUTtoIO\\")
 
-    years = glob.glob(os.path.join(os.path.abspath(or_sut_data_dir), "*/"))
+    year_dirs = sorted(glob.glob(os.path.join(
+        os.path.abspath(or_sut_data_dir), "*/")))
+    if years is not None:
+        years = {str(yr) for yr in years}
 
-    for data_dir_yr in years:
+    jobs = []
+    for data_dir_yr in year_dirs:
         yr_string = str(data_dir_yr[-5: -1])  # getting the name of the year
+        if years is not None and yr_string not in years:
+            continue
 
         if project == 0:
             directory = os.path.join(save_dir, yr_string)
         elif project == 1:
             directory = os.path.join(save_dir, "ramascene", yr_string)
 
-        if not os.path.exists(directory):
-            os.makedirs(directory)
-
-        # This is a quick fix. This is data only needed for RaMa-SCENE
-        # please update script to output everything
-        A_file_name = os.path.join(directory, 'A.npy')
-        L_file_name = os.path.join(directory, 'L.npy')
-        Y_file_name = os.path.join(directory, 'Y.npy')
-        B_file_name = os.path.join(directory, 'B.npy')
-        W_file_name = os.path.join(directory, 'W.npy')
-
-        print('Reading multi-regional supply-use tables for year {} '
-              .format(yr_string))
-        IO_tables = main(os.path.join(os.path.abspath(or_sut_data_dir),
-                                      yr_string), model, make_secondary)
-        # 11. SAVING MULTIREGIONAL DATA AS BINARY NUMPY ARRAY OBJECT
-        if project == 0:
-            np.save(A_file_name, IO_tables.io_coefficient_matrix())
-            np.save(L_file_name, IO_tables.io_total_requirement_matrix())
-            np.save(Y_file_name, IO_tables.final_demand())
-            np.save(B_file_name, IO_tables.ext_coefficients_matrix())
-            np.save(W_file_name, IO_tables.factor_inputs_coefficients_matrix())
-
-        elif project == 1:
-            rama.main(directory, IO_tables)
+        jobs.append(bt.YearJob(yr_string,
+                               os.path.join(os.path.abspath(or_sut_data_dir),
+                                            yr_string),
+                               directory))
+
+    summary = bt.run_years(jobs, model, make_secondary, project,
+                           max_workers=max_workers, resume=resume,
+                           memory_per_year=memory_per_year,
+                           blas_threads=blas_threads, mmap_mode=mmap_mode,
+                           trace_dir=trace_dir, trace_memory=trace_memory,
+                           precision=precision, dimensions=dimensions,
+                           cache_dir=cache_dir)
+    ins.logger.info('Summary of the years\n%s', bt.format_summary(summary))
+    return summary
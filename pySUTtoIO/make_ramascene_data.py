@@ -35,96 +35,135 @@ import numpy as np
 import os.path
 import copy
 import pySUTtoIO.tools as tools
-
-
-def main(directory, IO_tables):
+import pySUTtoIO.leontief as lt
+import pySUTtoIO.balance as balance
+import pySUTtoIO.writer as writer
+import pySUTtoIO.aggregation as aggregation
+import pySUTtoIO.characterization as characterization
+import pySUTtoIO.instrumentation as ins
+
+
+def main(directory, IO_tables, fd_groups=None, indicators=None,
+         va_index=range(9), product_groups=None):
+    """
+    :param fd_groups: list, optional
+            Groups of the final demand categories of a country that are
+            saved as columns of Y, by default one column per country, see
+            aggregation.regroup_final_demand
+    :param indicators: Characterization, optional
+            Indicators of B, by default indicators_v3.txt with the GHG and
+            material rows of characterization.ramascene_layout
+    :param va_index: list
+            Rows of the factor inputs that are value added
+    :param product_groups: Concordance, optional
+            Groups of the products of a country of which indicators with
+            product_inputs rows, such as indicators_v2.txt, hold the input
+            coefficients, by default prd_aggregation.txt
+    """
 
     # SETTINGS
-    ghg_index = [0, 1, 2, 27, 28, 29, 52, 53, 54, 55, 56, 57, 58, 59, 77, 78,
-                 403, 404, 405, 406, 407, 410]
-    va_index = [0, 1, 2, 3, 4, 5, 6, 7, 8]
-    material_index = range(419, 439, 1)
+    if indicators is None:
+        indicators = characterization.load()
     tolerance = 1E-3
-    prd_cnt = 200
-    fd_cnt = 7
-    cntr_cnt = 49
-
-    Z = IO_tables.io_transaction_matrix()
-    Y = IO_tables.final_demand()
-    W = IO_tables.factor_inputs_transaction_matrix()
-    extensions = IO_tables.ext_transaction_matrix()
-    indicators_dir = "data/auxiliary/indicators_v3.txt"
-    indicators = tools.csv_file_to_list(indicators_dir, delimiter='\t')
-    H = tools.list_to_numpy_array(indicators, 0, 0)
+    dimensions = IO_tables.dimensions
+    prd_cnt = dimensions.prd_cnt
+    fd_cnt = dimensions.fd_cnt
+    cntr_cnt = dimensions.cntr_cnt
 
-    va = np.sum(W[va_index, :], axis=0, keepdims=True)
-    E = extensions[:417, :]
-    E = E[ghg_index, :]  # select CO2, CH4 and N2O emissions
-    M = extensions[417:, :]
+    # CREATE CANONICAL FILENAMES
+    full_io_fn = os.path.join(directory, 'A_v4.npy')
+    full_leontief_fn = os.path.join(directory, 'L_v4.npy')
+    full_finaldemand_fn = os.path.join(directory, 'Y_v4.npy')
+    full_extensions_fn = os.path.join(directory, 'B_v4.npy')
 
-    M = M[material_index, :]  # "domestic extraction used" metals and minerals
-    o_coeff = np.zeros((1, prd_cnt * cntr_cnt))  # dummy place holder
-    M = np.vstack((o_coeff, W, E, M))  # stack all extensions
-    M = np.dot(np.transpose(H), M)
+    # Every matrix is saved as soon as it is ready and freed right after,
+    # the Leontief inverse is written in row blocks
+    Z = IO_tables.io_transaction_matrix()
+    # the final demand categories are collapsed before the Leontief
+    # inverse, so every product with Y acts on the collapsed columns
+    with ins.stage('regroup_final_demand'):
+        Y = IO_tables.final_demand()
+        fd = tools.row_sums(Y).reshape(-1, 1)
+        Y = aggregation.regroup_final_demand(Y, fd_cnt, fd_groups)
+    W = tools.to_dense(IO_tables.factor_inputs_transaction_matrix())
+    IO_tables.release('fi_Z', 'fi_A', 'ext_Z', 'ext_A')
+    va = np.sum(W[list(va_index), :], axis=0, keepdims=True)
+
+    # only the extension rows with a characterization factor are
+    # transformed, the indicators are sparse products over these rows; the
+    # placeholder row of the total output coefficients stays zero
+    with ins.stage('characterization'):
+        indicators.check('factor_inputs', W.shape[0])
+        indicators.check('extensions', IO_tables.extensions.shape[0])
+        selected = {}
+        if 'factor_inputs' in indicators.rows:
+            selected['factor_inputs'] = W[indicators.rows['factor_inputs']]
+        if 'product_inputs' in indicators.rows:
+            # inputs of each product group, from all countries
+            if product_groups is None:
+                product_groups = aggregation.Concordance.from_file()
+            rows = aggregation.multiregional(
+                aggregation.Concordance([None] * cntr_cnt),
+                product_groups).sum_rows(Z)
+            indicators.check('product_inputs', rows.shape[0])
+            selected['product_inputs'] = tools.to_dense(rows)[
+                indicators.rows['product_inputs']]
+        if 'extensions' in indicators.rows:
+            selected['extensions'] = IO_tables.ext_transaction_matrix(
+                indicators.rows['extensions'])
+        M = indicators.apply_rows(selected)
+    del W
+    del selected
 
     # CALCULATE TOTALS
-    to = np.sum(Z, axis=1, keepdims=True) + np.sum(Y, axis=1, keepdims=True)  # total output ($)
-    ti = np.transpose(np.sum(Z, axis=0, keepdims=True) + va)  # total outlays ($)
+    to = tools.row_sums(Z).reshape(-1, 1) + fd  # total output ($)
+    # total outlays ($)
+    ti = np.transpose(tools.column_sums(Z).reshape(1, -1) + va)
+    del va
 
     # CALCULATE COEFFICIENTS
-    A = np.dot(Z, tools.invdiag(to[:, 0]))  # input-output coefficients matrix ($/$)
-    B = np.dot(M, tools.invdiag(to[:, 0]))  # extension coefficients (xx/$)
+    # input-output coefficients matrix ($/$)
+    A = tools.inv_scale_columns(Z, to[:, 0])
+    del Z
+    # A is scaled with the total output including final demand, so the
+    # factorization of the model is not reused; its matrices are freed
+    # before I - A is factorized here
+    IO_tables.release('Z', 'T', 'A', 'LU', 'L')
+    writer.save(full_io_fn, A)
+    B = tools.inv_scale_columns(M, to[:, 0])  # extension coefficients (xx/$)
+    del M
 
     # FILL IN TOTAL OUTPUT COEFFICIENTS IN B MATRIX AND REPLACE DUMMY
     o_coeff = copy.deepcopy(to)
     o_coeff[o_coeff > 0] = 1
     B[0, :] = np.transpose(o_coeff)
+    writer.save(full_extensions_fn, B)
+    del B
 
     # LEONTIEF INVERSE
-    I = np.eye(prd_cnt * cntr_cnt)     # unity matrix ($)
-    L = np.linalg.inv(I - A)           # Leontief inverse matrix ($/$)
+    with ins.stage('leontief_inverse'):
+        leontief = lt.LeontiefSolver(A)    # factorization of I - A
+        del A
+        # Leontief inverse matrix ($/$)
+        writer.save_row_blocks(full_leontief_fn,
+                               (prd_cnt * cntr_cnt, prd_cnt * cntr_cnt),
+                               leontief.inverse_rows)
 
     # CHECK
     # balanced to start with ?
-    diff = np.abs(to - ti)
-    for index in np.ndindex(diff.shape):
-        if diff[index] > tolerance:
-            print('difference to and ti larger than {} million Euro. Difference is {} at index {}.'
-                  .format(tolerance, diff[index], index))
+    report = balance.BalanceReport('to and ti', to, ti, abs_tol=tolerance)
+    for index, diff in zip(report.indices, report.abs_error):
+        ins.logger.warning('difference to and ti larger than %s million Euro. '
+                           'Difference is %s at index %s.',
+                           tolerance, diff, index)
 
     # calculated total output equal to to initial total output
-    x = np.dot(L, np.sum(Y, axis=1, keepdims=True))
-    diff = np.abs(x - to)
-    for index in np.ndindex(diff.shape):
-        if diff[index] > tolerance:
-            print('difference x and to larger than {} million Euro. Difference is {} at index {}.'
-                  .format(tolerance, diff[index], index))
-
-    # AGGREGATE FINALDEMAND
-    Y_new = np.zeros([9800, 49])
-    for cntr_idx in range(0, cntr_cnt):
-        for fd_idx in range(0, fd_cnt):
-            old_idx = cntr_idx * fd_cnt + fd_idx
-            new_idx = cntr_idx
-            Y_new[:, new_idx] = Y_new[:, new_idx] + Y[:, old_idx]
-    Y = Y_new
-
-    # SOME DELETING
-    del Z
-    del W
-    del va
-    del E
-    del IO_tables
-    del extensions
-
-    # CREATE CANONICAL FILENAMES
-    full_io_fn = os.path.join(directory, 'A_v4.npy')
-    full_leontief_fn = os.path.join(directory, 'L_v4.npy')
-    full_finaldemand_fn = os.path.join(directory, 'Y_v4.npy')
-    full_extensions_fn = os.path.join(directory, 'B_v4.npy')
+    x = leontief.solve(fd)
+    report = balance.BalanceReport('x and to', to, x, abs_tol=tolerance)
+    for index, diff in zip(report.indices, report.abs_error):
+        ins.logger.warning('difference x and to larger than %s million Euro. '
+                           'Difference is %s at index %s.',
+                           tolerance, diff, index)
 
     # SAVING MULTIREGIONAL DATA AS BINARY NUMPY ARRAY OBJECTS
-    np.save(full_io_fn, A)
-    np.save(full_leontief_fn, L)
-    np.save(full_finaldemand_fn, Y)
-    np.save(full_extensions_fn, B)
+    writer.save(full_finaldemand_fn, Y)
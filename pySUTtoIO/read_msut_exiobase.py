@@ -13,185 +13,221 @@
 # Notice that the symbol v is used for the supply table which has a           #
 # product by industry format.                                                 #
 #                                                                             #
+# The files of a year are parsed concurrently by a pool of worker processes,  #
+# each worker saves its array directly. While the checks of one year run,    #
+# the files of the next year are already being parsed.                        #
+#                                                                             #
 # November 2018                                                               #
 #                                                                             #
 ###############################################################################
 import os.path
+import concurrent.futures
 import numpy as np
 import pySUTtoIO.tools as tl
-
-
-def main():
-
-    # 1. SETUP
-    years = range(2005, 2009)
-    raw_data_dir = os.path.join("data", "raw")
-    clean_data_dir = os.path.join("data", "clean", "msut")
+import pySUTtoIO.table_reader as tr
+import pySUTtoIO.balance as bl
+import pySUTtoIO.writer as wr
+import pySUTtoIO.bundle as bd
+import pySUTtoIO.dimensions as dm
+import pySUTtoIO.instrumentation as ins
+
+# raw text files of one year: output name, file prefix, number of row
+# header columns and number of column header rows
+raw_tables = [('V', 'mrSupply', 3, 2),
+              ('U', 'mrUse', 3, 2),
+              ('Y', 'mrFinalDemand', 3, 2),
+              ('W', 'mrFactorInputs', 2, 2),
+              ('Me', 'mrEmissions', 3, 2),
+              ('Me_dir', 'mrFDEmissions', 3, 2),
+              ('Mm', 'mrMaterials', 2, 2),
+              ('Mm_dir', 'mrFDMaterials', 2, 2),
+              ('Mr', 'mrResources', 3, 2),
+              ('Mr_dir', 'mrFDResources', 3, 2)]
+
+
+def ingest_file(raw_fn, clean_fn, row_header_cnt, col_header_cnt):
+    """
+    Parses one raw text file and saves its values as .npy file.
+
+    :return: tuple
+            The row and column header labels
+    """
+    values, row_headers, column_headers = tr.read_table(
+        raw_fn, row_header_cnt, col_header_cnt)
+    wr.save(clean_fn, values)
+    return row_headers, column_headers
+
+
+def submit_year(executor, raw_data_dir, clean_data_dir, yr_string):
+    """
+    Submits the parsing of all raw files of a year to the executor.
+
+    :return: dict
+            Future with the labels of each file
+    """
+    if not os.path.exists(os.path.join(clean_data_dir, yr_string)):
+        os.makedirs(os.path.join(clean_data_dir, yr_string))
+
+    futures = {}
+    for name, prefix, row_header_cnt, col_header_cnt in raw_tables:
+        raw_fn = os.path.join(raw_data_dir, yr_string,
+                              prefix + '_3.3_' + yr_string + '.txt')
+        clean_fn = os.path.join(clean_data_dir, yr_string, name + '.npy')
+        futures[name] = executor.submit(ingest_file, raw_fn, clean_fn,
+                                        row_header_cnt, col_header_cnt)
+    return futures
+
+
+def unbalance_list(report, labels, label_name):
+    rows = [['index', 'country_code', label_name, 'absolute difference']]
+    for idx, diff in zip(report.indices, report.abs_error):
+        rows.append([idx, labels[idx][0], labels[idx][1], diff])
+    return rows
+
+
+def finish_year(clean_data_dir, yr_string, futures, output_format='npy'):
+    """
+    Checks the balance of the parsed tables of a year and saves the
+    combined extensions, the labels and the unbalances.
+
+    :param output_format: str
+            'npy' for a .npy file per matrix and pickled labels, 'bundle' for
+            a single bundle file with all matrices and labels of the year
+    """
     value_added_index = [0, 1, 2, 3, 4, 5, 6, 7, 8]
-    prd_cnt = 200
-    ind_cnt = 163
-    cntr_cnt = 49
     tolerance = 1E-4
-
-    for yr in years:
-
-        yr_string = str(yr)
-        print('Reading multi-regional supply-use tables for year {} '.format(yr_string))
-
-        # 2. CREATE FILENAMES
-        supply_filename = 'mrSupply_3.3_' + yr_string + '.txt'
-        use_filename = 'mrUse_3.3_' + yr_string + '.txt'
-        finaldemand_filename = 'mrFinalDemand_3.3_' + yr_string + '.txt'
-        factor_inputs_filename = 'mrFactorInputs_3.3_' + yr_string + '.txt'
-        emissions_filename = 'mrEmissions_3.3_' + yr_string + '.txt'
-        direct_emissions_filename = 'mrFDEmissions_3.3_' + yr_string + '.txt'
-        materials_filename = 'mrMaterials_3.3_' + yr_string + '.txt'
-        direct_materials_filename = 'mrFDMaterials_3.3_' + yr_string + '.txt'
-        resources_filename = 'mrResources_3.3_' + yr_string + '.txt'
-        direct_resources_filename = 'mrFDResources_3.3_' + yr_string + '.txt'
-
-        # 3. CREATE CANONICAL FILENAMES
-        full_supply_fn = os.path.join(raw_data_dir, yr_string, supply_filename)
-        full_use_fn = os.path.join(raw_data_dir, yr_string, use_filename)
-        full_finaldemand_fn = os.path.join(raw_data_dir, yr_string, finaldemand_filename)
-        full_factor_inputs_fn = os.path.join(raw_data_dir, yr_string, factor_inputs_filename)
-        full_emissions_fn = os.path.join(raw_data_dir, yr_string, emissions_filename)
-        full_direct_emissions_fn = os.path.join(raw_data_dir, yr_string, direct_emissions_filename)
-        full_materials_fn = os.path.join(raw_data_dir, yr_string, materials_filename)
-        full_direct_materials_fn = os.path.join(raw_data_dir, yr_string, direct_materials_filename)
-        full_resources_fn = os.path.join(raw_data_dir, yr_string, resources_filename)
-        full_direct_resources_fn = os.path.join(raw_data_dir, yr_string, direct_resources_filename)
-
-        # 4. READ FILES
-        supply = tl.csv_file_to_list(full_supply_fn, delimiter='\t')
-        use = tl.csv_file_to_list(full_use_fn, delimiter='\t')
-        final_demands = tl.csv_file_to_list(full_finaldemand_fn, delimiter='\t')
-        factor_inputs = tl.csv_file_to_list(full_factor_inputs_fn, delimiter='\t')
-        emissions = tl.csv_file_to_list(full_emissions_fn, delimiter='\t')
-        direct_emissions = tl.csv_file_to_list(full_direct_emissions_fn, delimiter='\t')
-        materials = tl.csv_file_to_list(full_materials_fn, delimiter='\t')
-        direct_materials = tl.csv_file_to_list(full_direct_materials_fn, delimiter='\t')
-        resources = tl.csv_file_to_list(full_resources_fn, delimiter='\t')
-        direct_resources = tl.csv_file_to_list(full_direct_resources_fn, delimiter='\t')
-
-        # 5. CREATE NUMPY ARRAYS
-        v = tl.list_to_numpy_array(supply, 3, 2)
-        del supply
-        u = tl.list_to_numpy_array(use, 3, 2)
-        del use
-        y = tl.list_to_numpy_array(final_demands, 3, 2)
-        w = tl.list_to_numpy_array(factor_inputs, 2, 2)
-        me = tl.list_to_numpy_array(emissions, 3, 2)
-        me_dir = tl.list_to_numpy_array(direct_emissions, 3, 2)
-        mm = tl.list_to_numpy_array(materials, 2, 2)
-        mm_dir = tl.list_to_numpy_array(direct_materials, 2, 2)
-        mr = tl.list_to_numpy_array(resources, 3, 2)
-        mr_dir = tl.list_to_numpy_array(direct_resources, 3, 2)
-        m = np.concatenate([me, mm, mr], axis=0)
-
-        # 6. CREATE SEARCH LISTS
-        product_labels = tl.get_row_header(final_demands, 3, 2)
-        industry_labels = tl.get_column_header(factor_inputs, 2, 2)
-        finaluse_labels = tl.get_column_header(final_demands, 3, 2)
-        factor_input_labels = tl.get_row_header(factor_inputs, 2, 2)
-        emission_labels = tl.get_row_header(direct_emissions, 3, 2)
-        resource_labels = tl.get_row_header(direct_resources, 3, 2)
-        material_labels = tl.get_row_header(direct_materials, 2, 2)
-        extensions_labels = emission_labels + resource_labels + material_labels
-
-        # 7. CALCULATE TOTALS
-        # total value added
-        va = np.sum(w[value_added_index, :], axis=0, keepdims=True)
-
-        # total product supply and use
-        prd_supply = np.sum(v, axis=1, keepdims=True)
-        prd_use = np.sum(u, axis=1, keepdims=True) + np.sum(y, axis=1, keepdims=True)
-
-        # total industry input and output
-        ind_output = np.transpose(np.sum(v, axis=0, keepdims=True))
-        ind_input = np.transpose(np.sum(u, axis=0, keepdims=True) + va)
-
-        # 8. CHECK
-        unbalanced_prd = list()
-        unbalanced_prd.append(['index', 'country_code', 'product_name', 'absolute difference'])
-        diff = np.abs(prd_supply - prd_use)
-        cnt = 0
-        for idx in range(0, prd_cnt * cntr_cnt):
-            if diff[idx] > tolerance:
-                cnt = cnt + 1
-                row = [idx, product_labels[idx][0], product_labels[idx][1], diff[idx, 0]]
-                unbalanced_prd.append(row)
-        if cnt > 0:
-            print('Warning: {0} unbalanced product supplies and uses found'.format(cnt))
-
-        unbalanced_ind = list()
-        unbalanced_ind.append(['index', 'country_code', 'industry_name', 'absolute difference'])
-        diff = np.abs(ind_output - ind_input)
-        cnt = 0
-        for idx in range(0, ind_cnt * cntr_cnt):
-            if diff[idx] > tolerance:
-                cnt = cnt + 1
-                row = [idx, industry_labels[idx][0], industry_labels[idx][1], diff[idx, 0]]
-                unbalanced_ind.append(row)
-        if cnt > 0:
-            print('Warning: {0} unbalanced industry outputs and inputs found'.format(cnt))
-
-        # 10. CREATE CANONICAL OUTPUT FILENAMES
-        if not os.path.exists(os.path.join(clean_data_dir, yr_string)):
-            os.makedirs(os.path.join(clean_data_dir, yr_string))
-
-        full_supply_fn = os.path.join(clean_data_dir, yr_string, 'V.npy')
-        full_use_fn = os.path.join(clean_data_dir, yr_string, 'U.npy')
-        full_finaldemand_fn = os.path.join(clean_data_dir, yr_string, 'Y.npy')
-        full_factor_inputs_fn = os.path.join(clean_data_dir, yr_string, 'W.npy')
-        full_emissions_fn = os.path.join(clean_data_dir, yr_string, 'Me.npy')
-        full_direct_emissions_fn = os.path.join(clean_data_dir, yr_string, 'Me_dir.npy')
-        full_materials_fn = os.path.join(clean_data_dir, yr_string, 'Mm.npy')
-        full_direct_materials_fn = os.path.join(clean_data_dir, yr_string, 'Mm_dir.npy')
-        full_resources_fn = os.path.join(clean_data_dir, yr_string, 'Mr.npy')
-        full_direct_resources_fn = os.path.join(clean_data_dir, yr_string, 'Mr_dir.npy')
-
-        full_extensions_fn = os.path.join(clean_data_dir, yr_string, 'M.npy')
-
-        full_product_labels_fn = os.path.join(clean_data_dir, yr_string, 'products.pck')
-        full_industries_labels_fn = os.path.join(clean_data_dir, yr_string, 'industries.pck')
-        full_finaluses_labels_fn = os.path.join(clean_data_dir, yr_string, 'finaluses.pck')
-        full_factorinputs_labels_fn = os.path.join(clean_data_dir, yr_string, 'factorinputs.pck')
-        full_emission_labels_fn = os.path.join(clean_data_dir, yr_string, 'emissions.pck')
-        full_resource_labels_fn = os.path.join(clean_data_dir, yr_string, 'resources.pck')
-        full_material_labels_fn = os.path.join(clean_data_dir, yr_string, 'materials.pck')
-
-        full_extensions_labels_fn = os.path.join(clean_data_dir, yr_string, 'extensions.pck')
-
-        full_prd_unbalance_fn = os.path.join(clean_data_dir, yr_string, 'prd_unbalances.txt')
-        full_ind_unbalance_fn = os.path.join(clean_data_dir, yr_string, 'ind_unbalances.txt')
-
-        # 11. SAVING MULTIREGIONAL DATA AS BINARY NUMPY ARRAY OBJECTS
-        np.save(full_supply_fn, v)
-        np.save(full_use_fn, u)
-        np.save(full_finaldemand_fn, y)
-        np.save(full_factor_inputs_fn, w)
-        np.save(full_emissions_fn, me)
-        np.save(full_direct_emissions_fn, me_dir)
-        np.save(full_materials_fn, mm)
-        np.save(full_direct_materials_fn, mm_dir)
-        np.save(full_resources_fn, mr)
-        np.save(full_direct_resources_fn, mr_dir)
-
-        np.save(full_extensions_fn, m)
-
-        tl.list_to_pickle_file(full_product_labels_fn, product_labels)
-        tl.list_to_pickle_file(full_industries_labels_fn, industry_labels)
-        tl.list_to_pickle_file(full_finaluses_labels_fn, finaluse_labels)
-        tl.list_to_pickle_file(full_factorinputs_labels_fn, factor_input_labels)
-        tl.list_to_pickle_file(full_emission_labels_fn, emission_labels)
-        tl.list_to_pickle_file(full_resource_labels_fn, resource_labels)
-        tl.list_to_pickle_file(full_material_labels_fn, material_labels)
-
-        tl.list_to_pickle_file(full_extensions_labels_fn, extensions_labels)
-
-        tl.list_to_csv_file(full_prd_unbalance_fn, unbalanced_prd, delimiter='\t')
-        tl.list_to_csv_file(full_ind_unbalance_fn, unbalanced_ind, delimiter='\t')
-
-
-main()
+    year_dir = os.path.join(clean_data_dir, yr_string)
+
+    labels = {name: future.result() for name, future in futures.items()}
+    product_labels, finaluse_labels = labels['Y']
+    factor_input_labels, industry_labels = labels['W']
+    emission_labels = labels['Me_dir'][0]
+    resource_labels = labels['Mr_dir'][0]
+    material_labels = labels['Mm_dir'][0]
+    extensions_labels = emission_labels + resource_labels + material_labels
+
+    def load(name):
+        return np.load(os.path.join(year_dir, name + '.npy'), mmap_mode='r')
+
+    v = load('V')
+    u = load('U')
+    y = load('Y')
+    w = load('W')
+
+    # 7. CALCULATE TOTALS
+    # total value added
+    va = np.sum(w[value_added_index, :], axis=0, keepdims=True)
+
+    # total product supply and use
+    prd_supply = np.sum(v, axis=1, keepdims=True)
+    prd_use = np.sum(u, axis=1, keepdims=True) + \
+        np.sum(y, axis=1, keepdims=True)
+
+    # total industry input and output
+    ind_output = np.transpose(np.sum(v, axis=0, keepdims=True))
+    ind_input = np.transpose(np.sum(u, axis=0, keepdims=True) + va)
+
+    # 8. CHECK
+    report = bl.BalanceReport('product supply and use', prd_supply, prd_use,
+                              abs_tol=tolerance)
+    unbalanced_prd = unbalance_list(report, product_labels, 'product_name')
+    if not report:
+        ins.logger.warning('%s unbalanced product supplies and uses found',
+                           len(report.indices))
+
+    report = bl.BalanceReport('industry output and input', ind_output,
+                              ind_input, abs_tol=tolerance)
+    unbalanced_ind = unbalance_list(report, industry_labels, 'industry_name')
+    if not report:
+        ins.logger.warning('%s unbalanced industry outputs and inputs '
+                           'found', len(report.indices))
+
+    # 10. CREATE CANONICAL OUTPUT FILENAMES
+    full_extensions_fn = os.path.join(year_dir, 'M.npy')
+
+    full_product_labels_fn = os.path.join(year_dir, 'products.pck')
+    full_industries_labels_fn = os.path.join(year_dir, 'industries.pck')
+    full_finaluses_labels_fn = os.path.join(year_dir, 'finaluses.pck')
+    full_factorinputs_labels_fn = os.path.join(year_dir, 'factorinputs.pck')
+    full_emission_labels_fn = os.path.join(year_dir, 'emissions.pck')
+    full_resource_labels_fn = os.path.join(year_dir, 'resources.pck')
+    full_material_labels_fn = os.path.join(year_dir, 'materials.pck')
+
+    full_extensions_labels_fn = os.path.join(year_dir, 'extensions.pck')
+
+    full_prd_unbalance_fn = os.path.join(year_dir, 'prd_unbalances.txt')
+    full_ind_unbalance_fn = os.path.join(year_dir, 'ind_unbalances.txt')
+
+    # 11. SAVING MULTIREGIONAL DATA AS BINARY NUMPY ARRAY OBJECTS
+    extensions = [load('Me'), load('Mm'), load('Mr')]
+    shape = (sum(len(ext) for ext in extensions), v.shape[1])
+    with wr.NpyWriter(full_extensions_fn, shape) as writer:
+        row_idx = 0
+        for ext in extensions:
+            writer[row_idx:row_idx + len(ext)] = ext
+            row_idx += len(ext)
+
+    tl.list_to_csv_file(full_prd_unbalance_fn, unbalanced_prd, delimiter='\t')
+    tl.list_to_csv_file(full_ind_unbalance_fn, unbalanced_ind, delimiter='\t')
+
+    if output_format == 'bundle':
+        names = [name for name, _, _, _ in raw_tables] + ['M']
+        arrays = {name: load(name) for name in names}
+        bundle_labels = {'products': product_labels,
+                         'industries': industry_labels,
+                         'finaluses': finaluse_labels,
+                         'factorinputs': factor_input_labels,
+                         'emissions': emission_labels,
+                         'resources': resource_labels,
+                         'materials': material_labels,
+                         'extensions': bd.pad_labels(extensions_labels)}
+        dimensions = dm.Dimensions.from_labels(product_labels,
+                                               industry_labels,
+                                               finaluse_labels)
+        bd.write_bundle(os.path.join(year_dir, bd.bundle_filename), arrays,
+                        bundle_labels, {'year': int(yr_string),
+                                        'dimensions': list(dimensions)})
+        del arrays, v, u, y, w, extensions
+        for name in names:
+            os.remove(os.path.join(year_dir, name + '.npy'))
+        return
+
+    tl.list_to_pickle_file(full_product_labels_fn, product_labels)
+    tl.list_to_pickle_file(full_industries_labels_fn, industry_labels)
+    tl.list_to_pickle_file(full_finaluses_labels_fn, finaluse_labels)
+    tl.list_to_pickle_file(full_factorinputs_labels_fn, factor_input_labels)
+    tl.list_to_pickle_file(full_emission_labels_fn, emission_labels)
+    tl.list_to_pickle_file(full_resource_labels_fn, resource_labels)
+    tl.list_to_pickle_file(full_material_labels_fn, material_labels)
+
+    tl.list_to_pickle_file(full_extensions_labels_fn, extensions_labels)
+
+
+def main(raw_data_dir=os.path.join("data", "raw"),
+         clean_data_dir=os.path.join("data", "clean", "msut"),
+         years=range(2005, 2009), max_workers=None, output_format='npy'):
+    """
+    Reads the raw EXIOBASE text files of each year and saves them as numpy
+    arrays. max_workers limits the number of files parsed at the same time,
+    by default one per core. output_format 'bundle' saves each year as a
+    single bundle file, see finish_year.
+    """
+    years = [str(yr) for yr in years]
+    with concurrent.futures.ProcessPoolExecutor(max_workers) as executor:
+        pending = None
+        for idx, yr_string in enumerate(years):
+            if pending is None:
+                pending = submit_year(executor, raw_data_dir, clean_data_dir,
+                                      yr_string)
+            current = pending
+            # parse the next year while the current one is finished
+            if idx + 1 < len(years):
+                pending = submit_year(executor, raw_data_dir, clean_data_dir,
+                                      years[idx + 1])
+            ins.logger.info('Reading multi-regional supply-use tables for '
+                            'year %s', yr_string)
+            finish_year(clean_data_dir, yr_string, current, output_format)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,188 @@
+"""
+Evaluation of many final demand scenarios with one input-output model.
+A stack of final demand matrices (scenarios x products x columns) is
+flattened to one wide matrix, so the Leontief system of all scenarios is
+solved in a single call with the factorization of the model, and the
+footprints B L Y of all scenarios are a single matrix product with the
+multipliers B L. Stacks on disk are processed in chunks of scenarios, so
+the memory use does not depend on the number of scenarios.
+"""
+import os.path
+import numpy as np
+import pySUTtoIO.writer as wr
+
+
+def _flatten(stack):
+    """(s, n, k) stack to a (n, s * k) matrix."""
+    s, n, k = stack.shape
+    return np.transpose(stack, (1, 0, 2)).reshape(n, s * k)
+
+
+def _unflatten(matrix, s, k):
+    """(m, s * k) matrix to a (s, m, k) stack."""
+    return np.transpose(matrix.reshape(-1, s, k), (1, 0, 2))
+
+
+class ScenarioEngine:
+    """Outputs, footprints and country totals of stacks of final demand
+    matrices, all using the Leontief solver of one model."""
+
+    results = ('outputs', 'footprints', 'country_outputs',
+               'country_footprints')
+
+    def __init__(self, model, extension_rows=None):
+        """
+        :param model: TransformationModelB
+                Model of which the Leontief solver and extension
+                coefficients are used
+        :param extension_rows: list, optional
+                Rows of the extensions to calculate footprints for, by
+                default all
+
+        The country totals use the product labels of the model, or its
+        dimensions when it has no product labels.
+        """
+        self._model = model
+        self._solver = model.leontief()
+        B = model.ext_coefficients_matrix()
+        if extension_rows is not None:
+            B = B[extension_rows]
+        self._B = B
+        self._multipliers = None
+        product_index = model.product_index
+        if product_index is not None:
+            blocks = product_index.country_blocks()
+            self.country_blocks = list(blocks.values())
+        else:
+            self.country_blocks = model.dimensions.product_blocks()
+
+    @property
+    def multipliers(self):
+        """The multipliers B L, solved once."""
+        if self._multipliers is None:
+            self._multipliers = self._solver.solve_transpose(self._B)
+        return self._multipliers
+
+    def outputs(self, stack):
+        """
+        :param stack: numpy array
+                Final demand of s scenarios, shape (s, n, k)
+        :return: numpy array
+                The outputs L Y of each scenario, shape (s, n, k)
+        """
+        s, _, k = stack.shape
+        return _unflatten(self._solver.solve_many(_flatten(stack)), s, k)
+
+    def footprints(self, stack):
+        """
+        :return: numpy array
+                The footprints B L Y of each scenario, shape (s, m, k)
+        """
+        s, _, k = stack.shape
+        return _unflatten(self.multipliers @ _flatten(stack), s, k)
+
+    def country_outputs(self, stack, outputs=None):
+        """
+        :param outputs: numpy array, optional
+                The outputs of the stack, when already calculated
+        :return: numpy array
+                Total output of each country, shape (s, countries, k)
+        """
+        if outputs is None:
+            outputs = self.outputs(stack)
+        return np.stack([np.sum(outputs[:, block], axis=1)
+                         for block in self.country_blocks], axis=1)
+
+    def country_footprints(self, stack, outputs=None):
+        """
+        :return: numpy array
+                Footprints by producing country B_c x_c, shape
+                (s, m, countries, k)
+        """
+        if outputs is None:
+            outputs = self.outputs(stack)
+        s, _, k = outputs.shape
+        flat = _flatten(outputs)
+        return np.stack([_unflatten(self._B[:, block] @ flat[block], s, k)
+                         for block in self.country_blocks], axis=2)
+
+    def evaluate(self, stack, results=('outputs', 'footprints')):
+        """
+        Calculates several results of a stack, the outputs are solved only
+        once.
+
+        :param results: tuple
+                Names of the results, see ScenarioEngine.results
+        :return: dict
+                Each result by name
+        """
+        assert all(name in self.results for name in results)
+        stack = np.asarray(stack, dtype=np.float64)
+        evaluated = {}
+        outputs = None
+        if any(name != 'footprints' for name in results):
+            outputs = self.outputs(stack)
+        for name in results:
+            if name == 'outputs':
+                evaluated[name] = outputs
+            elif name == 'footprints':
+                evaluated[name] = self.footprints(stack)
+            else:
+                evaluated[name] = getattr(self, name)(stack, outputs)
+        return evaluated
+
+    def default_chunk_size(self, stack, chunk_bytes=2 ** 28):
+        """Number of scenarios of which the final demand fits in
+        chunk_bytes."""
+        scenario_bytes = 8 * int(np.prod(stack.shape[1:]))
+        return max(1, chunk_bytes // max(1, scenario_bytes))
+
+    def iter_chunks(self, source, results=('outputs', 'footprints'),
+                    chunk_size=None):
+        """
+        Evaluates a stack chunk by chunk.
+
+        :param source: str or numpy array
+                A .npy file, which is memory mapped, or an array with shape
+                (s, n, k)
+        :param chunk_size: int, optional
+                Scenarios per chunk, by default about 256 MB of final demand
+        :return: generator
+                For each chunk the first and last scenario and the results
+        """
+        if isinstance(source, str):
+            source = np.load(source, mmap_mode='r')
+        if chunk_size is None:
+            chunk_size = self.default_chunk_size(source)
+        for start in range(0, len(source), chunk_size):
+            stop = min(start + chunk_size, len(source))
+            yield start, stop, self.evaluate(source[start:stop], results)
+
+    def run(self, source, directory, results=('outputs', 'footprints'),
+            chunk_size=None):
+        """
+        Evaluates a stack chunk by chunk and writes each result to a .npy
+        file named after the result in directory.
+
+        :return: dict
+                The full filename of each result
+        """
+        if isinstance(source, str):
+            source = np.load(source, mmap_mode='r')
+        writers = {}
+        try:
+            for start, stop, evaluated in self.iter_chunks(source, results,
+                                                           chunk_size):
+                for name, result in evaluated.items():
+                    if name not in writers:
+                        filename = os.path.join(directory, name + '.npy')
+                        writers[name] = wr.NpyWriter(
+                            filename, (len(source),) + result.shape[1:])
+                    writers[name][start:stop] = result
+        except BaseException:
+            for writer in writers.values():
+                writer.abort()
+            raise
+        for writer in writers.values():
+            writer.close()
+        return {name: writer.filename for name, writer in writers.items()}
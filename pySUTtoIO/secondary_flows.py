@@ -1,171 +1,268 @@
-#!/usr/bin/env python3
-# -*- coding: utf-8 -*-
-"""
-Created on Nov 6 15:00 2018
-Description: Modifying SUT to ensure appearance of secondary material flows in
-IOT
-
-Scope: RaMa-SCENE - Raw Materials SCENario Efficiency improvements
-
-@author:Franco Donati
-@institution:Leiden University CML
-"""
-import numpy as np
-
-
-def make_secondary(data):
-    """
-    This allows to allign secondary flow in such a way that they then
-    appear in the IOT
-
-    Primary Products' positions
-
-    C_WOOD: 57
-    C_PULP: 59
-    C_PLAS: 85
-    C_GLAS: 96
-    C_CMNT: 100
-    C_STEL: 103
-    C_PREM: 105
-    C_ALUM: 107
-    C_LZTP: 109
-    C_COPP: 111
-    C_ONFM: 113
-    C_CONS: 149
-
-    Primary Sectors'positions:
-
-    A_WOOD: 49
-    A_PULP: 51
-    A_PLAS: 58
-    A_GLAS: 64
-    A_CMNT: 68
-    A_STEL: 71
-    A_PREM: 73
-    A_ALUM: 75
-    A_LZTP: 77
-    A_COPP: 79
-    A_ONFM: 81
-    A_CONS: 112
-
-    """
-    V = data.supply
-    U = data.use
-    Y = data.final_use
-
-    products = np.array([57, 59, 85, 96, 100, 103,
-                         105, 107, 109, 111, 113, 149])
-
-    industries = np.array([49, 51, 58, 64, 68, 71, 73,
-                           75, 77, 79, 81, 112])
-
-    no_countries = int(len(Y)/200)
-
-    prod_or = make_coord_array(products, no_countries, 200)
-    ind_or = make_coord_array(industries, no_countries, 163)
-
-    moved = allocate_sec_mat(V, U, Y, prod_or, ind_or)
-
-    V = moved["V"]
-    U = moved["U"]
-    Y = moved["Y"]
-
-    data.supply = V
-    data.use = U
-    data.final_use = Y
-
-    return(data)
-
-
-def make_coord_array(coordinates, no_countries, no_ind_or_prod):
-
-    n = 0
-    nn = 0
-    while n in range(len(coordinates)):
-        while nn in range(no_countries):
-            g = coordinates + no_ind_or_prod*nn
-            if "s" not in locals():
-                s = g
-            else:
-                s = np.concatenate([s, g])
-            nn = nn+1
-        n = n+1
-
-    return(s)
-
-
-def allocate_sec_mat(V, U, Y, prod_or, ind_or):
-    """
-    This function allows to move the primary material output from the
-    secondary material industries to the secondary material output.
-    This allows for the presence of secondary materials in the IOT
-    once they are transformed from SUTS.
-
-    prod_or = row position of the primary supplied material
-    ind_or = colum pos. of the primary industry supplying primary material
-    """
-    V = V.copy()
-    U = U.copy()
-    Y = Y.copy()
-
-    # position of the secondary material
-    des_prod_ix_pos = prod_or + 1
-    des_ind_col_pos = ind_or + 1
-
-    # getting the value of secondary material from the supply table
-    # which is placed on the primary material row
-    misplaced = V[np.ix_(prod_or, des_ind_col_pos)]
-
-    # placing the misplaced value to the secondary material row
-    V[np.ix_(des_prod_ix_pos, des_ind_col_pos)] = misplaced
-
-    # collecting how much of the primary material is consumed by final demand
-    # to be subtracted from the supply value
-
-    # matrix  of primary sectors x all products (588 x 7987)
-    prim_sec_supply_trans = V[np.ix_(prod_or)]
-
-    # scalar value of sum total primary industry supply
-    # prim_sec_tot_output = np.sum(prim_sec_supply_trans)
-    prim_sec_tot_output = np.sum(prim_sec_supply_trans, axis=1)
-
-    # matrix of secondary product supply by secondary industry (588 x 588)
-    sec_supply_trans = V[np.ix_(des_prod_ix_pos, des_ind_col_pos)]
-
-    # vector of total secondary industry output (588)
-    sec_output = np.sum(sec_supply_trans, axis=1)
-
-    # vector of ratios between secondary output per industry and sum total
-    # industry supply (diagonalised 588  x 588)
-    ratio_prim_sec = np.zeros((len(sec_output)))
-    for idx in range(0, len(sec_output)):
-        if prim_sec_tot_output[idx] != 0:
-            ratio_prim_sec[idx] = sec_output[idx] / prim_sec_tot_output[idx]
-    ratio_prim_sec = np.diag(ratio_prim_sec)
-
-    # ratio_prim_sec = np.diag(np.divide(sec_output, prim_sec_tot_output))
-    # ratio_prim_sec[ratio_prim_sec == [np.nan, np.inf]] = 0
-
-    prim_sec_use_trans = U[np.ix_(prod_or)]
-
-    prim_sec_fin_dem_trans = Y[np.ix_(prod_or)]
-
-    eye = np.identity(len(ratio_prim_sec))
-
-    U[np.ix_(prod_or)] = (eye - ratio_prim_sec) @ prim_sec_use_trans
-
-    U[np.ix_(des_prod_ix_pos)] = ratio_prim_sec @ prim_sec_use_trans
-
-    Y[np.ix_(prod_or)] = (eye - ratio_prim_sec) @ prim_sec_fin_dem_trans
-
-    Y[np.ix_(des_prod_ix_pos)] = ratio_prim_sec @ prim_sec_fin_dem_trans
-
-    V[np.ix_(prod_or, des_ind_col_pos)] = 0
-
-    output = {"V": V,
-              "U": U,
-              "Y": Y}
-
-    print('splitting off secondary materials ready')
-
-    return output
\ No newline at end of file
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Nov 6 15:00 2018
+Description: Modifying SUT to ensure appearance of secondary material flows in
+IOT
+
+Scope: RaMa-SCENE - Raw Materials SCENario Efficiency improvements
+
+@author:Franco Donati
+@institution:Leiden University CML
+"""
+import collections
+import functools
+import numpy as np
+import scipy.sparse as sp
+import pySUTtoIO.tools as tl
+import pySUTtoIO.dimensions as dm
+import pySUTtoIO.instrumentation as ins
+
+
+SecondaryPair = collections.namedtuple('SecondaryPair', [
+    'primary_product', 'secondary_product', 'primary_industry',
+    'secondary_industry'])
+
+# primary material products and industries with the products and industries
+# of the secondary material they are reallocated to, by EXIOBASE code
+default_code_pairs = (
+    SecondaryPair('C_WOOD', 'C_WOOW', 'A_WOOD', 'A_WOOW'),
+    SecondaryPair('C_PULP', 'C_PAPE', 'A_PULP', 'A_PAPE'),
+    SecondaryPair('C_PLAS', 'C_PLAW', 'A_PLAS', 'A_PLAW'),
+    SecondaryPair('C_GLAS', 'C_GLAW', 'A_GLAS', 'A_GLAW'),
+    SecondaryPair('C_CMNT', 'C_ASHW', 'A_CMNT', 'A_ASHW'),
+    SecondaryPair('C_STEL', 'C_STEW', 'A_STEL', 'A_STEW'),
+    SecondaryPair('C_PREM', 'C_PREW', 'A_PREM', 'A_PREW'),
+    SecondaryPair('C_ALUM', 'C_ALUW', 'A_ALUM', 'A_ALUW'),
+    SecondaryPair('C_LZTP', 'C_LZTW', 'A_LZTP', 'A_LZTW'),
+    SecondaryPair('C_COPP', 'C_COPW', 'A_COPP', 'A_COPW'),
+    SecondaryPair('C_ONFM', 'C_ONFW', 'A_ONFM', 'A_ONFW'),
+    SecondaryPair('C_CONS', 'C_CONW', 'A_CONS', 'A_CONW'))
+
+# the same pairs by position within a country, used when the supply-use
+# table has no labels; the secondary material directly follows the primary
+default_pairs = tuple(
+    SecondaryPair(prd, prd + 1, ind, ind + 1) for prd, ind in zip(
+        [57, 59, 85, 96, 100, 103, 105, 107, 109, 111, 113, 149],
+        [49, 51, 58, 64, 68, 71, 73, 75, 77, 79, 81, 112]))
+
+
+@functools.lru_cache(maxsize=None)
+def pair_coordinates(pairs, dimensions=dm.exiobase):
+    """
+    Rows and columns of the pairs in all countries, computed once for each
+    table dimensions.
+
+    :param pairs: tuple
+            SecondaryPair tuples with positions within a country
+    :param dimensions: Dimensions
+            Dimensions of the supply-use table
+    :return: SecondaryPair
+            Read-only index arrays, country by country
+    """
+    positions = np.array(pairs, dtype=np.intp).reshape(-1, 4)
+    assert np.all(positions[:, :2] < dimensions.prd_cnt)
+    assert np.all(positions[:, 2:] < dimensions.ind_cnt)
+    coordinates = [dimensions.product_positions(positions[:, 0]),
+                   dimensions.product_positions(positions[:, 1]),
+                   dimensions.industry_positions(positions[:, 2]),
+                   dimensions.industry_positions(positions[:, 3])]
+    for array in coordinates:
+        array.flags.writeable = False
+    return SecondaryPair(*coordinates)
+
+
+def label_coordinates(pairs, product_index, industry_index):
+    """
+    Rows and columns of the pairs in all countries, looked up by code.
+
+    :param pairs: tuple
+            SecondaryPair tuples with product and industry codes
+    :return: SecondaryPair
+            Index arrays, country by country, or None when there are no
+            labels or the labels do not contain the codes
+    """
+    if product_index is None or industry_index is None:
+        return None
+    pairs = SecondaryPair(*zip(*pairs))
+    try:
+        return SecondaryPair(
+            product_index.positions(pairs.primary_product).ravel(),
+            product_index.positions(pairs.secondary_product).ravel(),
+            industry_index.positions(pairs.primary_industry).ravel(),
+            industry_index.positions(pairs.secondary_industry).ravel())
+    except KeyError:
+        return None
+
+
+def make_secondary(data, pairs=None, code_pairs=default_code_pairs):
+    """
+    This allows to allign secondary flow in such a way that they then
+    appear in the IOT
+
+    The primary material products and industries and their secondary
+    counterparts are looked up by code in the labels of the supply-use
+    table, or taken from positions within a country when there are no
+    labels, see default_code_pairs and default_pairs.
+
+    The supply, use and final use matrices of data are changed in place
+    where possible.
+
+    :param pairs: tuple, optional
+            SecondaryPair tuples with positions within a country, by
+            default default_pairs
+    :param code_pairs: tuple, optional
+            SecondaryPair tuples with codes, None to use positions only
+    """
+    V = data.supply
+    U = data.use
+    Y = data.final_use
+
+    coordinates = None
+    if pairs is None and code_pairs is not None:
+        coordinates = label_coordinates(code_pairs, data.product_index,
+                                        data.industry_index)
+    if coordinates is None:
+        coordinates = pair_coordinates(tuple(pairs or default_pairs),
+                                       data.dimensions)
+
+    with ins.stage('allocate_sec_mat'):
+        moved = allocate_sec_mat(V, U, Y, coordinates.primary_product,
+                                 coordinates.primary_industry,
+                                 coordinates.secondary_product,
+                                 coordinates.secondary_industry,
+                                 in_place=True)
+
+    V = moved["V"]
+    U = moved["U"]
+    Y = moved["Y"]
+
+    data.supply = V
+    data.use = U
+    data.final_use = Y
+
+    return data
+
+
+def make_coord_array(coordinates, no_countries, no_ind_or_prod):
+    """
+    Repeats positions within a country for all countries, country by
+    country.
+    """
+    coordinates = np.asarray(coordinates)
+    offsets = no_ind_or_prod * np.arange(no_countries)
+    return (coordinates[None, :] + offsets[:, None]).ravel()
+
+
+def _editable(matrix, in_place):
+    """
+    Returns the dense matrix itself when it may be changed, otherwise a
+    copy. Copy-on-write memory maps are never copied, only the pages that
+    are changed get private copies.
+    """
+    if tl.is_copy_on_write(matrix):
+        return matrix
+    if in_place and matrix.flags.writeable:
+        return matrix
+    return matrix.copy()
+
+
+def _row_mask(size, rows):
+    mask = np.zeros(size)
+    mask[rows] = 1
+    return sp.diags(mask)
+
+
+def _split_rows(matrix, prod_or, des_prod, ratio, in_place):
+    """
+    Moves the share ratio of the rows prod_or to the rows des_prod.
+    """
+    if sp.issparse(matrix):
+        # one sparse product instead of changing the sparsity structure
+        size = matrix.shape[0]
+        split = sp.csr_matrix(
+            (np.concatenate([1 - ratio, ratio]),
+             (np.concatenate([prod_or, des_prod]),
+              np.concatenate([prod_or, prod_or]))), shape=(size, size))
+        rows = _row_mask(size, np.concatenate([prod_or, des_prod]))
+        result = matrix - rows @ matrix + split @ matrix
+        return result.asformat(matrix.format)
+
+    matrix = _editable(matrix, in_place)
+    rows = matrix[prod_or]
+    matrix[prod_or] = rows * (1 - ratio)[:, None]
+    matrix[des_prod] = rows * ratio[:, None]
+    return matrix
+
+
+def allocate_sec_mat(V, U, Y, prod_or, ind_or, des_prod_ix_pos=None,
+                     des_ind_col_pos=None, in_place=False):
+    """
+    This function allows to move the primary material output from the
+    secondary material industries to the secondary material output.
+    This allows for the presence of secondary materials in the IOT
+    once they are transformed from SUTS.
+
+    prod_or = row position of the primary supplied material
+    ind_or = colum pos. of the primary industry supplying primary material
+    des_prod_ix_pos = row position of the secondary material, by default
+    the row after the primary material
+    des_ind_col_pos = column position of the secondary material industry,
+    by default the column after the primary industry
+
+    Only the rows and columns of the pairs are touched. With in_place
+    dense V, U and Y are changed in place, otherwise the inputs are left
+    untouched, except copy-on-write memory maps which are always changed
+    in place. Sparse V and U are returned in their original sparse format.
+    """
+    prod_or = np.asarray(prod_or)
+    # position of the secondary material
+    if des_prod_ix_pos is None:
+        des_prod_ix_pos = prod_or + 1
+    if des_ind_col_pos is None:
+        des_ind_col_pos = np.asarray(ind_or) + 1
+
+    # getting the value of secondary material from the supply table
+    # which is placed on the primary material row
+    if sp.issparse(V):
+        misplaced = V[prod_or][:, des_ind_col_pos]
+    else:
+        misplaced = V[np.ix_(prod_or, des_ind_col_pos)]
+
+    # vectors of the total output of the primary product and of the output
+    # of the secondary material by the secondary industries
+    # (the primary rows are summed dense, so the sparse and dense results
+    # are identical)
+    prim_sec_tot_output = np.sum(tl.to_dense(V[prod_or]), axis=1)
+    sec_output = tl.row_sums(misplaced)
+
+    # ratios between secondary output and total primary product output
+    ratio_prim_sec = np.zeros(len(sec_output))
+    np.divide(sec_output, prim_sec_tot_output, out=ratio_prim_sec,
+              where=prim_sec_tot_output != 0)
+
+    if sp.issparse(V):
+        # move the misplaced values to the secondary material rows
+        size = V.shape[0]
+        columns = _row_mask(V.shape[1], des_ind_col_pos)
+        rows = _row_mask(size, np.concatenate([prod_or, des_prod_ix_pos]))
+        move = sp.csr_matrix(
+            (np.ones(len(prod_or)), (des_prod_ix_pos, prod_or)),
+            shape=(size, size))
+        V = (V - rows @ V @ columns + move @ V @ columns).asformat(V.format)
+    else:
+        V = _editable(V, in_place)
+        # placing the misplaced value to the secondary material row
+        V[np.ix_(des_prod_ix_pos, des_ind_col_pos)] = misplaced
+        V[np.ix_(prod_or, des_ind_col_pos)] = 0
+
+    U = _split_rows(U, prod_or, des_prod_ix_pos, ratio_prim_sec, in_place)
+    Y = _split_rows(Y, prod_or, des_prod_ix_pos, ratio_prim_sec, in_place)
+
+    output = {"V": V,
+              "U": U,
+              "Y": Y}
+
+    ins.logger.info('splitting off secondary materials ready')
+
+    return output
@@ -1,16 +1,27 @@
 import numpy as np
+import scipy.sparse as sp
+import pySUTtoIO.tools as tl
+import pySUTtoIO.bundle as bd
+import pySUTtoIO.labels as lb
+import pySUTtoIO.dimensions as dm
 
 
 class Sut:
-    """A data transfer object that contains data from one supply-use table."""
+    """A data transfer object that contains data from one supply-use table.
+    The supply, use and extensions matrices can be given as scipy sparse
+    matrices, all other matrices are dense numpy arrays or memory maps.
+    The shapes of the matrices are checked against the dimensions of the
+    table, by default those of EXIOBASE."""
 
-    __prd_cnt = 200
-    __ind_cnt = 163
-    __fd_cnt = 7
-    __cntr_cnt = 49
     __value_added_index = [0, 1, 2, 3, 4, 5, 6, 7, 8]
 
-    def __init__(self):
+    def __init__(self, dimensions=dm.exiobase):
+        """
+        :param dimensions: Dimensions
+                Countries, products, industries and final demand categories
+        """
+        assert isinstance(dimensions, dm.Dimensions)
+        self._dimensions = dimensions
         self._year = None
         self._supply = None
         self._use = None
@@ -23,36 +34,137 @@ class Sut:
         self._final_use_categories = None
         self._factor_input_categories = None
         self._extension_categories = None
+        self._bundle = None
+        self._mmap_mode = None
+        self._product_index = None
+        self._industry_index = None
+
+    # names of the arrays and labels in a bundle file
+    _bundle_arrays = {'supply': 'V', 'use': 'U', 'final_use': 'Y',
+                      'factor_inputs': 'W', 'extensions': 'M'}
+    _bundle_labels = {'product_categories': 'products',
+                      'industry_categories': 'industries',
+                      'finaluse_categories': 'finaluses',
+                      'factor_input_categories': 'factorinputs',
+                      'extension_categories': 'extensions'}
+
+    @classmethod
+    def open_bundle(cls, filename, mmap_mode=None):
+        """
+        Creates a Sut from a bundle file. Each matrix and label list is only
+        read when it is first used, bundle gives access to parts of the
+        matrices.
+
+        :param mmap_mode: str, optional
+                Memory map uncompressed matrices, see np.load
+        """
+        bundle = bd.Bundle(filename)
+        dimensions = bundle.metadata.get('dimensions')
+        if dimensions is None:
+            sut = cls()
+        else:
+            sut = cls(dm.Dimensions(*dimensions))
+        sut._bundle = bundle
+        sut._mmap_mode = mmap_mode
+        year = sut._bundle.metadata.get('year')
+        if year is not None:
+            sut.year = int(year)
+        return sut
+
+    @property
+    def dimensions(self):
+        return self._dimensions
+
+    @property
+    def bundle(self):
+        return self._bundle
+
+    def _load(self, attribute):
+        """Reads a matrix or label list from the bundle, if available."""
+        if self._bundle is None:
+            return
+        if attribute in self._bundle_arrays:
+            name = self._bundle_arrays[attribute]
+            if name in self._bundle.array_names:
+                setattr(self, attribute,
+                        self._bundle.read(name, mmap_mode=self._mmap_mode))
+        else:
+            name = self._bundle_labels[attribute]
+            if name in self._bundle.label_names:
+                setattr(self, attribute, self._bundle.labels(name))
+
+    def save_bundle(self, filename, compress=False):
+        """Writes all matrices and labels of this Sut to a bundle file."""
+        arrays = {}
+        for attribute, name in self._bundle_arrays.items():
+            if getattr(self, attribute) is not None:
+                arrays[name] = getattr(self, attribute)
+        labels = {}
+        for attribute, name in self._bundle_labels.items():
+            if getattr(self, attribute) is not None:
+                labels[name] = getattr(self, attribute)
+        metadata = {'dimensions': list(self.dimensions)}
+        if self.year is not None:
+            metadata['year'] = self.year
+        bd.write_bundle(filename, arrays, labels, metadata, compress)
 
     @property
     def product_categories(self):
+        if self._product_categories is None:
+            self._load('product_categories')
         return self._product_categories
 
     @property
     def industry_categories(self):
+        if self._industry_categories is None:
+            self._load('industry_categories')
         return self._industry_categories
 
     @property
     def finaluse_categories(self):
+        if self._final_use_categories is None:
+            self._load('finaluse_categories')
         return self._final_use_categories
 
     @property
     def factor_input_categories(self):
+        if self._factor_input_categories is None:
+            self._load('factor_input_categories')
         return self._factor_input_categories
 
     @property
     def extension_categories(self):
+        if self._extension_categories is None:
+            self._load('extension_categories')
         return self._extension_categories
 
     @product_categories.setter
     def product_categories(self, categories):
         assert type(categories) is list
         self._product_categories = categories
+        self._product_index = None
 
     @industry_categories.setter
     def industry_categories(self, categories):
         assert type(categories) is list
         self._industry_categories = categories
+        self._industry_index = None
+
+    @property
+    def product_index(self):
+        """LabelIndex of the product categories, None without labels."""
+        if self._product_index is None and \
+                self.product_categories is not None:
+            self._product_index = lb.LabelIndex(self.product_categories)
+        return self._product_index
+
+    @property
+    def industry_index(self):
+        """LabelIndex of the industry categories, None without labels."""
+        if self._industry_index is None and \
+                self.industry_categories is not None:
+            self._industry_index = lb.LabelIndex(self.industry_categories)
+        return self._industry_index
 
     @finaluse_categories.setter
     def finaluse_categories(self, categories):
@@ -80,69 +192,80 @@ class Sut:
 
     @property
     def supply(self):
+        if self._supply is None:
+            self._load('supply')
         return self._supply
 
     @supply.setter
     def supply(self, sup):
-        assert type(sup) is np.ndarray
-        assert sup.dtype == np.float64
-        assert sup.shape == (self.__prd_cnt * self.__cntr_cnt, self.__ind_cnt * self.__cntr_cnt)
+        assert isinstance(sup, np.ndarray) or sp.issparse(sup)
+        assert sup.dtype in tl.float_types
+        assert sup.shape == self._dimensions.supply_shape
         self._supply = sup
 
     @property
     def use(self):
+        if self._use is None:
+            self._load('use')
         return self._use
 
     @use.setter
     def use(self, use):
-        assert type(use) is np.ndarray
-        assert use.dtype == np.float64
-        assert use.shape == (self.__prd_cnt * self.__cntr_cnt, self.__ind_cnt * self.__cntr_cnt)
+        assert isinstance(use, np.ndarray) or sp.issparse(use)
+        assert use.dtype in tl.float_types
+        assert use.shape == self._dimensions.supply_shape
         self._use = use
 
     @property
     def final_use(self):
+        if self._final_use is None:
+            self._load('final_use')
         return self._final_use
 
     @final_use.setter
     def final_use(self, final_use):
-        assert type(final_use) is np.ndarray
-        assert final_use.dtype == np.float64
-        assert final_use.shape == (self.__prd_cnt * self.__cntr_cnt,  self.__fd_cnt * self.__cntr_cnt)
+        assert isinstance(final_use, np.ndarray)
+        assert final_use.dtype in tl.float_types
+        assert final_use.shape == self._dimensions.final_use_shape
         self._final_use = final_use
 
     @property
     def factor_inputs(self):
+        if self._factor_inputs is None:
+            self._load('factor_inputs')
         return self._factor_inputs
 
     @factor_inputs.setter
     def factor_inputs(self, factor_inputs):
-        assert type(factor_inputs) is np.ndarray
-        assert factor_inputs.dtype == np.float64
+        assert isinstance(factor_inputs, np.ndarray)
+        assert factor_inputs.dtype in tl.float_types
+        assert factor_inputs.shape[1] == self._dimensions.industries
         self._factor_inputs = factor_inputs
 
     @property
     def value_added(self):
-        return self._factor_inputs[self.__value_added_index, :]
+        return self.factor_inputs[self.__value_added_index, :]
 
     @property
     def total_product_supply(self):
-        return np.sum(self._supply, axis=1)
+        return tl.row_sums(self.supply)
 
     @property
     def total_product_use(self):
-        return np.sum(self._use, axis=1) + np.sum(self._final_use, axis=1)
+        return tl.row_sums(self.use) + np.sum(self.final_use, axis=1)
 
     @property
     def total_industry_output(self):
-        return np.sum(self._supply, axis=0)
+        return tl.column_sums(self.supply)
 
     @property
     def total_industry_input(self):
-        return np.sum(self._use, axis=0) + np.sum(self.value_added, axis=0)
+        return tl.column_sums(self.use) + np.sum(self.value_added, axis=0)
 
     @property
     def extensions(self):
+        if self._extensions is None:
+            self._load('extensions')
         return self._extensions
 
     @property
@@ -151,12 +274,13 @@ class Sut:
 
     @extensions.setter
     def extensions(self, data):
-        assert type(data) is np.ndarray
-        assert data.dtype == np.float64
+        assert isinstance(data, np.ndarray) or sp.issparse(data)
+        assert data.dtype in tl.float_types
+        assert data.shape[1] == self._dimensions.industries
         self._extensions = data
 
     @direct_extensions.setter
     def direct_extensions(self, data):
-        assert type(data) is np.ndarray
-        assert data.dtype == np.float64
+        assert isinstance(data, np.ndarray)
+        assert data.dtype in tl.float_types
         self._direct_extensions = data
@@ -0,0 +1,118 @@
+"""
+Reading of delimited text tables with row and column headers, such as the
+EXIOBASE supply-use text files. The column headers are read separately,
+after which the numerical body is parsed block by block straight into a
+preallocated float64 array. The text of the file is never held in memory
+as a whole.
+
+As in tools.list_to_numpy_array, row_header_cnt is the number of leading
+columns occupied by the row header labels and col_header_cnt the number of
+top rows occupied by the column header labels.
+"""
+import itertools
+import numpy as np
+
+
+default_block_rows = 1024
+
+
+def _split(line, delimiter):
+    return line.rstrip('\r\n').split(delimiter)
+
+
+def read_header(filename, row_header_cnt, col_header_cnt, delimiter='\t'):
+    """
+    Reads the column header labels of a table.
+
+    :param filename : str
+            Full qualified filename
+    :return: list
+            The column headers, one list of col_header_cnt labels per
+            column like tools.get_column_header
+    """
+    with open(filename, newline='') as table:
+        rows = [_split(line, delimiter)[row_header_cnt:]
+                for line in itertools.islice(table, col_header_cnt)]
+    return [list(labels) for labels in zip(*rows)]
+
+
+def table_shape(filename, row_header_cnt, col_header_cnt, delimiter='\t'):
+    """
+    Determines the shape of the numerical body of a table without parsing
+    it. Rows are counted in binary chunks, the column count is taken from
+    the first row after the column headers.
+
+    :return: tuple
+            Number of rows and columns of the numerical values
+    """
+    with open(filename, newline='') as table:
+        first_row = next(itertools.islice(table, col_header_cnt, None), '')
+    col_cnt = max(0, len(_split(first_row, delimiter)) - row_header_cnt)
+
+    line_cnt = 0
+    last = b'\n'
+    with open(filename, 'rb') as table:
+        for chunk in iter(lambda: table.read(2 ** 24), b''):
+            line_cnt += chunk.count(b'\n')
+            last = chunk[-1:]
+    if last != b'\n':
+        line_cnt += 1  # last line without line end
+    return max(0, line_cnt - col_header_cnt), col_cnt
+
+
+def iter_blocks(filename, row_header_cnt, col_header_cnt, delimiter='\t',
+                block_rows=default_block_rows):
+    """
+    Reads the body of a table in blocks of lines. Empty lines are skipped.
+
+    :param block_rows : int
+            Number of lines per block
+    :return: generator
+            For each block a tuple of the row header labels (list of lists)
+            and the numerical values as two dimensional float64 array
+    """
+    with open(filename, newline='') as table:
+        lines = itertools.islice(table, col_header_cnt, None)
+        while True:
+            block = [line for line in itertools.islice(lines, block_rows)
+                     if line.strip('\r\n')]
+            if not block:
+                break
+            headers = [line.split(delimiter, row_header_cnt)[:row_header_cnt]
+                       for line in block]
+            col_cnt = len(_split(block[0], delimiter)) - row_header_cnt
+            values = np.loadtxt(block, delimiter=delimiter, comments=None,
+                                dtype=np.float64, ndmin=2,
+                                usecols=range(row_header_cnt,
+                                              row_header_cnt + col_cnt))
+            yield headers, values
+
+
+def read_table(filename, row_header_cnt, col_header_cnt, delimiter='\t',
+               block_rows=default_block_rows, out=None):
+    """
+    Reads a table into a numpy array and its row and column header labels.
+
+    :param out : numpy array, optional
+            Preallocated array, e.g. a memory mapped .npy file, with the
+            shape of the numerical body. By default a new array is created.
+    :return: tuple
+            The numerical values, the row headers and the column headers
+            as lists of lists like tools.get_row_header and
+            tools.get_column_header
+    """
+    if out is None:
+        out = np.empty(table_shape(filename, row_header_cnt, col_header_cnt,
+                                   delimiter))
+    row_headers = []
+    row_idx = 0
+    for headers, values in iter_blocks(filename, row_header_cnt,
+                                       col_header_cnt, delimiter, block_rows):
+        out[row_idx:row_idx + len(values)] = values
+        row_headers.extend(headers)
+        row_idx += len(values)
+    if row_idx != len(out):
+        out = out[:row_idx]  # skipped empty lines
+    column_headers = read_header(filename, row_header_cnt, col_header_cnt,
+                                 delimiter)
+    return out, row_headers, column_headers
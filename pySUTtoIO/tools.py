@@ -1,6 +1,7 @@
 import csv
 import pickle as pck
 import numpy as np
+import scipy.sparse as sp
 
 
 def pickle_file_to_list(filename):
@@ -55,6 +56,36 @@ def list_to_csv_file(filename, list_data, delimiter=','):
     file.close()
 
 
+# floating point types of which matrices can be stored, computations
+# accumulate in float64
+float_types = (np.float32, np.float64)
+
+
+def _scale_factors(matrix, data):
+    # the reciprocals are rounded to single precision for a single precision
+    # matrix, so scaling does not create a double precision copy
+    factors = reciprocal(data)
+    if matrix.dtype == np.float32:
+        factors = factors.astype(np.float32)
+    return factors
+
+
+def reciprocal(data):
+    """
+    A function that takes an array of values and calculates the
+    reciprocal of each value. Zero values remain zero.
+
+    :param data : numpy array
+            The values to be converted into reciprocals.
+    :return: numpy array
+            Array of the same shape containing the reciprocals.
+    """
+    data = np.asarray(data, dtype=np.float64)
+    result = np.zeros(data.shape)
+    np.divide(1, data, out=result, where=data != 0)
+    return result
+
+
 def invdiag(data):
     """
     A function that takes a vector of values. Calculates
@@ -68,11 +99,98 @@ def invdiag(data):
     :return: numpy array
             The matrix containing the inverse diagonalized values.
     """
-    result = np.zeros(data.shape)
-    for index in np.ndindex(data.shape):
-        if data[index] != 0:
-            result[index] = 1 / data[index]
-    return np.diag(result)
+    return np.diag(reciprocal(data))
+
+
+def inv_scale_rows(matrix, data):
+    """
+    Divides each row of a matrix by the corresponding value of a vector,
+    rows belonging to a zero value become zero. This gives the same result
+    as np.dot(invdiag(data), matrix) without building the diagonal matrix.
+
+    :param matrix : numpy array
+            Two dimensional matrix to be scaled.
+    :param data : numpy array
+            Vector with one value for each row of the matrix.
+    :return: numpy array
+            The scaled matrix.
+    """
+    if sp.issparse(matrix):
+        return sp.diags(_scale_factors(matrix, data)) @ matrix
+    return matrix * _scale_factors(matrix, data).reshape(-1, 1)
+
+
+def inv_scale_columns(matrix, data):
+    """
+    Divides each column of a matrix by the corresponding value of a vector,
+    columns belonging to a zero value become zero. This gives the same
+    result as np.dot(matrix, invdiag(data)) without building the diagonal
+    matrix.
+
+    :param matrix : numpy array
+            Two dimensional matrix to be scaled.
+    :param data : numpy array
+            Vector with one value for each column of the matrix.
+    :return: numpy array
+            The scaled matrix.
+    """
+    if sp.issparse(matrix):
+        return matrix @ sp.diags(_scale_factors(matrix, data))
+    return matrix * _scale_factors(matrix, data).reshape(1, -1)
+
+
+def row_sums(matrix):
+    """
+    Sums the rows of a dense or sparse matrix. The sums are accumulated in
+    double precision, also for a single precision matrix.
+
+    :param matrix : numpy array or scipy sparse matrix
+            Two dimensional matrix
+    :return: numpy array
+            Vector with the sum of each row
+    """
+    if sp.issparse(matrix):
+        return np.asarray(matrix.sum(axis=1, dtype=np.float64)).ravel()
+    return np.sum(matrix, axis=1, dtype=np.float64)
+
+
+def column_sums(matrix):
+    """
+    Sums the columns of a dense or sparse matrix. The sums are accumulated
+    in double precision, also for a single precision matrix.
+
+    :param matrix : numpy array or scipy sparse matrix
+            Two dimensional matrix
+    :return: numpy array
+            Vector with the sum of each column
+    """
+    if sp.issparse(matrix):
+        return np.asarray(matrix.sum(axis=0, dtype=np.float64)).ravel()
+    return np.sum(matrix, axis=0, dtype=np.float64)
+
+
+def is_copy_on_write(matrix):
+    """
+    Checks whether a matrix is a copy-on-write memory map, changes to such
+    a matrix only copy the touched pages and never reach the file.
+
+    :param matrix : numpy array
+    :return: bool
+    """
+    return isinstance(matrix, np.memmap) and matrix.mode == 'c'
+
+
+def to_dense(matrix):
+    """
+    Returns a sparse matrix as dense numpy array, dense arrays are
+    returned unchanged.
+
+    :param matrix : numpy array or scipy sparse matrix
+    :return: numpy array
+    """
+    if sp.issparse(matrix):
+        return matrix.toarray()
+    return matrix
 
 
 def list_to_numpy_array(list_data, row_header_cnt, col_header_cnt):
@@ -170,9 +288,13 @@ def get_column_header(list_data, row_header_cnt, col_header_cnt):
 
 def remove_duplicates(labels):
     unique_list = []
+    seen = set()
 
     for elem in labels:
-        if elem not in unique_list:
+        # labels are often lists, which cannot be hashed
+        key = tuple(elem) if isinstance(elem, list) else elem
+        if key not in seen:
+            seen.add(key)
             unique_list.append(elem)
 
     return unique_list
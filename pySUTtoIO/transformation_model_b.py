@@ -1,37 +1,134 @@
-import math
+import collections
 import numpy as np
+import scipy.sparse as sp
 import os.path
 import pySUTtoIO.tools as tl
 import pySUTtoIO.sut as st
+import pySUTtoIO.leontief as lt
+import pySUTtoIO.balance as bl
+import pySUTtoIO.instrumentation as ins
+import pySUTtoIO.disk_cache as dc
 from pySUTtoIO.secondary_flows import make_secondary as ms
 
 
+def _changed_rows(delta):
+    """Rows of a sparse change that hold non-zero values."""
+    if delta is None:
+        return np.zeros(0, dtype=np.intp)
+    return np.flatnonzero(np.diff(sp.csr_matrix(delta).indptr))
+
+
+def _selection(size, rows):
+    """Matrix of which column k is the unit vector of rows[k]."""
+    selection = np.zeros((size, len(rows)))
+    selection[rows, np.arange(len(rows))] = 1
+    return selection
+
+
+def _add(matrix, delta):
+    """
+    Adds a sparse change to a dense matrix, in place when the matrix is
+    writable.
+    """
+    if not matrix.flags.writeable:
+        matrix = np.array(matrix)
+    delta = delta.tocoo()
+    np.add.at(matrix, (delta.row, delta.col), delta.data)
+    return matrix
+
+
 class TransformationModelB:
     """A supply-use table to input-output table transformation object.
     From the supply-use table a product-by-product input-output table
     based on industry technology assumption is created. In the 'Eurostat Manual
     of Supply, Use and Input-Output Tables' this transformation model is called
     model B. The resulting input-output table does not contain negative values.
-    Onlythe domestic tables are taken into consideration"""
+    Onlythe domestic tables are taken into consideration.
+    When the supply, use or extension matrices are scipy sparse matrices the
+    derived matrices stay sparse, use tools.to_dense for dense output.
+
+    With precision 'single' the inputs and the derived matrices are stored
+    in float32, which halves their memory and the size of the saved
+    tables. The product and industry totals and the balance checks are
+    accumulated in float64 and the Leontief system is factorized in
+    float64, see leontief.LeontiefSolver for a float32 factorization with
+    iterative refinement. check_leontief_inverse reports the error of the
+    stored Leontief inverse.
+
+    With a disk_cache.DiskCache the matrices of _persisted are also kept
+    on disk, by a hash of the inputs they are derived from, the settings
+    of the model and the library version. A model for the same tables
+    reads them from disk instead of computing them, and when only some
+    inputs changed only the matrices that depend on these inputs are
+    computed. The hashes are taken after the secondary flows are moved."""
 
     default_rel_tol = 1E-3
+    # largest rank of a change of A, as fraction of the number of products,
+    # for which update refreshes the Leontief solver instead of rebuilding
+    update_rank_fraction = 0.1
+    precisions = {'double': np.float64, 'single': np.float32}
+    # cached matrices that are stored in the precision of the model, the
+    # product totals q stay double precision
+    _stored = ('T', 'Z', 'A', 'L', 'ext_Z', 'ext_A', 'fi_Z', 'fi_A')
+    # cached matrices that are kept in a disk cache
+    _persisted = ('T', 'Z', 'A', 'LU', 'L', 'ext_A', 'fi_A')
     debug = False
     debug_data_dir = os.path.join('data', 'transformed', '2010', 'sut')
 
-    def __init__(self, sut, make_secondary):
+    # Every derived matrix is computed at most once and kept in a cache. The
+    # graph lists what each cached matrix is derived from, so replacing an
+    # input (V, U, Y, extensions or factor inputs) only drops the matrices
+    # that depend on it.
+    _dependencies = {
+        'q': ('V',),
+        'T': ('V',),
+        'Z': ('U', 'T'),
+        'A': ('Z', 'q'),
+        'LU': ('A',),
+        'L': ('LU',),
+        'ext_Z': ('extensions', 'T'),
+        'ext_A': ('ext_Z', 'q'),
+        'fi_Z': ('factor_inputs', 'T'),
+        'fi_A': ('fi_Z', 'q'),
+    }
+
+    def __init__(self, sut, make_secondary, solver='lu', solver_options=None,
+                 precision='double', cache=None):
+        """
+        :param solver: str
+                Method used for the Leontief system, see leontief.make_solver
+        :param solver_options: dict, optional
+                Precision and refinement of the factorization, or the
+                tolerance, maximum iterations and start vector of an
+                iterative solver
+        :param precision: str
+                'double' or 'single', the precision in which the matrices
+                are stored
+        :param cache: DiskCache, optional
+                Disk cache of the derived matrices
+        """
         assert type(sut) is st.Sut
+        assert precision in self.precisions
         self._sut = sut
+        self.solver = solver
+        self.solver_options = solver_options or {}
+        self.precision = precision
+        self.dtype = np.dtype(self.precisions[precision])
+        self._cache = {}
+        self.cache_hits = collections.Counter()
+        self.cache_misses = collections.Counter()
+        self.disk_cache = cache
+        self.disk_hits = collections.Counter()
+        self.make_secondary = make_secondary
+        self._digests = {}
         if make_secondary:
-            sut2 = ms(sut)
-            self.V = sut2.supply
-            self.U = sut2.use
-            self.q = np.sum(self.V, axis=1)
-            self.Y = sut2.final_use
-        else:
-            self.V = self._sut.supply
-            self.U = self._sut.use
-            self.q = self._sut.total_product_supply
-            self.Y = self._sut.final_use
+            with ins.stage('make_secondary'):
+                sut = ms(sut)
+        self._V = self._as_stored(sut.supply)
+        self._U = self._as_stored(sut.use)
+        self._Y = self._as_stored(sut.final_use)
+        self._extensions = self._as_stored(sut.extensions)
+        self._factor_inputs = self._as_stored(sut.factor_inputs)
 
         if self.debug:
             product_out = np.sum(self.V, axis=1, keepdims=True)
@@ -57,104 +154,490 @@ class TransformationModelB:
             tl.list_to_csv_file(full_ind_output_fn, np.transpose(industry_out), '\t')
             tl.list_to_csv_file(full_ind_input_fn, np.transpose(industry_in), '\t')
 
+    @property
+    def dimensions(self):
+        return self._sut.dimensions
+
+    @property
+    def product_index(self):
+        """LabelIndex of the products, the rows and columns of the IOT."""
+        return self._sut.product_index
+
+    @property
+    def industry_index(self):
+        return self._sut.industry_index
+
+    @property
+    def V(self):
+        return self._V
+
+    @V.setter
+    def V(self, supply):
+        self._V = self._as_stored(supply)
+        self._invalidate('V')
+
+    @property
+    def U(self):
+        return self._U
+
+    @U.setter
+    def U(self, use):
+        self._U = self._as_stored(use)
+        self._invalidate('U')
+
+    @property
+    def Y(self):
+        return self._Y
+
+    @Y.setter
+    def Y(self, final_use):
+        self._Y = self._as_stored(final_use)
+        self._invalidate('Y')
+
+    @property
+    def extensions(self):
+        return self._extensions
+
+    @extensions.setter
+    def extensions(self, extensions):
+        self._extensions = self._as_stored(extensions)
+        self._invalidate('extensions')
+
+    @property
+    def factor_inputs(self):
+        return self._factor_inputs
+
+    @factor_inputs.setter
+    def factor_inputs(self, factor_inputs):
+        self._factor_inputs = self._as_stored(factor_inputs)
+        self._invalidate('factor_inputs')
+
+    def _as_stored(self, matrix):
+        """Converts a matrix to the precision of the model, a matrix that
+        already has this precision is not copied."""
+        if matrix is None or matrix.dtype == self.dtype:
+            return matrix
+        return matrix.astype(self.dtype)
+
+    @property
+    def q(self):
+        return self._cached('q', lambda: tl.row_sums(self.V))
+
+    def _cached(self, name, compute):
+        """
+        Returns the cached matrix called name, computing and storing it
+        first when it is not available yet. Cached arrays are made read-only
+        as they are shared between all callers.
+        """
+        if name in self._cache:
+            self.cache_hits[name] += 1
+        else:
+            self.cache_misses[name] += 1
+            result = self._load_persisted(name)
+            if result is None:
+                with ins.stage(name) as record:
+                    result = compute()
+                    record.add_array(name, result)
+                self._store(name, result)
+                self._persist(name)
+            else:
+                self._store(name, result)
+        return self._cache[name]
+
+    def _invalidate(self, name):
+        """Drops every cached matrix that is derived from name, also when
+        a matrix in between was released."""
+        self._digests.pop(name, None)
+        for key, dependencies in self._dependencies.items():
+            if name in dependencies:
+                self._cache.pop(key, None)
+                self._invalidate(key)
+
+    def _forget(self, name):
+        """Drops the hashes of name and of every matrix derived from it."""
+        self._digests.pop(name, None)
+        for key, dependencies in self._dependencies.items():
+            if name in dependencies:
+                self._forget(key)
+
+    def _settings(self):
+        import pySUTtoIO
+        options = sorted((option, dc.array_digest(value)
+                          if isinstance(value, np.ndarray) else repr(value))
+                         for option, value in self.solver_options.items())
+        return repr((type(self).__name__, pySUTtoIO.__version__,
+                     bool(self.make_secondary), self.precision, self.solver,
+                     options))
+
+    def digest(self, name):
+        """
+        Hash of an input or derived matrix: of its values for the inputs,
+        of the settings of the model and the hashes of the matrices it is
+        derived from otherwise. It is the key of the matrix in the disk
+        cache.
+        """
+        if name not in self._digests:
+            if name in self._dependencies:
+                self._digests[name] = dc.digest(
+                    self._settings(), name,
+                    *[self.digest(dependency)
+                      for dependency in self._dependencies[name]])
+            else:
+                self._digests[name] = dc.digest(name, getattr(self, name))
+        return self._digests[name]
+
+    def _load_persisted(self, name):
+        if self.disk_cache is None or name not in self._persisted:
+            return None
+        with ins.stage(name, source='disk') as record:
+            result = self.disk_cache.get(self.digest(name))
+            record.info['hit'] = result is not None
+            if result is None:
+                return None
+            if name == 'LU':
+                A = self.io_coefficient_matrix() \
+                    if self.solver_options.get('refine', 0) > 0 else None
+                result = lt.LeontiefSolver.from_factors(
+                    result['lu'], result['piv'], A,
+                    self.solver_options.get('refine', 0))
+            else:
+                record.add_array(name, result)
+        self.disk_hits[name] += 1
+        return result
+
+    def _persist(self, name):
+        if self.disk_cache is None or name not in self._persisted:
+            return
+        result = self._cache[name]
+        if name == 'LU':
+            # only dense factorizations, sparse and iterative solvers are
+            # cheap to build again
+            if type(result) is not lt.LeontiefSolver or \
+                    result.factors() is None:
+                return
+            lu, piv = result.factors()
+            result = {'lu': lu, 'piv': piv}
+        self.disk_cache.put(self.digest(name), result)
+
+    def restore_file(self, name, filename):
+        """
+        Copies a matrix from the disk cache to a .npy file without reading
+        it into memory.
+
+        :return: bool
+                Whether the matrix was in the disk cache
+        """
+        if self.disk_cache is None or \
+                not self.disk_cache.get_file(self.digest(name), filename):
+            return False
+        self.disk_hits[name] += 1
+        return True
+
+    def persist_file(self, name, filename):
+        """Adds a matrix that was saved as .npy file to the disk cache."""
+        if self.disk_cache is not None:
+            self.disk_cache.put_file(self.digest(name), filename)
+
+    def clear_cache(self):
+        self._cache.clear()
+
+    def release(self, *names):
+        """
+        Frees cached matrices that are no longer needed. Matrices derived
+        from them stay cached, a released matrix is recomputed when it is
+        requested again. Changing an input still drops every cached matrix
+        derived from it, also through released matrices.
+        """
+        for name in names:
+            self._cache.pop(name, None)
+
     def transformation_matrix(self):
-        make = np.transpose(self.V)
-        g = np.sum(self.V, axis=0)
-        return np.dot(tl.invdiag(g), make)
+        return self._cached('T', self._transformation_matrix)
+
+    def _transformation_matrix(self):
+        make = self.V.T
+        g = tl.column_sums(self.V)
+        return tl.inv_scale_rows(make, g)
 
     def io_transaction_matrix(self):
+        return self._cached('Z', self._io_transaction_matrix)
+
+    def _io_transaction_matrix(self):
         use = self.U
-        transaction_matrix = np.dot(use, self.transformation_matrix())
+        transaction_matrix = use @ self.transformation_matrix()
 
         if self.debug:
             full_transaction_output_fn = os.path.join(self.debug_data_dir, 'transaction_output_new.txt')
-            tl.list_to_csv_file(full_transaction_output_fn, np.sum(transaction_matrix, axis=1, keepdims=True), '\t')
-            print('transaction matrix ready and saved')
-        print('transaction matrix ready')
+            tl.list_to_csv_file(full_transaction_output_fn,
+                                tl.row_sums(transaction_matrix).reshape(-1, 1),
+                                '\t')
+            ins.logger.info('transaction matrix ready and saved')
+        ins.logger.info('transaction matrix ready')
         return transaction_matrix
 
     def io_coefficient_matrix(self):
+        return self._cached('A', self._io_coefficient_matrix)
+
+    def _io_coefficient_matrix(self):
         q = self.q
-        return np.dot(self.io_transaction_matrix(), tl.invdiag(q))
+        return tl.inv_scale_columns(self.io_transaction_matrix(), q)
 
-    def ext_transaction_matrix(self):
-        return np.dot(self._sut.extensions, self.transformation_matrix())
+    def ext_transaction_matrix(self, rows=None):
+        """
+        :param rows: list, optional
+                Only calculate these rows of the extensions, the result is
+                not cached
+        """
+        if rows is None:
+            return self._cached('ext_Z', self._ext_transaction_matrix)
+        if 'ext_Z' in self._cache:
+            return self._cache['ext_Z'][rows]
+        return self._as_stored(self.extensions[rows] @
+                               self.transformation_matrix())
+
+    def _ext_transaction_matrix(self):
+        return self.extensions @ self.transformation_matrix()
 
     def ext_coefficients_matrix(self):
+        return self._cached('ext_A', self._ext_coefficients_matrix)
+
+    def _ext_coefficients_matrix(self):
         q = self.q
-        return np.dot(self.ext_transaction_matrix(), tl.invdiag(q))
+        return tl.inv_scale_columns(self.ext_transaction_matrix(), q)
 
     def factor_inputs_transaction_matrix(self):
-        return np.dot(self._sut.factor_inputs, self.transformation_matrix())
+        return self._cached('fi_Z', self._factor_inputs_transaction_matrix)
+
+    def _factor_inputs_transaction_matrix(self):
+        return self.factor_inputs @ self.transformation_matrix()
 
     def factor_inputs_coefficients_matrix(self):
+        return self._cached('fi_A', self._factor_inputs_coefficients_matrix)
+
+    def _factor_inputs_coefficients_matrix(self):
         q = self.q
-        return np.dot(self.factor_inputs_transaction_matrix(), tl.invdiag(q))
+        return tl.inv_scale_columns(self.factor_inputs_transaction_matrix(), q)
+
+    def update(self, dU=None, dV=None, dY=None, dM=None, max_rank=None):
+        """
+        Applies changes to the use, supply, final use and extension
+        matrices, e.g. for a what-if scenario. Cached matrices are updated
+        for the changed rows and columns only. When the change of the
+        coefficient matrix A has a rank of at most max_rank the cached
+        Leontief solver and inverse are refreshed with low-rank (Woodbury)
+        updates, otherwise they are rebuilt when they are next requested.
+        A model with sparse matrices is always rebuilt.
+
+        The matrices of the model are changed in place when they are
+        writable dense arrays, otherwise they are copied once.
+
+        :param dU: numpy array or scipy sparse matrix, optional
+                Change of the use matrix, mostly zeros
+        :param dV: numpy array or scipy sparse matrix, optional
+                Change of the supply matrix
+        :param dY: numpy array or scipy sparse matrix, optional
+                Change of the final use matrix
+        :param dM: numpy array or scipy sparse matrix, optional
+                Change of the extensions matrix
+        :param max_rank: int, optional
+                By default update_rank_fraction of the number of products
+        :return: int
+                Rank of the low-rank update, None when the Leontief solver
+                and inverse were dropped instead
+        """
+        if any(sp.issparse(matrix) for matrix in
+               (self.V, self.U, self.extensions)):
+            for name, delta in (('U', dU), ('V', dV), ('Y', dY),
+                                ('extensions', dM)):
+                if delta is not None:
+                    setattr(self, name, getattr(self, name) + delta)
+            return None
+        if max_rank is None:
+            max_rank = int(self.update_rank_fraction * self.V.shape[0])
+
+        dU, dV, dY, dM = [None if delta is None else sp.csr_matrix(delta)
+                          for delta in (dU, dV, dY, dM)]
+        if dY is not None:
+            self._Y = _add(self._Y, dY)
+            self._forget('Y')
+        if dU is None and dV is None and dM is None:
+            return 0
+
+        old = dict(self._cache)
+        size = self.V.shape[0]
+        rows_U = _changed_rows(dU)
+        rows_M = _changed_rows(dM)
+        rows_V = _changed_rows(dV)
+        cols_V = _changed_rows(None if dV is None else dV.T)
+
+        # rows of the transformation matrix, product totals and the
+        # columns of the inputs that are affected, before the change
+        T_cols = tl.inv_scale_rows(self.V[:, cols_V].T,
+                                   tl.column_sums(self.V[:, cols_V]))
+        q_rows = tl.row_sums(self.V[rows_V])
+        sources = (('U', 'Z', 'A', dU, rows_U),
+                   ('extensions', 'ext_Z', 'ext_A', dM, rows_M),
+                   ('factor_inputs', 'fi_Z', 'fi_A', None, []))
+        inputs = {name: getattr(self, name)[:, cols_V]
+                  for name, z_name, _, _, _ in sources
+                  if z_name in old or name == 'U'}
+        solver = old.get('LU')
+        low_rank = 'L' in old or isinstance(solver, (
+            lt.LeontiefSolver, lt.UpdatedLeontiefSolver))
+        if low_rank and len(rows_V) > 0:
+            if 'Z' in old:
+                Z_cols = old['Z'][:, rows_V]
+            else:
+                Z_cols = self.U @ self.transformation_matrix()[:, rows_V]
+
+        if dV is not None:
+            self._V = _add(self._V, dV)
+            self._forget('V')
+        if dU is not None:
+            self._U = _add(self._U, dU)
+            self._forget('U')
+        if dM is not None:
+            self._extensions = _add(self._extensions, dM)
+            self._forget('extensions')
+
+        new_T_cols = tl.inv_scale_rows(self.V[:, cols_V].T,
+                                       tl.column_sums(self.V[:, cols_V]))
+        dT_cols = new_T_cols - T_cols
+        new_q_rows = tl.row_sums(self.V[rows_V])
+
+        self._cache = {}
+        if 'q' in old:
+            q = old['q'].copy()
+            q[rows_V] = new_q_rows
+            self._store('q', q)
+        if 'T' in old:
+            T = old['T'].copy()
+            T[cols_V] = new_T_cols
+            self._store('T', T)
+
+        for name, z_name, a_name, delta, rows in sources:
+            if z_name not in old:
+                continue
+            if len(cols_V) == 0 and len(rows) == 0:
+                self._store(z_name, old[z_name])
+                if a_name in old:
+                    self._store(a_name, old[a_name])
+                continue
+            Z = old[z_name].copy()
+            if len(cols_V) > 0:
+                Z += inputs[name] @ dT_cols
+            if len(rows) > 0:
+                Z[rows] += delta[rows] @ self.transformation_matrix()
+            self._store(z_name, Z)
+            if a_name not in old:
+                continue
+            if len(rows_V) > 0:
+                A = tl.inv_scale_columns(Z, self.q)
+            else:
+                A = old[a_name].copy()
+                A[rows] = tl.inv_scale_columns(Z[rows], self.q)
+            self._store(a_name, A)
+
+        if isinstance(solver, lt.IterativeLeontiefSolver):
+            # an iterative solver only needs the new A, it is warm started
+            # from the previous solutions
+            self._store('LU', solver.with_matrix(self.io_coefficient_matrix()))
+        if not low_rank:
+            return None
+
+        # the change of A as P Q^T: the changed rows of the use matrix, the
+        # changed rows of the transformation matrix and the rescaled columns
+        # of the products of which the total output changed
+        q_scale = tl.reciprocal(self.q)
+        P = [_selection(size, rows_U), inputs['U']]
+        Q = [(dU[rows_U] @ self.transformation_matrix() * q_scale).T
+             if len(rows_U) > 0 else np.zeros((size, 0)),
+             (dT_cols * q_scale).T]
+        if len(rows_V) > 0:
+            P.append(Z_cols)
+            Q.append(_selection(size, rows_V) *
+                     (tl.reciprocal(new_q_rows) - tl.reciprocal(q_rows)))
+        P = np.hstack(P)
+        Q = np.hstack(Q)
+        rank = P.shape[1]
+        if isinstance(solver, lt.UpdatedLeontiefSolver):
+            rank += solver.rank
+        if rank > max_rank:
+            return None
+
+        if isinstance(solver, (lt.LeontiefSolver, lt.UpdatedLeontiefSolver)):
+            self._store('LU', lt.UpdatedLeontiefSolver(solver, P, Q))
+        if 'L' in old:
+            self._store('L', lt.update_inverse(old['L'], P, Q))
+        return P.shape[1]
+
+    def _store(self, name, result):
+        if name in self._stored:
+            result = self._as_stored(result)
+        if isinstance(result, np.ndarray):
+            result.flags.writeable = False
+        self._cache[name] = result
 
     def final_demand(self, fd=None):
         if fd is None:
             fd = self.Y
         return fd
 
+    def leontief(self):
+        """
+        Returns the solver of the Leontief system of this model. Products
+        with the Leontief inverse such as L y or B L should be calculated
+        with this solver instead of building the full inverse.
+        """
+        return self._cached('LU', lambda: lt.make_solver(
+            self.io_coefficient_matrix(), self.solver, **self.solver_options))
+
     def io_total_requirement_matrix(self):
-        A = self.io_coefficient_matrix()
-        identity = np.identity(len(A))
-        A = np.nan_to_num(A)
-        return np.linalg.inv(identity - A)
+        return self._cached('L', lambda: self.leontief().inverse())
 
     def check_io_transaction_matrix(self, rel_tol=default_rel_tol):
-        is_correct = True
-        q1 = np.sum(self.io_transaction_matrix(), axis=1) + \
-            np.sum(self.Y, axis=1)
-        q2 = np.sum(self.U, axis=1) + \
-            np.sum(self.Y, axis=1)
-        it = np.nditer(q1, flags=['f_index'])
-        while not it.finished and is_correct:
-            if not math.isclose(q1[it.index], q2[it.index], rel_tol=rel_tol):
-                print(q1[it.index]- q2[it.index])
-                is_correct = False
-            it.iternext()
-        return is_correct
+        q1 = tl.row_sums(self.io_transaction_matrix()) + \
+            tl.row_sums(self.Y)
+        q2 = tl.row_sums(self.U) + \
+            tl.row_sums(self.Y)
+        return bl.BalanceReport('product output from transaction matrix',
+                                q2, q1, rel_tol,
+                                labels=self._sut.product_categories)
 
     def check_io_coefficients_matrix(self, rel_tol=default_rel_tol):
-        is_correct = True
-        q1 = np.sum(self.io_transaction_matrix(), axis=1) + \
-            np.sum(self.Y, axis=1)
-        (row_cnt, col_cnt) = self.U.shape
-        eye = np.diag(np.ones(row_cnt))
-        l_inverse = np.linalg.inv(eye - self.io_coefficient_matrix())
-        fd = np.sum(self.Y, axis=1)
-        q2 = np.dot(l_inverse, fd)
-        it = np.nditer(q1, flags=['f_index'])
-        while not it.finished and is_correct:
-            if not math.isclose(q1[it.index], q2[it.index], rel_tol=rel_tol):
-                is_correct = False
-            it.iternext()
-        return is_correct
+        q1 = tl.row_sums(self.io_transaction_matrix()) + \
+            tl.row_sums(self.Y)
+        fd = tl.row_sums(self.Y)
+        q2 = self.leontief().solve(fd)
+        return bl.BalanceReport('product output from coefficients matrix',
+                                q1, q2, rel_tol,
+                                labels=self._sut.product_categories)
 
     def check_ext_transaction_matrix(self, rel_tol=default_rel_tol):
-        is_correct = True
-        e1 = np.sum(self._sut.extensions, axis=1)
-        e2 = np.sum(self.ext_transaction_matrix(), axis=1)
-        it = np.nditer(e1, flags=['f_index'])
-        while not it.finished and is_correct:
-            if not math.isclose(e1[it.index], e2[it.index], rel_tol=rel_tol):
-                is_correct = False
-            it.iternext()
-        return is_correct
+        e1 = tl.row_sums(self.extensions)
+        e2 = tl.row_sums(self.ext_transaction_matrix())
+        return bl.BalanceReport('extensions from transaction matrix',
+                                e1, e2, rel_tol,
+                                labels=self._sut.extension_categories)
 
     def check_ext_coefficient_matrix(self, rel_tol=default_rel_tol):
-        is_correct = True
-        e1 = np.sum(self._sut.extensions, axis=1)
+        e1 = tl.row_sums(self.extensions)
         ext = self.ext_coefficients_matrix()
-        (row_cnt, col_cnt) = self.U.shape
-        eye = np.diag(np.ones(row_cnt))
-        l_inverse = np.linalg.inv(eye - self.io_coefficient_matrix())
-        fd = np.sum(self.Y, axis=1)
-        e2 = np.dot(ext, np.dot(l_inverse, fd))
-        it = np.nditer(e1, flags=['f_index'])
-        while not it.finished and is_correct:
-            if not math.isclose(e1[it.index], e2[it.index], rel_tol=rel_tol):
-                is_correct = False
-            it.iternext()
-        return is_correct
+        fd = tl.row_sums(self.Y)
+        e2 = ext @ self.leontief().solve(fd)
+        return bl.BalanceReport('extensions from coefficients matrix',
+                                e1, e2, rel_tol,
+                                labels=self._sut.extension_categories)
+
+    def check_leontief_inverse(self, rel_tol=default_rel_tol):
+        """
+        Compares the total output calculated with the stored Leontief
+        inverse to the output solved with the factorization, this shows the
+        error of storing L in the precision of the model.
+        """
+        fd = tl.row_sums(self.Y)
+        x1 = self.leontief().solve(fd)
+        x2 = self.io_total_requirement_matrix() @ fd
+        return bl.BalanceReport('product output from Leontief inverse',
+                                x1, x2, rel_tol,
+                                labels=self._sut.product_categories)
@@ -0,0 +1,105 @@
+"""
+Writing of output matrices to .npy files. Data is written to a temporary
+file which is renamed to the final filename once it is complete, so an
+interrupted run never leaves a partial file under the final name. Large
+matrices can be written in row blocks into a memory mapped file, so only
+one block needs to be in memory at a time.
+"""
+import os
+import numpy as np
+import pySUTtoIO.tools as tl
+
+
+def _temporary_filename(filename):
+    return filename + '.part'
+
+
+class NpyWriter:
+    """Writes a two dimensional array into a .npy file block by block.
+
+    Used as context manager the file is only renamed to its final name when
+    the block exits without an exception, otherwise the temporary file is
+    removed."""
+
+    def __init__(self, filename, shape, dtype=np.float64):
+        self.filename = filename
+        self._temporary = _temporary_filename(filename)
+        self._memmap = np.lib.format.open_memmap(self._temporary, mode='w+',
+                                                 dtype=dtype, shape=shape)
+
+    @property
+    def shape(self):
+        return self._memmap.shape
+
+    def __setitem__(self, index, block):
+        self._memmap[index] = block
+
+    def close(self):
+        """Flushes all data and moves the file to its final name."""
+        self._memmap.flush()
+        self._memmap = None
+        os.replace(self._temporary, self.filename)
+
+    def abort(self):
+        """Discards the temporary file."""
+        self._memmap = None
+        if os.path.exists(self._temporary):
+            os.remove(self._temporary)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+def default_block_rows(shape, block_bytes=2 ** 26):
+    """Number of rows of float64 values that fit in block_bytes."""
+    return max(1, block_bytes // (8 * max(1, shape[1])))
+
+
+def save(filename, array):
+    """
+    Saves an array to a .npy file, sparse matrices are saved dense.
+
+    :param filename : str
+            Full qualified filename
+    :param array : numpy array or scipy sparse matrix
+    """
+    temporary = _temporary_filename(filename)
+    try:
+        with open(temporary, 'wb') as npy:
+            np.save(npy, tl.to_dense(array))
+        os.replace(temporary, filename)
+    except BaseException:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+        raise
+
+
+def save_row_blocks(filename, shape, compute_rows, block_rows=None,
+                    dtype=np.float64):
+    """
+    Saves a matrix that is computed in row blocks, only one block is held
+    in memory at a time.
+
+    :param filename : str
+            Full qualified filename
+    :param shape : tuple
+            Shape of the complete matrix
+    :param compute_rows : function
+            Called with start and stop row, returns these rows of the matrix
+    :param block_rows : int, optional
+            Rows per block, by default blocks of about 64 MB
+    :param dtype : numpy dtype
+            Type of the saved values, the blocks are converted to it
+    """
+    if block_rows is None:
+        block_rows = default_block_rows(shape)
+    with NpyWriter(filename, shape, dtype) as writer:
+        for start in range(0, shape[0], block_rows):
+            stop = min(start + block_rows, shape[0])
+            writer[start:stop] = compute_rows(start, stop)
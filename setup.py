@@ -11,11 +11,11 @@ with open('README.rst') as readme_file:
 with open('HISTORY.rst') as history_file:
     history = history_file.read()
 
-requirements = [ ]
+requirements = ['numpy', 'scipy']
 
 setup_requirements = [ ]
 
-test_requirements = [ ]
+test_requirements = ['numpy', 'scipy']
 
 setup(
     author="Franco Donati",
@@ -26,11 +26,13 @@ setup(
         'License :: OSI Approved :: MIT License',
         'Natural Language :: English',
         'Programming Language :: Python :: 3',
-        'Programming Language :: Python :: 3.4',
-        'Programming Language :: Python :: 3.5',
-        'Programming Language :: Python :: 3.6',
         'Programming Language :: Python :: 3.7',
     ],
+    entry_points={
+        'console_scripts': [
+            'pySUTtoIO=pySUTtoIO.cli:main',
+        ],
+    },
     description="Package to generate IO tables from exiobase SUTs as well as allowing for changes in location of secondary raw materials",
     install_requires=requirements,
     license="MIT license",
@@ -39,6 +41,7 @@ setup(
     keywords='pySUTtoIO',
     name='pySUTtoIO',
     packages=find_packages(include=['pySUTtoIO']),
+    python_requires='>=3.7',
     setup_requires=setup_requirements,
     test_suite='tests',
     tests_require=test_requirements,
@@ -1,16 +1,75 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
-"""Tests for `pyEXIO_SUTtoIO` package."""
+"""Tests for `pySUTtoIO` package."""
 
 
+import concurrent.futures
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
 import unittest
+from unittest import mock
 
-from pyEXIO_SUTtoIO import pyEXIO_SUTtoIO
+import numpy as np
+import scipy.sparse as sp
 
+import pySUTtoIO.aggregation as ag
+import pySUTtoIO.balance as bl
+import pySUTtoIO.batch as bt
+import pySUTtoIO.benchmark as bm
+import pySUTtoIO.bundle as bd
+import pySUTtoIO.cli as cli
+import pySUTtoIO.characterization as ch
+import pySUTtoIO.dimensions as dm
+import pySUTtoIO.disk_cache as dc
+import pySUTtoIO.instrumentation as ins
+import pySUTtoIO.labels as lb
+import pySUTtoIO.leontief as lt
+import pySUTtoIO.main as mn
+import pySUTtoIO.make_ramascene_data as rama
+import pySUTtoIO.read_msut_exiobase as rd
+import pySUTtoIO.scenarios as sc
+import pySUTtoIO.secondary_flows as sf
+import pySUTtoIO.sut as st
+import pySUTtoIO.table_reader as tr
+import pySUTtoIO.tools as tl
+import pySUTtoIO.transformation_model_b as mb
+import pySUTtoIO.writer as wr
 
-class TestPyexio_suttoio(unittest.TestCase):
-    """Tests for `pyEXIO_SUTtoIO` package."""
+
+def make_sut(prd_cnt=6, ind_cnt=5, fd_cnt=2, ext_cnt=3, seed=0, cntr_cnt=1):
+    """
+    Creates a small balanced supply-use table with random values, the
+    counts are the totals of all countries.
+    """
+    rng = np.random.RandomState(seed)
+    supply = rng.uniform(1, 10, (prd_cnt, ind_cnt))
+    use = rng.uniform(0, 1, (prd_cnt, ind_cnt))
+    final_use = rng.uniform(0, 1, (prd_cnt, fd_cnt))
+    # balance product supply and use through final use
+    final_use = final_use / np.sum(final_use, axis=1, keepdims=True) * \
+        (np.sum(supply, axis=1, keepdims=True) -
+         np.sum(use, axis=1, keepdims=True))
+    # balance industry input and output through value added
+    value_added = np.sum(supply, axis=0) - np.sum(use, axis=0)
+    factor_inputs = np.vstack([value_added, np.zeros((8, ind_cnt))])
+
+    sut = st.Sut(dm.Dimensions(cntr_cnt, prd_cnt // cntr_cnt,
+                               ind_cnt // cntr_cnt, fd_cnt // cntr_cnt))
+    sut.supply = supply
+    sut.use = use
+    sut.final_use = final_use
+    sut.factor_inputs = factor_inputs
+    sut.extensions = rng.uniform(0, 5, (ext_cnt, ind_cnt))
+    return sut
+
+
+class TestPySUTtoIO(unittest.TestCase):
+    """Tests for `pySUTtoIO` package."""
 
     def setUp(self):
         """Set up test fixtures, if any."""
@@ -20,3 +79,1225 @@ class TestPyexio_suttoio(unittest.TestCase):
 
     def test_000_something(self):
         """Test something."""
+
+
+class TestTools(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.RandomState(1)
+        self.matrix = rng.uniform(-5, 5, (7, 4))
+        self.rows = rng.uniform(-5, 5, 7)
+        self.rows[[1, 4]] = 0
+        self.columns = rng.uniform(-5, 5, 4)
+        self.columns[2] = 0
+
+    def test_reciprocal(self):
+        np.testing.assert_array_equal(tl.reciprocal([0, 2, -4]),
+                                      [0, 0.5, -0.25])
+
+    def test_inv_scale_rows_matches_invdiag(self):
+        np.testing.assert_array_equal(
+            tl.inv_scale_rows(self.matrix, self.rows),
+            np.dot(tl.invdiag(self.rows), self.matrix))
+
+    def test_inv_scale_columns_matches_invdiag(self):
+        np.testing.assert_array_equal(
+            tl.inv_scale_columns(self.matrix, self.columns),
+            np.dot(self.matrix, tl.invdiag(self.columns)))
+
+    def test_remove_duplicates(self):
+        labels = [['NL', 'a'], ['DE', 'a'], ['NL', 'a'], ['NL', 'b']]
+        self.assertEqual(tl.remove_duplicates(labels),
+                         [['NL', 'a'], ['DE', 'a'], ['NL', 'b']])
+        self.assertEqual(tl.remove_duplicates([3, 1, 3]), [3, 1])
+
+
+class TestDimensions(unittest.TestCase):
+
+    def setUp(self):
+        self.dimensions = dm.Dimensions(cntr_cnt=3, prd_cnt=4, ind_cnt=2,
+                                        fd_cnt=1)
+
+    def test_blocks(self):
+        self.assertEqual(self.dimensions.supply_shape, (12, 6))
+        self.assertEqual(self.dimensions.final_use_shape, (12, 3))
+        self.assertEqual(self.dimensions.product_block(1), slice(4, 8))
+        np.testing.assert_array_equal(
+            self.dimensions.product_positions([0, 3]), [0, 3, 4, 7, 8, 11])
+        np.testing.assert_array_equal(
+            self.dimensions.industry_positions([1]), [1, 3, 5])
+
+    def test_from_labels(self):
+        products = [[country, 'p{}'.format(idx)] for country in 'ABC'
+                    for idx in range(4)]
+        industries = [[country, 'i{}'.format(idx)] for country in 'ABC'
+                      for idx in range(2)]
+        finaluses = [[country, 'households'] for country in 'ABC']
+        self.assertEqual(dm.Dimensions.from_labels(products, industries,
+                                                   finaluses),
+                         self.dimensions)
+
+    def test_sut_shapes(self):
+        sut = st.Sut(self.dimensions)
+        sut.supply = np.ones((12, 6))
+        with self.assertRaises(AssertionError):
+            sut.use = np.ones((12, 7))
+        with self.assertRaises(AssertionError):
+            sut.final_use = np.ones((12, 7))
+        self.assertEqual(st.Sut().dimensions, dm.exiobase)
+
+
+class TestAggregation(unittest.TestCase):
+
+    def setUp(self):
+        self.sut = make_sut(prd_cnt=8, ind_cnt=6, fd_cnt=4, cntr_cnt=2)
+        self.products = ag.Concordance(['a', 'b', 'a', 'c'])
+        self.aggregation = ag.Aggregation(
+            self.sut.dimensions, products=self.products,
+            countries=ag.Concordance(['EU', 'EU']))
+        # dense concordance of all products, only used as reference
+        self.S = self.aggregation.product_rows.operator().toarray()
+
+    def test_concordance(self):
+        self.assertEqual(self.products.names, ['a', 'b', 'c'])
+        matrix = np.arange(12.0).reshape(4, 3)
+        np.testing.assert_array_equal(
+            self.products.sum_rows(matrix),
+            self.products.operator().toarray() @ matrix)
+        np.testing.assert_array_equal(
+            self.products.sum_columns(matrix.T),
+            matrix.T @ self.products.operator().toarray().T)
+        sparse = self.products.sum_rows(sp.csr_matrix(matrix))
+        self.assertTrue(sp.issparse(sparse))
+        np.testing.assert_array_equal(sparse.toarray(),
+                                      self.products.sum_rows(matrix))
+
+    def test_from_file(self):
+        concordance = ag.Concordance.from_file()
+        self.assertEqual((concordance.size, concordance.group_cnt), (200, 17))
+        codes = ['p99', 'p01.a']
+        concordance = ag.Concordance.from_file(codes=codes)
+        self.assertEqual(concordance.names, ['17', '1'])
+
+    def test_sut(self):
+        aggregated = self.aggregation.sut(self.sut)
+        self.assertEqual(aggregated.dimensions, dm.Dimensions(1, 3, 3, 2))
+        np.testing.assert_allclose(aggregated.supply,
+                                   self.S @ self.sut.supply @
+                                   np.hstack([np.identity(3)] * 2).T)
+        np.testing.assert_allclose(np.sum(aggregated.total_product_supply),
+                                   np.sum(self.sut.total_product_supply))
+        model = mb.TransformationModelB(aggregated, False)
+        self.assertTrue(model.check_io_coefficients_matrix())
+
+    def test_regroup_final_demand(self):
+        Y = np.arange(24.0).reshape(2, 12)  # 4 countries, 3 categories
+        np.testing.assert_array_equal(ag.regroup_final_demand(Y, 3),
+                                      [[3, 12, 21, 30], [39, 48, 57, 66]])
+        regrouped = ag.regroup_final_demand(Y, 3, [[0], [1, 2]])
+        np.testing.assert_array_equal(regrouped[0], [0, 3, 3, 9, 6, 15,
+                                                     9, 21])
+
+    def test_coefficients(self):
+        model = mb.TransformationModelB(self.sut, False)
+        x = model.q
+        S = self.S
+        Z = model.io_transaction_matrix()
+        np.testing.assert_allclose(self.aggregation.transactions(Z),
+                                   S @ Z @ S.T)
+        expected = S @ model.io_coefficient_matrix() @ np.diag(x) @ S.T / \
+            (S @ x)
+        np.testing.assert_allclose(
+            self.aggregation.coefficients(model.io_coefficient_matrix(), x),
+            expected)
+        B = model.ext_coefficients_matrix()
+        np.testing.assert_allclose(
+            self.aggregation.extension_coefficients(B, x),
+            B @ np.diag(x) @ S.T / (S @ x))
+
+
+class TestCharacterization(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.factors = np.array([[1, 0], [0, 0], [2, 1], [0, 3]])
+        self.layout = (('W', None), ('M', (5, 2)))
+
+    def test_operators(self):
+        characterization = ch.Characterization(self.factors, self.layout)
+        # the second factor input has no factors and is never read
+        np.testing.assert_array_equal(characterization.rows['W'], [0])
+        np.testing.assert_array_equal(characterization.rows['M'], [2, 5])
+        rng = np.random.RandomState(4)
+        W = rng.uniform(size=(2, 3))
+        M = rng.uniform(size=(6, 3))
+        expected = self.factors.T @ np.vstack([W, M[[5, 2]]])
+        np.testing.assert_allclose(
+            characterization.apply({'W': W, 'M': M}), expected)
+        np.testing.assert_allclose(
+            characterization.apply_rows({'W': W[[0]], 'M': M[[2, 5]]}),
+            expected)
+
+    def test_load(self):
+        filename = os.path.join(self.tmp.name, 'indicators.txt')
+        tl.list_to_csv_file(filename, self.factors.tolist(), '\t')
+        loaded = ch.load(filename, self.layout)
+        self.assertIs(ch.load(filename, self.layout), loaded)
+        self.assertTrue(os.path.exists(os.path.join(self.tmp.name,
+                                                    'indicators.npz')))
+        ch._load.cache_clear()
+        compiled = ch.load(filename, self.layout)
+        self.assertIsNot(compiled, loaded)
+        self.assertEqual(compiled.sizes, {'W': 2})
+        for source in ['W', 'M']:
+            np.testing.assert_array_equal(
+                compiled.operators[source].toarray(),
+                loaded.operators[source].toarray())
+
+    def test_check(self):
+        characterization = ch.Characterization(self.factors, self.layout)
+        characterization.check('W', 2)
+        characterization.check('M', 6)
+        for source, row_cnt in [('W', 3), ('M', 5)]:
+            with self.assertRaises(ValueError):
+                characterization.check(source, row_cnt)
+        with self.assertRaises(ValueError):
+            characterization.apply({'W': np.ones((3, 2)),
+                                    'M': np.ones((6, 2))})
+        with self.assertRaises(ValueError):
+            characterization.apply_rows({})
+        # a source without factors counts as zero
+        characterization = ch.Characterization(np.zeros((4, 2)),
+                                               self.layout)
+        np.testing.assert_array_equal(
+            characterization.apply({'W': np.ones((2, 3)),
+                                    'M': np.ones((6, 3))}),
+            np.zeros((2, 3)))
+
+    def test_ramascene_layouts(self):
+        # small tables with the EXIOBASE factor inputs and extensions
+        sut = bm.synthetic_sut(1, 20, 15, 2, 1104)
+        groups = ag.Concordance(list(range(17)) + [0, 1, 2])
+        shapes = {}
+        for version in ['v2', 'v3']:
+            filename = os.path.join(self.tmp.name,
+                                    'indicators_{}.txt'.format(version))
+            shutil.copyfile(os.path.join('data', 'auxiliary',
+                                         'indicators_{}.txt'.format(version)),
+                            filename)
+            indicators = ch.load(filename)
+            self.assertEqual(indicators.sizes, {'factor_inputs': 23})
+            directory = os.path.join(self.tmp.name, version)
+            os.makedirs(directory)
+            rama.main(directory, mb.TransformationModelB(sut, False),
+                      indicators=indicators, product_groups=groups)
+            B = np.load(os.path.join(directory, 'B_v4.npy'))
+            self.assertTrue(np.all(np.isfinite(B)))
+            shapes[version] = B.shape
+        self.assertEqual(shapes, {'v2': (77, 20), 'v3': (60, 20)})
+        self.assertIn('product_inputs', ch.load(filename.replace(
+            'v3', 'v2')).rows)
+        # the v2 file split like v3 has too many factor input rows
+        wrong = ch.load(filename.replace('v3', 'v2'), ch.ramascene_layout)
+        with self.assertRaises(ValueError):
+            rama.main(self.tmp.name, mb.TransformationModelB(sut, False),
+                      indicators=wrong)
+
+    def test_ext_transaction_rows(self):
+        model = mb.TransformationModelB(make_sut(), False)
+        rows = model.ext_transaction_matrix([2, 0])
+        np.testing.assert_allclose(rows,
+                                   model.ext_transaction_matrix()[[2, 0]])
+        self.assertEqual(model.cache_misses['ext_Z'], 1)
+
+
+class TestLabelIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.labels = [[country, 'product {}'.format(idx), 'C_{}'.format(idx)]
+                       for country in ['NL', 'DE', 'FR'] for idx in range(4)]
+        self.index = lb.LabelIndex(self.labels)
+
+    def test_lookup(self):
+        self.assertEqual(self.index.index('DE', 'C_2'), 6)
+        self.assertEqual(self.index.index('DE', 'product 2'), 6)
+        self.assertEqual(self.index[6], ['DE', 'product 2', 'C_2'])
+        self.assertRaises(KeyError, self.index.index, 'BE', 'C_2')
+        self.assertRaises(KeyError, self.index.index, 'NL', 'C_9')
+
+    def test_indices(self):
+        np.testing.assert_array_equal(
+            self.index.indices(['FR', 'NL', 'FR'], ['C_0', 'C_3', 'C_1']),
+            [8, 3, 9])
+        np.testing.assert_array_equal(
+            self.index.positions(['C_1', 'C_3']).ravel(),
+            sf.make_coord_array(np.array([1, 3]), 3, 4))
+        self.assertRaises(KeyError, self.index.indices, 'NL', ['C_0', 'x'])
+
+    def test_country_blocks(self):
+        self.assertEqual(self.index.countries, ['NL', 'DE', 'FR'])
+        self.assertEqual(self.index.country_slice('DE'), slice(4, 8))
+        self.assertEqual(len(self.index.country_blocks()), 3)
+
+    def test_sut_index(self):
+        sut = st.Sut()
+        self.assertIsNone(sut.product_index)
+        sut.product_categories = self.labels
+        self.assertEqual(sut.product_index.index('FR', 'C_0'), 8)
+
+
+class TestBalanceReport(unittest.TestCase):
+
+    def test_report(self):
+        expected = np.array([1.0, 2.0, 0.0, 4.0, 5.0])
+        actual = np.array([1.0, 2.5, 0.0, np.nan, 5.001])
+        labels = [['NL', 'p{}'.format(idx)] for idx in range(5)]
+        report = bl.BalanceReport('test', expected, actual, rel_tol=1E-3,
+                                  labels=labels)
+        self.assertFalse(report)
+        np.testing.assert_array_equal(report.indices, [1, 3])
+        self.assertEqual(report.labels, [['NL', 'p1'], ['NL', 'p3']])
+        np.testing.assert_allclose(report.abs_error[0], 0.5)
+        np.testing.assert_allclose(report.rel_error[0], 0.2)
+        self.assertEqual(len(report.to_list()), 3)
+
+    def test_abs_tol(self):
+        report = bl.BalanceReport('test', [1.0, 2.0], [1.01, 2.5],
+                                  abs_tol=0.1)
+        np.testing.assert_array_equal(report.indices, [1])
+        self.assertTrue(bl.BalanceReport('test', [1.0], [1.01], abs_tol=0.1))
+
+
+class TestLeontiefSolver(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.RandomState(2)
+        self.A = rng.uniform(0, 0.1, (8, 8))
+        self.L = np.linalg.inv(np.identity(8) - self.A)
+        self.solver = lt.LeontiefSolver(self.A)
+
+    def test_solve(self):
+        y = np.arange(8.0)
+        np.testing.assert_allclose(self.solver.solve(y), self.L @ y)
+        Y = np.ones((8, 3))
+        np.testing.assert_allclose(self.solver.solve_many(Y), self.L @ Y)
+
+    def test_solve_transpose(self):
+        B = np.arange(16.0).reshape(2, 8)
+        np.testing.assert_allclose(self.solver.solve_transpose(B), B @ self.L)
+        np.testing.assert_allclose(self.solver.solve_transpose(B[0]),
+                                   B[0] @ self.L)
+
+    def test_inverse(self):
+        np.testing.assert_allclose(self.solver.inverse(), self.L)
+
+
+class TestUpdatedLeontiefSolver(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.RandomState(7)
+        self.A = rng.uniform(0, 0.1, (8, 8))
+        self.P = rng.uniform(0, 0.05, (8, 2))
+        self.Q = rng.uniform(0, 0.05, (8, 2))
+        self.L = np.linalg.inv(np.identity(8) - self.A - self.P @ self.Q.T)
+
+    def test_solver(self):
+        solver = lt.UpdatedLeontiefSolver(lt.LeontiefSolver(self.A),
+                                          self.P[:, :1], self.Q[:, :1])
+        # a second update is stacked on the original solver
+        solver = lt.UpdatedLeontiefSolver(solver, self.P[:, 1:],
+                                          self.Q[:, 1:])
+        self.assertEqual(solver.rank, 2)
+        y = np.arange(8.0)
+        np.testing.assert_allclose(solver.solve(y), self.L @ y)
+        B = np.ones((3, 8))
+        np.testing.assert_allclose(solver.solve_transpose(B), B @ self.L)
+        np.testing.assert_allclose(solver.inverse(), self.L)
+        np.testing.assert_allclose(solver.inverse_rows(2, 5), self.L[2:5])
+
+    def test_update_inverse(self):
+        L = np.linalg.inv(np.identity(8) - self.A)
+        np.testing.assert_allclose(lt.update_inverse(L, self.P, self.Q),
+                                   self.L)
+
+
+class TestMixedPrecision(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.RandomState(3)
+        self.A = rng.uniform(0, 0.1, (50, 50))
+        self.L = np.linalg.inv(np.identity(50) - self.A)
+        self.y = rng.uniform(1, 2, 50)
+
+    def test_refinement(self):
+        single = lt.LeontiefSolver(self.A, dtype=np.float32)
+        refined = lt.LeontiefSolver(self.A, dtype=np.float32, refine=5)
+        expected = self.L @ self.y
+        x = refined.solve(self.y)
+        self.assertEqual(x.dtype, np.float64)
+        self.assertTrue(refined.report.converged)
+        self.assertGreater(refined.report.iterations, 0)
+        np.testing.assert_allclose(x, expected, rtol=1E-13)
+        self.assertGreater(np.max(np.abs(single.solve(self.y) - expected)),
+                           np.max(np.abs(x - expected)))
+        B = np.ones((2, 50))
+        np.testing.assert_allclose(refined.solve_transpose(B), B @ self.L,
+                                   rtol=1E-13)
+
+    def test_single_precision_model(self):
+        sut = make_sut()
+        double = mb.TransformationModelB(sut, False)
+        single = mb.TransformationModelB(sut, False, precision='single')
+        self.assertEqual(single.io_coefficient_matrix().dtype, np.float32)
+        self.assertEqual(single.io_total_requirement_matrix().dtype,
+                         np.float32)
+        self.assertEqual(single.q.dtype, np.float64)
+        np.testing.assert_allclose(single.io_coefficient_matrix(),
+                                   double.io_coefficient_matrix(), rtol=1E-6)
+        for check in ('check_io_transaction_matrix',
+                      'check_io_coefficients_matrix',
+                      'check_ext_coefficient_matrix',
+                      'check_leontief_inverse'):
+            report = getattr(single, check)()
+            self.assertTrue(report)
+            self.assertLess(report.max_rel_error,
+                            mb.TransformationModelB.default_rel_tol)
+        self.assertGreater(single.check_leontief_inverse().max_rel_error,
+                           double.check_leontief_inverse().max_rel_error)
+
+
+class TestIterativeLeontiefSolver(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.RandomState(3)
+        self.A = rng.uniform(0, 0.1, (8, 8))
+        self.L = np.linalg.inv(np.identity(8) - self.A)
+
+    def test_methods(self):
+        y = np.arange(8.0)
+        B = np.arange(16.0).reshape(2, 8)
+        for method in lt.IterativeLeontiefSolver.methods:
+            for A in [self.A, sp.csr_matrix(self.A)]:
+                solver = lt.make_solver(A, method, tol=1E-12)
+                np.testing.assert_allclose(solver.solve(y), self.L @ y)
+                self.assertTrue(solver.report.converged)
+                np.testing.assert_allclose(solver.solve_many(np.ones((8, 3))),
+                                           self.L @ np.ones((8, 3)))
+                np.testing.assert_allclose(solver.solve_transpose(B),
+                                           B @ self.L)
+
+    def test_warm_start(self):
+        solver = lt.make_solver(self.A, 'power', tol=1E-12)
+        y = np.ones(8)
+        solver.solve(y)
+        cold = solver.report.iterations
+        solver.solve(y * 1.001)
+        self.assertLess(solver.report.iterations, cold)
+
+    def test_not_converged(self):
+        solver = lt.make_solver(self.A, 'power', tol=1E-12, maxiter=2)
+        solver.solve(np.ones(8))
+        self.assertFalse(solver.report.converged)
+        self.assertEqual(solver.report.iterations, 2)
+
+
+class TestTransformationModelB(unittest.TestCase):
+
+    def setUp(self):
+        self.sut = make_sut()
+        self.model = mb.TransformationModelB(self.sut, False)
+
+    def test_checks(self):
+        self.assertTrue(self.model.check_io_transaction_matrix())
+        self.assertTrue(self.model.check_io_coefficients_matrix())
+        self.assertTrue(self.model.check_ext_transaction_matrix())
+        self.assertTrue(self.model.check_ext_coefficient_matrix())
+
+    def test_check_report(self):
+        labels = [['NL', 'p{}'.format(idx)] for idx in range(6)]
+        self.sut.product_categories = labels
+        self.model.Y = self.model.Y * 2
+        report = self.model.check_io_coefficients_matrix()
+        self.assertFalse(report)
+        np.testing.assert_array_equal(report.indices, range(6))
+        self.assertEqual(report.labels, labels)
+        self.assertTrue(np.all(report.rel_error > 1E-3))
+
+    def test_coefficients_match_invdiag(self):
+        model = self.model
+        T = np.dot(tl.invdiag(np.sum(model.V, axis=0)), np.transpose(model.V))
+        Z = np.dot(model.U, T)
+        np.testing.assert_array_equal(model.transformation_matrix(), T)
+        np.testing.assert_array_equal(model.io_coefficient_matrix(),
+                                      np.dot(Z, tl.invdiag(model.q)))
+        np.testing.assert_array_equal(
+            model.ext_coefficients_matrix(),
+            np.dot(np.dot(model.extensions, T), tl.invdiag(model.q)))
+
+    def test_no_duplicate_work(self):
+        model = self.model
+        model.check_io_transaction_matrix()
+        model.check_io_coefficients_matrix()
+        model.check_ext_transaction_matrix()
+        model.check_ext_coefficient_matrix()
+        model.io_coefficient_matrix()
+        model.io_total_requirement_matrix()
+        model.ext_coefficients_matrix()
+        model.factor_inputs_coefficients_matrix()
+        self.assertTrue(all(cnt == 1 for cnt in model.cache_misses.values()))
+        self.assertGreater(model.cache_hits['T'], 0)
+
+    def test_iterative_solver(self):
+        model = mb.TransformationModelB(self.sut, False, solver='gmres',
+                                        solver_options={'tol': 1E-12})
+        self.assertIsInstance(model.leontief(), lt.IterativeLeontiefSolver)
+        self.assertTrue(model.check_io_coefficients_matrix())
+        np.testing.assert_allclose(model.io_total_requirement_matrix(),
+                                   self.model.io_total_requirement_matrix())
+
+    def test_checks_do_not_build_inverse(self):
+        self.model.check_io_coefficients_matrix()
+        self.model.check_ext_coefficient_matrix()
+        self.assertNotIn('L', self.model.cache_misses)
+
+    def test_invalidation(self):
+        model = self.model
+        A = model.io_coefficient_matrix()
+        B = model.ext_coefficients_matrix()
+        model.U = model.U * 2
+        self.assertIs(model.ext_coefficients_matrix(), B)
+        self.assertEqual(model.cache_misses['T'], 1)
+        np.testing.assert_allclose(model.io_coefficient_matrix(), A * 2)
+        model.extensions = model.extensions * 3
+        np.testing.assert_allclose(model.ext_coefficients_matrix(), B * 3)
+        self.assertEqual(model.cache_misses['T'], 1)
+        model.V = model.V * 2
+        self.assertEqual(model.cache_misses['T'], 1)
+        model.io_coefficient_matrix()
+        self.assertEqual(model.cache_misses['T'], 2)
+
+    def test_release(self):
+        model = self.model
+        L = model.io_total_requirement_matrix()
+        model.release('T', 'Z', 'A')
+        self.assertIs(model.io_total_requirement_matrix(), L)
+        model.V = model.V * 2
+        A = model.io_coefficient_matrix()
+        np.testing.assert_allclose(model.io_total_requirement_matrix(),
+                                   np.linalg.inv(np.eye(len(A)) - A))
+        self.assertEqual(model.cache_misses['L'], 2)
+        model.release('A', 'LU')
+        model.U = model.U * 2
+        np.testing.assert_allclose(model.io_coefficient_matrix(), A * 2)
+        np.testing.assert_allclose(model.io_total_requirement_matrix(),
+                                   np.linalg.inv(np.eye(len(A)) - A * 2))
+
+    def test_invalidation_after_release(self):
+        model = self.model
+        A = model.io_coefficient_matrix()
+        L = model.io_total_requirement_matrix()
+        model.release('Z')
+        model.U = model.U * 2
+        np.testing.assert_allclose(model.io_coefficient_matrix(), A * 2)
+        np.testing.assert_allclose(model.io_total_requirement_matrix(),
+                                   np.linalg.inv(np.eye(len(A)) - A * 2))
+        self.assertFalse(np.allclose(model.io_total_requirement_matrix(), L))
+
+
+class TestDiskCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.cache = dc.DiskCache(self.tmp.name)
+
+    def test_round_trip(self):
+        dense = np.arange(6.0).reshape(2, 3)
+        sparse = sp.csr_matrix(dense)
+        self.cache.put('dense', dense)
+        self.cache.put('sparse', sparse)
+        self.cache.put('arrays', {'lu': dense, 'piv': np.arange(2)})
+        np.testing.assert_array_equal(self.cache.get('dense'), dense)
+        np.testing.assert_array_equal(self.cache.get('sparse').toarray(),
+                                      dense)
+        np.testing.assert_array_equal(self.cache.get('arrays')['piv'],
+                                      np.arange(2))
+        self.assertIsNone(self.cache.get('missing'))
+        self.assertEqual(dc.array_digest(dense), dc.array_digest(dense + 0))
+        self.assertNotEqual(dc.array_digest(dense),
+                            dc.array_digest(dense.astype(np.float32)))
+
+    def test_integrity(self):
+        self.cache.put('dense', np.ones((4, 4)))
+        full_fn = os.path.join(self.tmp.name, 'dense.npy')
+        with open(full_fn, 'r+b') as npy:
+            npy.seek(-8, os.SEEK_END)
+            npy.write(np.float64(2).tobytes())
+        self.assertIsNone(self.cache.get('dense'))
+        self.assertNotIn('dense', self.cache)
+        self.assertFalse(os.path.exists(full_fn))
+
+    def test_eviction(self):
+        array = np.ones((16, 16))
+        self.cache.put('old', array)
+        self.cache.put('used', array)
+        # room for two entries, of which 'used' is read last
+        self.cache.max_bytes = self.cache.size()
+        os.utime(os.path.join(self.tmp.name, 'old.npy'), (2, 2))
+        os.utime(os.path.join(self.tmp.name, 'used.npy'), (1, 1))
+        self.cache.get('used')
+        self.cache.put('new', array)
+        self.assertEqual(sorted(key for _, _, key in self.cache.entries()),
+                         ['new', 'used'])
+        self.assertFalse(self.cache.put('large', np.ones((64, 64))))
+
+    def test_model(self):
+        sut = make_sut()
+        first = mb.TransformationModelB(sut, False, cache=self.cache)
+        L = first.io_total_requirement_matrix()
+        B = first.ext_coefficients_matrix()
+        model = mb.TransformationModelB(sut, False, cache=self.cache)
+        np.testing.assert_array_equal(model.io_total_requirement_matrix(), L)
+        self.assertEqual(model.disk_hits['L'], 1)
+        self.assertNotIn('A', model.cache_misses)
+        x = model.leontief().solve(tl.row_sums(model.Y))
+        self.assertEqual(model.disk_hits['LU'], 1)
+        np.testing.assert_allclose(x, L @ tl.row_sums(model.Y))
+        # only the matrices derived from the changed input are computed
+        model.extensions = model.extensions * 2
+        np.testing.assert_allclose(model.ext_coefficients_matrix(), B * 2)
+        self.assertNotIn('ext_A', model.disk_hits)
+        other = mb.TransformationModelB(sut, False, cache=self.cache,
+                                        precision='single')
+        self.assertNotEqual(other.digest('T'), model.digest('T'))
+
+    def test_launch_year(self):
+        data_dir = os.path.join(self.tmp.name, 'in')
+        os.makedirs(data_dir)
+        sut = make_sut()
+        sut.save_bundle(os.path.join(data_dir, bd.bundle_filename))
+        cache_dir = os.path.join(self.tmp.name, 'cache')
+        outputs = []
+        tracer = ins.Tracer()
+        for directory in ['first', 'second']:
+            directory = os.path.join(self.tmp.name, directory)
+            with ins.use(tracer):
+                mn.launch_year(data_dir, 'b', directory, False,
+                               cache_dir=cache_dir)
+            outputs.append(np.load(os.path.join(directory, 'L.npy')))
+        np.testing.assert_array_equal(outputs[0], outputs[1])
+        # I - A is factorized once, the second year reads the factors
+        self.assertEqual([record.info for record in tracer.records
+                          if record.name == 'LU'],
+                         [{'source': 'disk', 'hit': False}, {},
+                          {'source': 'disk', 'hit': True}])
+        self.assertIn(
+            mb.TransformationModelB(sut, False).digest('L'),
+            dc.DiskCache(cache_dir))
+
+
+class TestModelUpdate(unittest.TestCase):
+
+    def setUp(self):
+        self.sut = make_sut()
+        self.model = mb.TransformationModelB(make_sut(), False)
+        for method in ['io_coefficient_matrix', 'ext_coefficients_matrix',
+                       'factor_inputs_coefficients_matrix',
+                       'io_total_requirement_matrix', 'leontief']:
+            getattr(self.model, method)()
+        self.dU = sp.csr_matrix(([0.3, -0.1], ([1, 4], [2, 2])), shape=(6, 5))
+        self.dV = sp.csr_matrix(([0.5], ([3], [1])), shape=(6, 5))
+        self.dM = sp.csr_matrix(([1.0], ([0], [4])), shape=(3, 5))
+
+    def assert_model(self, sut):
+        expected = mb.TransformationModelB(sut, False)
+        for method in ['io_coefficient_matrix', 'ext_coefficients_matrix',
+                       'factor_inputs_coefficients_matrix',
+                       'io_total_requirement_matrix']:
+            np.testing.assert_allclose(getattr(self.model, method)(),
+                                       getattr(expected, method)(),
+                                       atol=1E-12)
+        y = np.ones(6)
+        np.testing.assert_allclose(self.model.leontief().solve(y),
+                                   expected.leontief().solve(y))
+
+    def test_update_use(self):
+        rank = self.model.update(dU=self.dU, max_rank=6)
+        self.assertEqual(rank, 2)
+        self.sut.use = self.sut.use + self.dU.toarray()
+        self.assert_model(self.sut)
+        self.assertEqual(self.model.cache_misses['LU'], 1)
+
+    def test_update_supply_and_extensions(self):
+        rank = self.model.update(dU=self.dU, dV=self.dV, dM=self.dM,
+                                 dY=np.ones((6, 2)), max_rank=6)
+        self.assertEqual(rank, 4)
+        self.sut.use = self.sut.use + self.dU.toarray()
+        self.sut.supply = self.sut.supply + self.dV.toarray()
+        self.sut.extensions = self.sut.extensions + self.dM.toarray()
+        self.assert_model(self.sut)
+        np.testing.assert_array_equal(self.model.Y,
+                                      self.sut.final_use + 1)
+
+    def test_rebuild(self):
+        self.assertIsNone(self.model.update(dU=self.dU, max_rank=1))
+        self.sut.use = self.sut.use + self.dU.toarray()
+        self.assert_model(self.sut)
+        self.assertEqual(self.model.cache_misses['LU'], 2)
+
+
+class TestScenarioEngine(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.model = mb.TransformationModelB(make_sut(ind_cnt=4, cntr_cnt=2),
+                                             False)
+        self.engine = sc.ScenarioEngine(self.model)
+        self.stack = np.random.RandomState(8).uniform(0, 1, (5, 6, 2))
+        self.L = self.model.io_total_requirement_matrix()
+        self.B = self.model.ext_coefficients_matrix()
+
+    def test_evaluate(self):
+        results = self.engine.evaluate(self.stack, sc.ScenarioEngine.results)
+        for idx, Y in enumerate(self.stack):
+            x = self.L @ Y
+            np.testing.assert_allclose(results['outputs'][idx], x)
+            np.testing.assert_allclose(results['footprints'][idx],
+                                       self.B @ x)
+            np.testing.assert_allclose(results['country_outputs'][idx],
+                                       [x[:3].sum(axis=0), x[3:].sum(axis=0)])
+            np.testing.assert_allclose(
+                results['country_footprints'][idx][:, 1],
+                self.B[:, 3:] @ x[3:])
+
+    def test_run(self):
+        source = os.path.join(self.tmp.name, 'Y.npy')
+        np.save(source, self.stack)
+        filenames = self.engine.run(source, self.tmp.name, chunk_size=2)
+        np.testing.assert_allclose(np.load(filenames['footprints']),
+                                   self.engine.footprints(self.stack))
+        chunks = [(start, stop) for start, stop, _ in
+                  self.engine.iter_chunks(self.stack, chunk_size=2)]
+        self.assertEqual(chunks, [(0, 2), (2, 4), (4, 5)])
+
+
+class TestSparseBackend(unittest.TestCase):
+
+    def setUp(self):
+        self.sut = make_sut()
+        self.sparse_sut = make_sut()
+        self.sparse_sut.supply = sp.csr_matrix(self.sparse_sut.supply)
+        self.sparse_sut.use = sp.csc_matrix(self.sparse_sut.use)
+        self.sparse_sut.extensions = sp.csr_matrix(self.sparse_sut.extensions)
+
+    def test_model_b(self):
+        dense = mb.TransformationModelB(self.sut, False)
+        sparse = mb.TransformationModelB(self.sparse_sut, False)
+        self.assertTrue(sp.issparse(sparse.io_coefficient_matrix()))
+        self.assertTrue(sp.issparse(sparse.ext_coefficients_matrix()))
+        for method in ['io_coefficient_matrix', 'ext_coefficients_matrix',
+                       'factor_inputs_coefficients_matrix',
+                       'io_total_requirement_matrix']:
+            np.testing.assert_allclose(
+                tl.to_dense(getattr(sparse, method)()),
+                getattr(dense, method)())
+        self.assertTrue(sparse.check_io_coefficients_matrix())
+        self.assertTrue(sparse.check_ext_coefficient_matrix())
+
+    def test_allocate_sec_mat(self):
+        prod_or = np.array([0, 3])
+        ind_or = np.array([0, 2])
+        dense = sf.allocate_sec_mat(self.sut.supply, self.sut.use,
+                                    self.sut.final_use, prod_or, ind_or)
+        sparse = sf.allocate_sec_mat(self.sparse_sut.supply,
+                                     self.sparse_sut.use,
+                                     self.sparse_sut.final_use, prod_or,
+                                     ind_or)
+        self.assertEqual(sparse['V'].format, 'csr')
+        self.assertEqual(sparse['U'].format, 'csc')
+        for name in ['V', 'U', 'Y']:
+            np.testing.assert_array_equal(tl.to_dense(sparse[name]),
+                                          dense[name])
+        # the input tables are left untouched
+        np.testing.assert_array_equal(self.sparse_sut.supply.toarray(),
+                                      self.sut.supply)
+
+
+class TestSecondaryFlows(unittest.TestCase):
+
+    def setUp(self):
+        self.sut = make_sut(prd_cnt=8, ind_cnt=6)
+
+    def test_in_place(self):
+        V, U, Y = self.sut.supply.copy(), self.sut.use.copy(), \
+            self.sut.final_use.copy()
+        copied = sf.allocate_sec_mat(V, U, Y, [0, 4], [0, 3])
+        np.testing.assert_array_equal(V, self.sut.supply)
+        moved = sf.allocate_sec_mat(V, U, Y, [0, 4], [0, 3], in_place=True)
+        self.assertIs(moved['U'], U)
+        for name in ['V', 'U', 'Y']:
+            np.testing.assert_array_equal(moved[name], copied[name])
+        # the use of the primary products is split over both products
+        np.testing.assert_allclose(moved['U'][[0, 4]] + moved['U'][[1, 5]],
+                                   self.sut.use[[0, 4]])
+
+    def test_pair_coordinates(self):
+        pairs = (sf.SecondaryPair(0, 2, 1, 3),)
+        dimensions = dm.Dimensions(2, 4, 5, 1)
+        coordinates = sf.pair_coordinates(pairs, dimensions)
+        self.assertIs(sf.pair_coordinates(pairs, dimensions), coordinates)
+        np.testing.assert_array_equal(coordinates.secondary_product, [2, 6])
+        np.testing.assert_array_equal(coordinates.primary_industry, [1, 6])
+        self.assertFalse(coordinates.primary_product.flags.writeable)
+
+    def test_label_coordinates(self):
+        products = [[country, 'p', code] for country in ['NL', 'DE']
+                    for code in ['C_A', 'C_AW']]
+        industries = [[country, code] for country in ['NL', 'DE']
+                      for code in ['A_A', 'A_AW', 'A_B']]
+        pairs = (sf.SecondaryPair('C_A', 'C_AW', 'A_A', 'A_AW'),)
+        coordinates = sf.label_coordinates(pairs, lb.LabelIndex(products),
+                                           lb.LabelIndex(industries))
+        np.testing.assert_array_equal(coordinates.secondary_product, [1, 3])
+        np.testing.assert_array_equal(coordinates.secondary_industry, [1, 4])
+        self.assertIsNone(sf.label_coordinates(
+            (sf.SecondaryPair('C_X', 'C_AW', 'A_A', 'A_AW'),),
+            lb.LabelIndex(products), lb.LabelIndex(industries)))
+
+
+class TestMemoryMappedInputs(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.sut = make_sut()
+        self.arrays = {}
+        for name in ['supply', 'use', 'final_use']:
+            full_fn = os.path.join(self.tmp.name, name + '.npy')
+            np.save(full_fn, getattr(self.sut, name))
+            self.arrays[name] = np.load(full_fn, mmap_mode='c')
+
+    def test_allocate_sec_mat_copy_on_write(self):
+        prod_or = np.array([0, 3])
+        ind_or = np.array([0, 2])
+        dense = sf.allocate_sec_mat(self.sut.supply, self.sut.use,
+                                    self.sut.final_use, prod_or, ind_or)
+        mapped = sf.allocate_sec_mat(self.arrays['supply'], self.arrays['use'],
+                                     self.arrays['final_use'], prod_or, ind_or)
+        self.assertIs(mapped['V'], self.arrays['supply'])
+        for name in ['V', 'U', 'Y']:
+            np.testing.assert_array_equal(mapped[name], dense[name])
+        # the files are not changed
+        np.testing.assert_array_equal(
+            np.load(os.path.join(self.tmp.name, 'supply.npy')),
+            self.sut.supply)
+
+
+class TestWriter(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.filename = os.path.join(self.tmp.name, 'L.npy')
+
+    def test_save_row_blocks(self):
+        rng = np.random.RandomState(4)
+        A = rng.uniform(0, 0.1, (7, 7))
+        for solver in [lt.make_solver(A),
+                       lt.make_solver(A, 'power', tol=1E-12)]:
+            wr.save_row_blocks(self.filename, (7, 7), solver.inverse_rows,
+                               block_rows=3)
+            np.testing.assert_allclose(np.load(self.filename),
+                                       np.linalg.inv(np.identity(7) - A))
+        self.assertEqual(os.listdir(self.tmp.name), ['L.npy'])
+
+    def test_abort(self):
+        with self.assertRaises(ZeroDivisionError):
+            with wr.NpyWriter(self.filename, (2, 2)) as writer:
+                writer[0] = 1
+                1 / 0
+        self.assertEqual(os.listdir(self.tmp.name), [])
+
+    def test_save_sparse(self):
+        wr.save(self.filename, sp.identity(3, format='csr'))
+        np.testing.assert_array_equal(np.load(self.filename), np.identity(3))
+
+
+def add_raw_labels(sut):
+    """Adds the labels of raw EXIOBASE text files to a Sut of one
+    country."""
+    prd_cnt, ind_cnt = sut.supply.shape
+    sut.product_categories = [['NL', 'product {}'.format(i), 'C_{}'.format(i)]
+                              for i in range(prd_cnt)]
+    sut.industry_categories = [['NL', 'industry {}'.format(i)]
+                               for i in range(ind_cnt)]
+    sut.finaluse_categories = [['NL', 'final use {}'.format(i)]
+                               for i in range(sut.final_use.shape[1])]
+    sut.factor_input_categories = [['factor input {}'.format(i), 'M.EUR']
+                                   for i in range(len(sut.factor_inputs))]
+    return sut
+
+
+class TestBenchmark(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+
+    def test_synthetic_sut(self):
+        sut = bm.synthetic_sut(*bm.sizes['toy'])
+        model = mb.TransformationModelB(sut, False)
+        self.assertTrue(model.check_io_transaction_matrix())
+        self.assertTrue(bl.BalanceReport(
+            'industries', np.sum(sut.supply, axis=0),
+            np.sum(sut.use, axis=0) + np.sum(sut.value_added, axis=0),
+            rel_tol=1E-9))
+        self.assertEqual(sut.product_index.index('R01', 'C_WOOW'), 31)
+        # the secondary materials are only split off by make_secondary
+        self.assertEqual(np.sum(sut.supply[31]), 0)
+        sf.make_secondary(sut)
+        self.assertGreater(np.sum(sut.supply[31]), 0)
+        self.assertTrue(bl.BalanceReport(
+            'products', np.sum(sut.supply, axis=1),
+            np.sum(sut.use, axis=1) + np.sum(sut.final_use, axis=1),
+            rel_tol=1E-9))
+
+    def test_run_and_compare(self):
+        indicators = os.path.join(self.tmp.name, 'indicators_v3.txt')
+        shutil.copyfile(bm.default_indicators, indicators)
+        results = bm.run_benchmark('toy', self.tmp.name,
+                                   indicators_filename=indicators)
+        self.assertEqual([r.stage for r in results], bm.stages)
+        self.assertTrue(all(r.status == 'done' for r in results))
+        self.assertTrue(all(r.seconds >= 0 for r in results))
+        self.assertTrue(os.path.exists(os.path.join(self.tmp.name,
+                                                    'B_v4.npy')))
+        # tables without the EXIOBASE extensions skip make_ramascene_data
+        skipped = bm.run_benchmark((2, 30, 25, 7, 12), self.tmp.name,
+                                   ['ramascene'],
+                                   indicators_filename=indicators)
+        self.assertEqual([r.status for r in skipped], ['skipped'])
+
+        filename = os.path.join(self.tmp.name, 'baseline.json')
+        bm.save_baseline(filename, results, 'toy')
+        baseline = bm.load_baseline(filename)
+        self.assertEqual(bm.compare(results, baseline), [])
+        slower = [results[0]._replace(seconds=results[0].seconds + 1)]
+        regressions = bm.compare(slower, baseline)
+        self.assertEqual([(r.stage, r.metric) for r in regressions],
+                         [('parse', 'seconds')])
+
+
+class TestTableReader(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.filename = os.path.join(self.tmp.name, 'mrSupply.txt')
+        rng = np.random.RandomState(5)
+        self.values = rng.uniform(-1E6, 1E6, (7, 4))
+        with open(self.filename, 'w') as table:
+            table.write('\t\t\tAT\tAT\tBE\tBE\n')
+            table.write('region\tname\tcode\tind 1\tind #2\tind 1\tind #2\n')
+            for idx, row in enumerate(self.values):
+                fields = ['AT', 'product #{}'.format(idx), 'C_{}'.format(idx)]
+                fields += [repr(float(value)) for value in row]
+                table.write('\t'.join(fields) + '\n')
+            table.write('\n')
+
+    def test_read_table(self):
+        data = tl.csv_file_to_list(self.filename, delimiter='\t')[:-1]
+        values, row_headers, column_headers = tr.read_table(
+            self.filename, 3, 2, block_rows=3)
+        np.testing.assert_array_equal(values,
+                                      tl.list_to_numpy_array(data, 3, 2))
+        self.assertEqual(row_headers, tl.get_row_header(data, 3, 2))
+        self.assertEqual(column_headers, tl.get_column_header(data, 3, 2))
+
+    def test_table_shape(self):
+        self.assertEqual(tr.table_shape(self.filename, 3, 2), (8, 4))
+
+    def test_iter_blocks(self):
+        blocks = list(tr.iter_blocks(self.filename, 3, 2, block_rows=5))
+        self.assertEqual([len(values) for _, values in blocks], [5, 2])
+
+    def test_out(self):
+        out = np.lib.format.open_memmap(os.path.join(self.tmp.name, 'V.npy'),
+                                        mode='w+', shape=(7, 4))
+        values, _, _ = tr.read_table(self.filename, 3, 2, out=out)
+        np.testing.assert_array_equal(out, self.values)
+
+
+class TestReadMsutExiobase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.raw_data_dir = os.path.join(self.tmp.name, 'raw')
+        self.clean_data_dir = os.path.join(self.tmp.name, 'clean')
+        self.suts = {'2005': make_sut(seed=5), '2006': make_sut(seed=6)}
+        for yr_string, sut in self.suts.items():
+            bm.write_raw_year(self.raw_data_dir, yr_string,
+                              add_raw_labels(sut))
+
+    def test_main(self):
+        rd.main(self.raw_data_dir, self.clean_data_dir, [2005, 2006],
+                max_workers=2)
+        for yr_string, sut in self.suts.items():
+            year_dir = os.path.join(self.clean_data_dir, yr_string)
+            np.testing.assert_array_equal(
+                np.load(os.path.join(year_dir, 'V.npy')), sut.supply)
+            np.testing.assert_array_equal(
+                np.load(os.path.join(year_dir, 'M.npy')), sut.extensions)
+            products = tl.pickle_file_to_list(
+                os.path.join(year_dir, 'products.pck'))
+            self.assertEqual(products[1], ['NL', 'product 1', 'C_1'])
+            unbalances = tl.csv_file_to_list(
+                os.path.join(year_dir, 'prd_unbalances.txt'), delimiter='\t')
+            self.assertEqual(len(unbalances), 1)
+
+    def test_main_bundle(self):
+        with self.assertLogs(ins.logger, 'INFO') as logs:
+            rd.main(self.raw_data_dir, self.clean_data_dir, [2005],
+                    max_workers=1, output_format='bundle')
+        self.assertIn('year 2005', logs.output[0])
+        year_dir = os.path.join(self.clean_data_dir, '2005')
+        self.assertFalse(os.path.exists(os.path.join(year_dir, 'V.npy')))
+        with bd.Bundle(os.path.join(year_dir, bd.bundle_filename)) as bundle:
+            self.assertEqual(bundle.metadata,
+                             {'year': 2005, 'dimensions': [1, 6, 5, 2]})
+            np.testing.assert_array_equal(bundle.read('V'),
+                                          self.suts['2005'].supply)
+            np.testing.assert_array_equal(bundle.read('M'),
+                                          self.suts['2005'].extensions)
+            self.assertEqual(bundle.labels('products')[1],
+                             ['NL', 'product 1', 'C_1'])
+            # materials have no compartment, it is padded
+            self.assertEqual(
+                [bundle.labels('extensions')[idx] for idx in (0, 2)],
+                [['Emissions 0', 'kg', 'air'], ['Materials 1', 'kg', '']])
+
+
+class TestBundle(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.filename = os.path.join(self.tmp.name, bd.bundle_filename)
+        rng = np.random.default_rng(0)
+        self.arrays = {'V': rng.random((10, 4)), 'Y': rng.random((10, 2))}
+        self.labels = {'products': [['NL', 'p{}'.format(idx % 5), 'C']
+                                    for idx in range(10)]}
+
+    def test_round_trip(self):
+        for compress in (False, True):
+            bd.write_bundle(self.filename, self.arrays, self.labels,
+                            {'year': 2011}, compress, chunk_rows=3)
+            with bd.Bundle(self.filename) as bundle:
+                self.assertEqual(sorted(bundle.array_names), ['V', 'Y'])
+                self.assertEqual(bundle.metadata['year'], 2011)
+                self.assertEqual(bundle.shape('V'), (10, 4))
+                for name, array in self.arrays.items():
+                    np.testing.assert_array_equal(bundle.read(name), array)
+                # rows spanning several blocks
+                np.testing.assert_array_equal(bundle.read('V', 2, 8),
+                                              self.arrays['V'][2:8])
+                self.assertEqual(bundle.labels('products'),
+                                 self.labels['products'])
+                categories, codes = bundle.label_columns('products')[1]
+                self.assertEqual(len(categories), 5)
+
+    def test_memory_map(self):
+        bd.write_bundle(self.filename, self.arrays, chunk_rows=3)
+        with bd.Bundle(self.filename) as bundle:
+            rows = bundle.read('V', 4, 7, mmap_mode='r')
+            self.assertIsInstance(rows, np.memmap)
+            np.testing.assert_array_equal(rows, self.arrays['V'][4:7])
+
+    def test_not_a_bundle(self):
+        with open(self.filename, 'wb') as other:
+            other.write(b'\0' * 64)
+        self.assertRaises(ValueError, bd.Bundle, self.filename)
+
+    def test_sut_bundle(self):
+        sut = make_sut()
+        sut.year = 2011
+        sut.product_categories = self.labels['products'][:6]
+        sut.save_bundle(self.filename)
+        loaded = st.Sut.open_bundle(self.filename)
+        self.assertEqual(loaded.year, 2011)
+        self.assertEqual(loaded.dimensions, sut.dimensions)
+        self.assertEqual(loaded.product_categories, sut.product_categories)
+        np.testing.assert_array_equal(loaded.bundle.read('U', 0, 3),
+                                      sut.use[0:3])
+        # the Sut keeps no file handle open between reads
+        if os.path.isdir('/proc/self/fd'):
+            open_files = [os.path.realpath(os.path.join('/proc/self/fd', fd))
+                          for fd in os.listdir('/proc/self/fd')]
+            self.assertNotIn(os.path.realpath(self.filename), open_files)
+
+    def test_ragged_labels(self):
+        labels = {'products': [['NL', 'p0', 'C'], ['NL', 'p1']]}
+        with self.assertRaises(ValueError):
+            bd.write_bundle(self.filename, self.arrays, labels)
+        self.assertEqual(os.listdir(self.tmp.name), [])
+
+
+class TestBatch(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.done = os.path.join(self.tmp.name, 'out', '2005')
+        os.makedirs(self.done)
+        for filename in ['A.npy', 'L.npy', 'Y.npy', 'B.npy', 'W.npy']:
+            np.save(os.path.join(self.done, filename), np.ones((2, 2)))
+
+    def test_outputs_valid(self):
+        filenames = ['A.npy', 'L.npy']
+        self.assertTrue(bt.outputs_valid(self.done, filenames))
+        self.assertFalse(bt.outputs_valid(self.done, filenames + ['X.npy']))
+        # truncated file
+        full_fn = os.path.join(self.done, 'L.npy')
+        with open(full_fn, 'r+b') as npy:
+            npy.truncate(os.path.getsize(full_fn) - 8)
+        self.assertFalse(bt.outputs_valid(self.done, filenames))
+
+    def test_worker_count(self):
+        jobs = [bt.YearJob(str(yr), self.tmp.name, self.tmp.name)
+                for yr in range(3)]
+        self.assertEqual(bt.worker_count(jobs, 8, memory_per_year=1), 3)
+        self.assertEqual(bt.worker_count(jobs, 2, memory_per_year=1), 2)
+        self.assertEqual(bt.worker_count(jobs, 8, memory_per_year=2 ** 60), 1)
+
+    def test_run_years(self):
+        jobs = [bt.YearJob('2005', self.tmp.name, self.done),
+                bt.YearJob('2006', os.path.join(self.tmp.name, 'missing'),
+                           os.path.join(self.tmp.name, 'out', '2006'))]
+        results = bt.run_years(jobs, 'b', False, resume=True)
+        self.assertEqual([r.status for r in results], ['skipped', 'failed'])
+        self.assertIn('No such file', results[1].message)
+
+    def test_broken_pool(self):
+        class BrokenExecutor:
+            # every year fails as when a worker is killed
+            def __init__(self, *args, **kwargs):
+                pass
+
+            def __enter__(self):
+                return self
+
+            def __exit__(self, *exc_info):
+                return False
+
+            def submit(self, *args):
+                future = concurrent.futures.Future()
+                future.set_exception(
+                    concurrent.futures.process.BrokenProcessPool('killed'))
+                return future
+
+        jobs = [bt.YearJob(yr_string, self.tmp.name,
+                           os.path.join(self.tmp.name, 'out', yr_string))
+                for yr_string in ['2006', '2007']]
+        with mock.patch.object(concurrent.futures, 'ProcessPoolExecutor',
+                               BrokenExecutor):
+            results = bt.run_years(jobs, 'b', False, max_workers=2,
+                                   memory_per_year=1)
+        self.assertEqual([r.status for r in results], ['failed', 'failed'])
+        self.assertIn('BrokenProcessPool', results[0].message)
+        self.assertIn('2007', bt.format_summary(results))
+
+    def test_blas_threads_limit(self):
+        previous = os.environ.get('OMP_NUM_THREADS')
+        with bt.blas_threads_limit(3):
+            self.assertEqual(os.environ['OMP_NUM_THREADS'], '3')
+        self.assertEqual(os.environ.get('OMP_NUM_THREADS'), previous)
+
+
+class TestInstrumentation(unittest.TestCase):
+
+    def test_nested_stages(self):
+        tracer = ins.Tracer(trace_memory=True)
+        with ins.use(tracer):
+            with ins.stage('outer', year='2011'):
+                with ins.stage('inner') as record:
+                    array = np.ones((1000, 100))
+                    record.add_array('ones', array)
+                del array
+        inner, outer = tracer.records
+        self.assertEqual((inner.name, inner.depth), ('inner', 1))
+        self.assertEqual((outer.name, outer.depth), ('outer', 0))
+        self.assertEqual(outer.info, {'year': '2011'})
+        self.assertEqual(inner.arrays, [{'name': 'ones', 'shape': [1000, 100],
+                                         'bytes': 800000}])
+        self.assertGreaterEqual(inner.peak_bytes, 800000)
+        self.assertGreaterEqual(outer.peak_bytes, inner.peak_bytes)
+        self.assertGreaterEqual(outer.wall, inner.wall)
+
+    def test_hooks(self):
+        names = []
+        tracer = ins.Tracer(hooks=[lambda record: names.append(record.name)],
+                            keep_records=False)
+        with ins.use(tracer):
+            model = mb.TransformationModelB(make_sut(), False)
+            model.io_total_requirement_matrix()
+        self.assertIn('A', names)
+        self.assertIn('L', names)
+        self.assertEqual(tracer.records, [])
+
+    def test_export(self):
+        tracer = ins.Tracer()
+        with ins.use(tracer):
+            model = mb.TransformationModelB(make_sut(), False)
+            model.io_coefficient_matrix()
+        with tempfile.TemporaryDirectory() as tmp:
+            filename = os.path.join(tmp, 'trace.json')
+            tracer.export(filename)
+            with open(filename) as trace_file:
+                events = json.load(trace_file)['traceEvents']
+        event = [event for event in events
+                 if event['name'] == 'A'][0]
+        self.assertEqual(event['ph'], 'X')
+        self.assertEqual(event['args']['arrays'][0]['shape'], [6, 6])
+
+
+class TestCli(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+
+    def test_parse_years(self):
+        self.assertEqual(cli.parse_years('2005-2007'),
+                         ['2005', '2006', '2007'])
+        self.assertEqual(cli.parse_years('2011'), ['2011'])
+        with self.assertRaises(Exception):
+            cli.parse_years('2008-2005')
+
+    def test_lazy_import(self):
+        # the package and the command line do not load the pipeline
+        code = ('import sys, pySUTtoIO.cli; '
+                'print(sorted(name for name in ("numpy", "pySUTtoIO.main")'
+                ' if name in sys.modules))')
+        output = subprocess.check_output([sys.executable, '-c', code],
+                                         universal_newlines=True)
+        self.assertEqual(output.strip(), '[]')
+        import pySUTtoIO
+        self.assertIs(pySUTtoIO.main, mn)
+
+    def test_transform(self):
+        sut_dir = os.path.join(self.tmp.name, 'clean')
+        for yr_string in ['2005', '2006']:
+            os.makedirs(os.path.join(sut_dir, yr_string))
+            make_sut().save_bundle(os.path.join(sut_dir, yr_string,
+                                                bd.bundle_filename))
+        save_dir = os.path.join(self.tmp.name, 'out')
+        status = cli.main(['transform', sut_dir, save_dir, '--years', '2006',
+                           '--cache-dir', os.path.join(self.tmp.name,
+                                                       'cache')])
+        self.assertEqual(status, 0)
+        self.assertEqual(os.listdir(save_dir), ['2006'])
+        self.assertTrue(bt.outputs_valid(os.path.join(save_dir, '2006'),
+                                         mn.output_filenames[0]))